@@ -1,11 +1,13 @@
 from __future__ import annotations
 
 import os
+from collections.abc import Hashable, Iterator
 from contextlib import contextmanager
 from copy import copy
 from typing import TYPE_CHECKING, Any, Union
 from unittest.mock import patch
 
+import numpy as np
 import torch
 from PIL import Image
 from typing_extensions import Protocol
@@ -68,5 +70,66 @@ def copy_extra_params(extra_params: dict[str, Any]) -> dict[str, Any]:
     return {k: v for k, v in extra_params.items() if not callable(v)}
 
 
+def samples_to_pil(samples: list[torch.Tensor]) -> list[Image.Image]:
+    """
+    Convert decoded samples (C, H, W, range 0~1) to PIL images the same way
+    webui does before calling `postprocess_image`.
+    """
+    images = []
+    for sample in samples:
+        arr = 255.0 * np.moveaxis(sample.cpu().numpy(), 0, 2)
+        images.append(Image.fromarray(arr.astype(np.uint8)))
+    return images
+
+
+class ConditioningCache:
+    """
+    Prompt conditioning caches shared by the img2img processings of one
+    `postprocess_image` call.
+
+    Each distinct prompt gets its own `[params, conds]` list, which is
+    assigned to `cached_c`/`cached_uc` of every processing that uses the prompt.
+    The webui still compares its own cache params (prompt, steps, clip skip,
+    model, extra networks...) before it reuses the conditioning.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._slots: dict[Hashable, list[Any]] = {}
+
+    def slot(self, key: Hashable) -> list[Any]:
+        if key not in self._slots:
+            self._slots[key] = [None, None]
+        return self._slots[key]
+
+    def assign(self, p: PT, *extra: Hashable) -> None:
+        "Give `p` the cache slots of its prompts. `extra` is added to the keys."
+        prompt = tuple(p.prompt) if isinstance(p.prompt, list) else p.prompt
+        negative = p.negative_prompt
+        if isinstance(negative, list):
+            negative = tuple(negative)
+        p.cached_c = self.slot(("c", prompt, *extra))
+        p.cached_uc = self.slot(("uc", negative, *extra))
+
+    @contextmanager
+    def track(self, p: PT) -> Iterator[None]:
+        "Count the cache hits and misses of the processing run inside the block."
+        slots = [p.cached_c, p.cached_uc]
+        before = [slot[0] for slot in slots]
+        try:
+            yield
+        finally:
+            for slot, params in zip(slots, before):
+                if params is not None and slot[0] is params:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+
 class PPImage(Protocol):
     image: Image.Image
+
+
+class PPBatchList(Protocol):
+    images: list[torch.Tensor]
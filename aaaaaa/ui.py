@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from collections.abc import Callable
 from dataclasses import dataclass
 from functools import partial
 from itertools import chain
@@ -61,6 +62,7 @@ class WebuiInfo:
     i2i_button: gr.Button
     checkpoints_list: list[str]
     vae_list: list[str]
+    rescan_models: Callable[[], list[str]] | None = None
 
 
 def gr_interactive(value: bool = True):
@@ -100,6 +102,23 @@ def on_ad_model_update(model: str):
     return gr.update(visible=False, placeholder="")
 
 
+def model_choices(models: list[str], n: int) -> list[str]:
+    return [*models, "None"] if n == 0 else ["None", *models]
+
+
+def on_ad_model_rescan(
+    *models: str, rescan_models: Callable[[], list[str]]
+) -> list[dict[str, Any]]:
+    "Scan once and update the model dropdowns of every tab."
+    found = rescan_models()
+    updates = []
+    for n, model in enumerate(models):
+        choices = model_choices(found, n)
+        value = model if model in choices else choices[0]
+        updates.append(gr.update(choices=choices, value=value))
+    return updates
+
+
 def on_cn_model_update(cn_model_name: str):
     cn_model_name = cn_model_name.replace("inpaint_depth", "depth")
     for t in cn_module_choices:
@@ -126,6 +145,7 @@ def adui(
 ):
     states = []
     infotext_fields = []
+    tabs = []
     eid = partial(elem_id, n=0, is_img2img=is_img2img)
 
     with InputAccordion(
@@ -155,7 +175,7 @@ def adui(
         with gr.Group(), gr.Tabs():
             for n in range(num_models):
                 with gr.Tab(ordinal(n + 1)):
-                    state, infofields = one_ui_group(
+                    state, infofields, w = one_ui_group(
                         n=n,
                         is_img2img=is_img2img,
                         webui_info=webui_info,
@@ -163,6 +183,18 @@ def adui(
 
                 states.append(state)
                 infotext_fields.extend(infofields)
+                tabs.append(w)
+
+        if webui_info.rescan_models is not None:
+            # a rescan from any tab updates the dropdowns of all of them
+            dropdowns = [w.ad_model for w in tabs]
+            on_rescan = partial(
+                on_ad_model_rescan, rescan_models=webui_info.rescan_models
+            )
+            for w in tabs:
+                w.ad_model_rescan.click(
+                    on_rescan, inputs=dropdowns, outputs=dropdowns, queue=False
+                )
 
     # components: [bool, bool, dict, dict, ...]
     components = [ad_enable, ad_skip_img2img, *states]
@@ -173,11 +205,7 @@ def one_ui_group(n: int, is_img2img: bool, webui_info: WebuiInfo):
     w = Widgets()
     eid = partial(elem_id, n=n, is_img2img=is_img2img)
 
-    model_choices = (
-        [*webui_info.ad_model_list, "None"]
-        if n == 0
-        else ["None", *webui_info.ad_model_list]
-    )
+    choices = model_choices(webui_info.ad_model_list, n)
 
     with gr.Group():
         with gr.Row(variant="compact"):
@@ -191,14 +219,23 @@ def one_ui_group(n: int, is_img2img: bool, webui_info: WebuiInfo):
         with gr.Row():
             w.ad_model = gr.Dropdown(
                 label="ADetailer detector" + suffix(n),
-                choices=model_choices,
-                value=model_choices[0],
+                choices=choices,
+                value=choices[0],
                 visible=True,
                 type="value",
                 elem_id=eid("ad_model"),
                 info="Select a model to use for detection.",
             )
 
+            if webui_info.rescan_models is not None:
+                w.ad_model_rescan = gr.Button(
+                    "\U0001f504",
+                    elem_id=eid("ad_model_rescan"),
+                    elem_classes=["tool"],
+                    scale=0,
+                    min_width=40,
+                )
+
         with gr.Row():
             w.ad_model_classes = gr.Textbox(
                 label="ADetailer detector classes" + suffix(n),
@@ -287,7 +324,7 @@ def one_ui_group(n: int, is_img2img: bool, webui_info: WebuiInfo):
 
     infotext_fields = [(getattr(w, attr), name + suffix(n)) for attr, name in ALL_ARGS]
 
-    return state, infotext_fields
+    return state, infotext_fields, w
 
 
 def detection(w: Widgets, n: int, is_img2img: bool):
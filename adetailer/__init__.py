@@ -1,11 +1,38 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
 from .__version__ import __version__
 from .args import ALL_ARGS, ADetailerArgs
 from .common import PredictOutput, get_models
-from .mediapipe import mediapipe_predict
-from .ultralytics import ultralytics_predict
+
+if TYPE_CHECKING:
+    from .mediapipe import mediapipe_predict
+    from .ultralytics import ultralytics_predict, ultralytics_predict_batch
 
 ADETAILER = "ADetailer"
 
+# The detectors pull in cv2, torch, mediapipe and ultralytics,
+# so they are imported on first use instead of with the package.
+_LAZY_ATTRS = {
+    "mediapipe_predict": ".mediapipe",
+    "ultralytics_predict": ".ultralytics",
+    "ultralytics_predict_batch": ".ultralytics",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_ATTRS:
+        msg = f"module {__name__!r} has no attribute {name!r}"
+        raise AttributeError(msg)
+
+    from importlib import import_module
+
+    value = getattr(import_module(_LAZY_ATTRS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
 __all__ = [
     "ADETAILER",
     "ALL_ARGS",
@@ -15,4 +42,5 @@ __all__ = [
     "get_models",
     "mediapipe_predict",
     "ultralytics_predict",
+    "ultralytics_predict_batch",
 ]
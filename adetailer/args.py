@@ -217,6 +217,54 @@ class ADetailerArgs(BaseModel, extra=Extra.forbid):
         return self.ad_model == "None" or self.ad_tab_enable is False
 
 
+class DetectArgs(BaseModel, extra=Extra.forbid):
+    "Detection and mask options of `ADetailerArgs`, for detection without inpainting."
+
+    ad_model: str
+    ad_model_classes: str = ""
+    ad_confidence: confloat(ge=0.0, le=1.0) = 0.3
+    ad_mask_filter_method: Literal["Area", "Confidence"] = "Area"
+    ad_mask_k: NonNegativeInt = 0
+    ad_mask_min_ratio: confloat(ge=0.0, le=1.0) = 0.0
+    ad_mask_max_ratio: confloat(ge=0.0, le=1.0) = 1.0
+    ad_dilate_erode: int = 4
+    ad_x_offset: int = 0
+    ad_y_offset: int = 0
+    ad_mask_merge_invert: Literal["None", "Merge", "Merge and Invert"] = "None"
+    ad_bbox_sortby: str = "None"
+
+    @validator("ad_bbox_sortby")
+    def bbox_sortby_validator(cls, v: str):  # noqa: N805
+        if v not in BBOX_SORTBY:
+            msg = f"must be one of {BBOX_SORTBY!r}"
+            raise ValueError(msg)
+        return v
+
+    def is_mediapipe(self) -> bool:
+        return self.ad_model.lower().startswith("mediapipe")
+
+    def bbox_sort_order(self) -> int:
+        return BBOX_SORTBY.index(self.ad_bbox_sortby)
+
+
+class DetectRequest(DetectArgs):
+    "Body of the `/adetailer/v1/detect` endpoint."
+
+    # base64 encoded images, optionally as data urls
+    images: list[str]
+    mask_format: Literal["rle", "png", "none"] = "rle"
+
+
+class WarmupRequest(BaseModel, extra=Extra.forbid):
+    "Body of the `/adetailer/v1/warmup` endpoint."
+
+    # empty: the models of the preload option
+    models: list[str] = []
+    size: conint(ge=64, le=4096) = 1024
+    # ad_model_classes of the YOLO-World models, empty: the preload option's
+    classes: str = ""
+
+
 _all_args = [
     ("ad_model", "ADetailer model"),
     ("ad_model_classes", "ADetailer model classes"),
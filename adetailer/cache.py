@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Generic, Optional, TypeVar
+
+from rich import print  # noqa: A004  Shadowing built-in 'print'
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    A thread-safe LRU cache bounded by the number of entries and,
+    optionally, by the total size of the cached values in bytes.
+
+    Parameters
+    ----------
+        max_entries: int
+            maximum number of entries. 0 disables caching.
+        max_bytes: int
+            maximum total size of the cached values. 0 means no limit.
+        sizeof: Callable[[V], int] | None
+            function that returns the size of a value in bytes.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2,
+        max_bytes: int = 0,
+        sizeof: Optional[Callable[[V], int]] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, tuple[V, int]] = OrderedDict()
+        self._lock = threading.RLock()
+        # key: [lock, number of callers using or waiting for the key]
+        self._key_locks: dict[K, list[Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._data
+
+    @property
+    def nbytes(self) -> int:
+        return sum(size for _, size in self._data.values())
+
+    def get(self, key: K, factory: Callable[[], V]) -> V:
+        """
+        Return the cached value for `key`, creating it with `factory` on a miss.
+
+        `factory` runs under the lock of `key` only: a slow creation doesn't
+        block the other keys, and concurrent misses of `key` create it once.
+        """
+        with self._lock:
+            if key in self._data:
+                return self._hit(key)
+
+        with self._key_lock(key):
+            with self._lock:
+                if key in self._data:
+                    return self._hit(key)
+                self.misses += 1
+
+            value = factory()
+            if self.max_entries <= 0:
+                return value
+
+            size = self.sizeof(value) if self.sizeof is not None else 0
+            with self._lock:
+                self._data[key] = (value, size)
+                self._shrink()
+            return value
+
+    @contextmanager
+    def use(self, key: K, factory: Callable[[], V]) -> Iterator[V]:
+        """
+        Same as `get`, but the value is used by one caller at a time: the lock
+        of `key` is held until the end of the `with` block. For cached values
+        that are not thread-safe.
+        """
+        with self._key_lock(key):
+            yield self.get(key, factory)
+
+    def _hit(self, key: K) -> V:
+        self.hits += 1
+        self._data.move_to_end(key)
+        return self._data[key][0]
+
+    @contextmanager
+    def _key_lock(self, key: K) -> Iterator[None]:
+        with self._lock:
+            entry = self._key_locks.get(key)
+            if entry is None:
+                # reentrant, `use` holds it while `get` takes it again
+                entry = self._key_locks[key] = [threading.RLock(), 0]
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[key]
+
+    def configure(
+        self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None
+    ) -> None:
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._shrink()
+
+    def evict(self, predicate: Callable[[K], bool]) -> list[K]:
+        "Remove every entry whose key matches `predicate`. Returns the removed keys."
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return keys
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def _shrink(self) -> None:
+        while len(self._data) > max(self.max_entries, 0):
+            self._data.popitem(last=False)
+
+        # always keep the most recently used entry, even if it alone exceeds the budget
+        while (
+            self.max_bytes > 0 and len(self._data) > 1 and self.nbytes > self.max_bytes
+        ):
+            self._data.popitem(last=False)
+
+
+class ObjectPool(Generic[K, V]):
+    """
+    A thread-safe pool of reusable objects grouped by key.
+
+    An object is handed to one caller at a time by `acquire` and put back
+    when the caller is done with it, so objects that are not thread-safe
+    can be shared by multiple worker threads.
+
+    Parameters
+    ----------
+        max_idle: int
+            maximum number of idle objects kept per key. 0 disables pooling.
+        max_keys: int
+            maximum number of keys. The idle objects of the least recently
+            used key are closed when a new key exceeds the limit.
+        close: Callable[[V], Any] | None
+            function called on an object that is dropped from the pool.
+    """
+
+    def __init__(
+        self,
+        max_idle: int = 2,
+        max_keys: int = 4,
+        close: Optional[Callable[[V], Any]] = None,
+    ):
+        self.max_idle = max_idle
+        self.max_keys = max_keys
+        self.close = close
+        self.created = 0
+        self.reused = 0
+        self._idle: OrderedDict[K, list[V]] = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        "Number of idle objects."
+        return sum(len(objs) for objs in self._idle.values())
+
+    def __contains__(self, key: K) -> bool:
+        return bool(self._idle.get(key))
+
+    @contextmanager
+    def acquire(self, key: K, factory: Callable[[], V]) -> Iterator[V]:
+        "Borrow an object for `key`, creating it with `factory` if none is idle."
+        with self._lock:
+            generation = self._generation
+            idle = self._idle.get(key)
+            obj = idle.pop() if idle else None
+            if obj is not None:
+                self.reused += 1
+
+        if obj is None:
+            obj = factory()
+            with self._lock:
+                self.created += 1
+
+        try:
+            yield obj
+        except BaseException:
+            # the object may be in a broken state
+            self._close(obj)
+            raise
+        self._release(key, obj, generation)
+
+    def evict(self, predicate: Callable[[K], bool]) -> list[K]:
+        "Close the idle objects of every key that matches `predicate`. Returns the removed keys."
+        with self._lock:
+            keys = [key for key in self._idle if predicate(key)]
+            dropped = [obj for key in keys for obj in self._idle.pop(key)]
+        for obj in dropped:
+            self._close(obj)
+        return keys
+
+    def clear(self) -> None:
+        "Close every idle object. Objects in use are closed when they are released."
+        with self._lock:
+            self._generation += 1
+            dropped = [obj for objs in self._idle.values() for obj in objs]
+            self._idle.clear()
+        for obj in dropped:
+            self._close(obj)
+
+    def _release(self, key: K, obj: V, generation: int) -> None:
+        dropped = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if generation != self._generation or len(idle) >= self.max_idle:
+                dropped.append(obj)
+            else:
+                idle.append(obj)
+
+            while len(self._idle) > max(self.max_keys, 1):
+                _, objs = self._idle.popitem(last=False)
+                dropped.extend(objs)
+            if not idle:
+                del self._idle[key]
+
+        for o in dropped:
+            self._close(o)
+
+    def _close(self, obj: V) -> None:
+        if self.close is not None:
+            self.close(obj)
+
+
+class ModelHashCache:
+    """
+    Persisted model hashes keyed by (path, size, mtime), so model files are
+    only read again when they change.
+
+    Parameters
+    ----------
+        path: str | os.PathLike[str]
+            path of the cache json file
+    """
+
+    def __init__(self, path: str | os.PathLike[str]):
+        self.path = Path(path)
+        self.hashes: dict[str, tuple[int, int, str]] = {}
+        self.changed = False
+
+    @classmethod
+    def load(cls, path: str | os.PathLike[str]) -> ModelHashCache:
+        "Read the cache at `path`. A missing or broken file gives an empty cache."
+        cache = cls(path)
+        try:
+            data = json.loads(cache.path.read_text("utf-8"))
+            cache.hashes = {key: tuple(value) for key, value in data.items()}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[-] ADetailer: Failed to read model hash cache {cache.path}: {e}")
+        return cache
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            tmp.write_text(json.dumps(self.hashes), "utf-8")
+            tmp.replace(self.path)
+        except OSError as e:
+            print(f"[-] ADetailer: Failed to write model hash cache {self.path}: {e}")
+        else:
+            self.changed = False
+
+    def get(self, path: Path, compute: Callable[[Path], str]) -> str:
+        "Hash of the file at `path`, computed with `compute` if the file changed."
+        st = path.stat()
+        key = str(path)
+        item = self.hashes.get(key)
+        if item is not None and item[:2] == (st.st_size, st.st_mtime_ns):
+            return item[2]
+
+        value = compute(path)
+        self.hashes[key] = (st.st_size, st.st_mtime_ns, value)
+        self.changed = True
+        return value
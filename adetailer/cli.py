@@ -0,0 +1,358 @@
+"""
+Detect objects and compute the ADetailer masks of every image in a directory,
+without the webui.
+
+    python -m adetailer images/ --model face_yolov8n.pt -o detections.jsonl
+
+One json line is written per image, in completion order, with the bboxes,
+confidences and the COCO RLE of the preprocessed masks. Images already in the
+output are skipped, so an interrupted run continues where it stopped; the
+images that failed are processed again and their old records replaced.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+from collections.abc import Iterable, Iterator, Sequence
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Optional
+
+from PIL import Image
+from rich import print  # noqa: A004  Shadowing built-in 'print'
+
+from adetailer.__version__ import __version__
+from adetailer.args import BBOX_SORTBY, MASK_MERGE_INVERT, DetectArgs
+from adetailer.common import DEFAULT_MODELS, hf_download
+from adetailer.detect import detect
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff")
+
+
+@dataclass(frozen=True)
+class WorkerConfig:
+    args: DetectArgs
+    model_path: str
+    root: Path
+    device: str = "cpu"
+    masks_dir: Optional[Path] = None
+    mask_format: str = "rle"
+    # torch threads of each worker, 0 keeps the default
+    threads: int = 0
+
+
+# config of a worker process, set once by `init_worker`
+_worker: dict[str, WorkerConfig] = {}
+
+
+def find_images(root: Path, exclude: Iterable[Path] = ()) -> list[Path]:
+    """
+    Images under `root`, sorted so that runs are reproducible.
+
+    Paths in `exclude`, and everything under them, are skipped, so that the
+    masks saved inside `root` are not detected on the next run.
+    """
+    excluded = [path.resolve() for path in exclude]
+    return sorted(
+        path
+        for path in root.rglob("*")
+        if path.suffix.lower() in IMAGE_SUFFIXES
+        and path.is_file()
+        and not any(path.resolve().is_relative_to(e) for e in excluded)
+    )
+
+
+def resolve_model(model: str) -> str:
+    "Path of `model`, a mediapipe model name, a file or a default model name."
+    if model.lower().startswith("mediapipe") or Path(model).is_file():
+        return model
+    if model in DEFAULT_MODELS:
+        repo_id = (
+            "Bingsu/yolo-world-mirror" if "-world" in model else "Bingsu/adetailer"
+        )
+        path = hf_download(model, repo_id=repo_id)
+        if path != "INVALID":
+            return path
+    msg = f"[-] ADetailer: Model {model!r} not found."
+    raise ValueError(msg)
+
+
+def read_done(output: Path) -> set[str]:
+    """
+    Paths of the images already processed without error in `output`.
+
+    The records of failed images are removed from `output`, as those images
+    are processed again and get a new record. So is a line cut by an
+    interruption, so that the next records start on a new line.
+    """
+    if not output.exists():
+        return set()
+
+    data = output.read_bytes()
+    done = set()
+    kept = []
+    for line in data.splitlines(keepends=True):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if line.endswith(b"\n") and "error" not in record:
+            done.add(record["path"])
+            kept.append(line)
+
+    if len(kept) < len(data.splitlines()):
+        tmp = output.with_name(output.name + ".tmp")
+        tmp.write_bytes(b"".join(kept))
+        tmp.replace(output)
+    return done
+
+
+def chunked(items: Sequence[Any], size: int) -> Iterator[list[Any]]:
+    for i in range(0, len(items), size):
+        yield list(items[i : i + size])
+
+
+def init_worker(config: WorkerConfig) -> None:
+    if config.threads > 0 and not config.args.is_mediapipe():
+        import torch
+
+        # the workers share the cores instead of each one using all of them
+        torch.set_num_threads(config.threads)
+    _worker["config"] = config
+
+
+def process_chunk(paths: list[Path]) -> list[dict[str, Any]]:
+    "Detect on `paths` with the model of the worker, in one batch."
+    config = _worker["config"]
+    records: dict[Path, dict[str, Any]] = {}
+    images = {}
+    for path in paths:
+        rel = path.relative_to(config.root).as_posix()
+        try:
+            with Image.open(path) as image:
+                images[path] = image.convert("RGB")
+        except Exception as e:
+            records[path] = {"path": rel, "error": f"{type(e).__name__}: {e}"}
+        else:
+            records[path] = {"path": rel}
+
+    try:
+        results = detect(
+            list(images.values()),
+            config.args,
+            model_path=config.model_path,
+            device=config.device,
+        )
+    except Exception as e:
+        for path in images:
+            records[path]["error"] = f"{type(e).__name__}: {e}"
+        return list(records.values())
+
+    for path, result in zip(images, results):
+        record = records[path]
+        record.update(result.to_json(config.mask_format))
+        if config.masks_dir is not None:
+            record["mask_files"] = save_masks(
+                config.masks_dir, record["path"], result.masks
+            )
+    return list(records.values())
+
+
+def save_masks(masks_dir: Path, rel: str, masks: list[Any]) -> list[str]:
+    "Save `masks` as `<masks_dir>/<rel without suffix>-<i>.png`."
+    stem = Path(rel).with_suffix("")
+    out = []
+    for i, mask in enumerate(masks):
+        name = f"{stem.as_posix()}-{i}.png"
+        path = masks_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        mask.to_pil().save(path)
+        out.append(name)
+    return out
+
+
+def run(  # noqa: PLR0913
+    root: Path,
+    output: Path,
+    args: DetectArgs,
+    *,
+    model_path: str,
+    device: str = "cpu",
+    workers: int = 1,
+    batch_size: int = 4,
+    masks_dir: Optional[Path] = None,
+    mask_format: str = "rle",
+    resume: bool = True,
+) -> tuple[int, int]:
+    """
+    Process the images under `root` that are not in `output` yet.
+
+    Returns
+    -------
+        tuple[int, int]
+            number of processed images, and of images that failed
+    """
+    if not resume and output.exists():
+        output.unlink()
+    done = read_done(output)
+    exclude = [output] if masks_dir is None else [output, masks_dir]
+    paths = [
+        path
+        for path in find_images(root, exclude)
+        if path.relative_to(root).as_posix() not in done
+    ]
+    print(f"[-] ADetailer: {len(paths)} images to process, {len(done)} already done.")
+    if not paths:
+        return 0, 0
+
+    chunks = list(chunked(paths, batch_size))
+    config = WorkerConfig(
+        args,
+        model_path,
+        root,
+        device=device,
+        masks_dir=masks_dir,
+        mask_format=mask_format,
+    )
+    processed = failed = 0
+    with output.open("a", encoding="utf-8") as f:
+        for records in _map_chunks(chunks, config, workers):
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+                processed += 1
+                if "error" in record:
+                    failed += 1
+                    print(f"[-] ADetailer: {record['path']}: {record['error']}")
+            f.flush()
+            print(f"[-] ADetailer: {processed}/{len(paths)}", end="\r", flush=True)
+    print()
+    return processed, failed
+
+
+def _map_chunks(
+    chunks: list[list[Path]], config: WorkerConfig, workers: int
+) -> Iterable[list[dict[str, Any]]]:
+    if workers <= 0:
+        # in this process, mostly for debugging
+        init_worker(config)
+        yield from map(process_chunk, chunks)
+        return
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    config = replace(config, threads=threads)
+    # spawn: a forked torch or mediapipe runtime is not safe
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(workers, init_worker, (config,)) as pool:
+        yield from pool.imap_unordered(process_chunk, chunks)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m adetailer",
+        description="Detect objects and compute ADetailer masks for a directory of images.",
+    )
+    parser.add_argument(
+        "input", type=Path, help="directory of images, searched recursively"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=Path("detections.jsonl"),
+        help="jsonl output",
+    )
+    parser.add_argument(
+        "-m", "--model", default="face_yolov8n.pt", help="model name or path"
+    )
+    parser.add_argument("--classes", default="", help="classes of yolo-world models")
+    parser.add_argument("--confidence", type=float, default=0.3)
+    parser.add_argument("--mask-k", type=int, default=0, help="0 keeps every mask")
+    parser.add_argument(
+        "--filter-method", choices=["Area", "Confidence"], default="Area"
+    )
+    parser.add_argument("--min-ratio", type=float, default=0.0)
+    parser.add_argument("--max-ratio", type=float, default=1.0)
+    parser.add_argument("--dilate-erode", type=int, default=4)
+    parser.add_argument("--x-offset", type=int, default=0)
+    parser.add_argument("--y-offset", type=int, default=0)
+    parser.add_argument("--merge-invert", choices=MASK_MERGE_INVERT, default="None")
+    parser.add_argument("--sortby", choices=BBOX_SORTBY, default="None")
+    parser.add_argument("--device", default="cpu", help="ultralytics device")
+    parser.add_argument(
+        "-j", "--workers", type=int, default=1, help="processes, 0 runs in this process"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=4, help="images per forward pass"
+    )
+    parser.add_argument("--masks-dir", type=Path, help="also save the masks as png")
+    parser.add_argument(
+        "--mask-format",
+        choices=["rle", "none"],
+        default="rle",
+        help="masks in the jsonl",
+    )
+    parser.add_argument(
+        "--overwrite", action="store_true", help="start over instead of resuming"
+    )
+    parser.add_argument("--version", action="version", version=__version__)
+    return parser
+
+
+def detect_args(ns: argparse.Namespace) -> DetectArgs:
+    return DetectArgs(
+        ad_model=ns.model,
+        ad_model_classes=ns.classes,
+        ad_confidence=ns.confidence,
+        ad_mask_filter_method=ns.filter_method,
+        ad_mask_k=ns.mask_k,
+        ad_mask_min_ratio=ns.min_ratio,
+        ad_mask_max_ratio=ns.max_ratio,
+        ad_dilate_erode=ns.dilate_erode,
+        ad_x_offset=ns.x_offset,
+        ad_y_offset=ns.y_offset,
+        ad_mask_merge_invert=ns.merge_invert,
+        ad_bbox_sortby=ns.sortby,
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = build_parser()
+    ns = parser.parse_args(argv)
+    if not ns.input.is_dir():
+        print(f"[-] ADetailer: {ns.input} is not a directory.")
+        return 2
+
+    try:
+        args = detect_args(ns)
+    except ValueError as e:
+        # pydantic's ValidationError, exits with the usage and status 2
+        parser.error(str(e))
+
+    try:
+        model_path = resolve_model(ns.model)
+    except ValueError as e:
+        print(e)
+        return 2
+
+    try:
+        processed, failed = run(
+            ns.input,
+            ns.output,
+            args,
+            model_path=model_path,
+            device=ns.device,
+            workers=ns.workers,
+            batch_size=max(ns.batch_size, 1),
+            masks_dir=ns.masks_dir,
+            mask_format=ns.mask_format,
+            resume=not ns.overwrite,
+        )
+    except KeyboardInterrupt:
+        print("\n[-] ADetailer: interrupted, run the same command again to resume.")
+        return 130
+
+    print(f"[-] ADetailer: {processed} images processed, {failed} failed.")
+    return 1 if failed else 0
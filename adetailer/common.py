@@ -1,32 +1,97 @@
 from __future__ import annotations
 
+import hashlib
+import math
 import os
 from collections import OrderedDict
+from collections.abc import Callable, Sequence
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any, Generic, Optional, TypeVar
 
-from huggingface_hub import hf_hub_download
+import numpy as np
 from PIL import Image, ImageDraw
 from rich import print  # noqa: A004  Shadowing built-in 'print'
-from torchvision.transforms.functional import to_pil_image
+
+from adetailer.crop_mask import CropMask
+from adetailer.manifest import ModelManifest
+from adetailer.scan_index import ScanIndex
 
 REPO_ID = "Bingsu/adetailer"
 
 T = TypeVar("T", int, float)
 
 
-@dataclass
+@dataclass(eq=False)
 class PredictOutput(Generic[T]):
-    bboxes: list[list[T]] = field(default_factory=list)
-    masks: list[Image.Image] = field(default_factory=list)
-    confidences: list[float] = field(default_factory=list)
-    preview: Optional[Image.Image] = None
+    # (N, 4) array of [x1, y1, x2, y2]
+    bboxes: np.ndarray = field(default_factory=lambda: np.empty((0, 4)))
+    masks: list[CropMask] = field(default_factory=list)
+    # (N,) array
+    confidences: np.ndarray = field(default_factory=lambda: np.empty(0))
+    image_size: tuple[int, int] = (0, 0)
+    render_preview: Optional[Callable[..., Image.Image]] = field(
+        default=None, repr=False, compare=False
+    )
+    preview_indices: Optional[list[int]] = field(
+        default=None, repr=False, compare=False
+    )
+    _preview: Optional[Image.Image] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        self.bboxes = np.asarray(self.bboxes).reshape(-1, 4)
+        self.confidences = np.asarray(self.confidences, dtype=np.float64).reshape(-1)
+
+    def __len__(self) -> int:
+        return len(self.bboxes)
+
+    @property
+    def preview(self) -> Optional[Image.Image]:
+        "The preview image. It is rendered on first access."
+        if self._preview is None and self.render_preview is not None:
+            if self.preview_indices is None:
+                self._preview = self.render_preview()
+            else:
+                self._preview = self.render_preview(self.preview_indices)
+            self.render_preview = None
+        return self._preview
+
+    @preview.setter
+    def preview(self, value: Optional[Image.Image]) -> None:
+        self._preview = value
+        self.render_preview = None
+
+    def select(self, idx: Sequence[int]) -> PredictOutput[T]:
+        """
+        A new PredictOutput with only the detections at `idx`, in that order.
+        Its preview only shows the selected detections.
+        """
+        idx = np.asarray(idx, dtype=np.intp).reshape(-1)
+        if self.preview_indices is None:
+            preview_indices = idx.tolist()
+        else:
+            preview_indices = [self.preview_indices[i] for i in idx]
+
+        out = PredictOutput(
+            bboxes=self.bboxes[idx],
+            masks=[self.masks[i] for i in idx],
+            confidences=self.confidences[idx],
+            image_size=self.image_size,
+            render_preview=self.render_preview,
+            preview_indices=preview_indices,
+        )
+        if self.render_preview is None:
+            out._preview = self._preview
+        return out
 
 
 def hf_download(file: str, repo_id: str = REPO_ID, check_remote: bool = True) -> str:
+    from huggingface_hub import hf_hub_download
+
     if check_remote:
         with suppress(Exception):
             return hf_hub_download(repo_id, file, etag_timeout=1)
@@ -51,12 +116,24 @@ def safe_mkdir(path: str | os.PathLike[str]) -> None:
         path.mkdir()
 
 
-def scan_model_dir(path: Path) -> list[Path]:
+def scan_model_dir(path: Path, index: ScanIndex | None = None) -> list[Path]:
     if not path.is_dir():
         return []
+    if index is not None:
+        return index.scan(path)
     return [p for p in path.rglob("*") if p.is_file() and p.suffix == ".pt"]
 
 
+DEFAULT_MODELS = [
+    "face_yolov8n.pt",
+    "face_yolov8s.pt",
+    "hand_yolov8n.pt",
+    "person_yolov8n-seg.pt",
+    "person_yolov8s-seg.pt",
+    "yolov8x-worldv2.pt",
+]
+
+
 def download_models(*names: str, check_remote: bool = True) -> dict[str, str]:
     models = OrderedDict()
     with ThreadPoolExecutor() as executor:
@@ -77,26 +154,66 @@ def download_models(*names: str, check_remote: bool = True) -> dict[str, str]:
     return {name: future.result() for name, future in models.items()}
 
 
+def resolve_models(
+    *names: str, manifest: ModelManifest, check_remote: bool = False
+) -> dict[str, str]:
+    """
+    Paths of the downloaded models. Names found in `manifest` are trusted
+    as is, the others are looked up in the huggingface cache (and on the hub
+    if `check_remote`) and recorded in the manifest.
+    """
+    models = {}
+    missing = []
+    for name in names:
+        path = manifest.resolve(name)
+        if path is not None and not check_remote:
+            models[name] = path
+        else:
+            missing.append(name)
+
+    changed = False
+    for name, path in download_models(*missing, check_remote=check_remote).items():
+        if path == "INVALID":
+            continue
+        models[name] = path
+        changed |= manifest.update(name, path)
+
+    if changed:
+        manifest.save()
+    return {name: models[name] for name in names if name in models}
+
+
 def get_models(
-    *dirs: str | os.PathLike[str], huggingface: bool = True
+    *dirs: str | os.PathLike[str],
+    huggingface: bool = True,
+    manifest: ModelManifest | None = None,
+    index: ScanIndex | None = None,
 ) -> OrderedDict[str, str]:
+    """
+    Parameters
+    ----------
+        dirs: str | os.PathLike[str]
+            directories to scan for extra models
+        huggingface: bool
+            check huggingface for the default models
+        manifest: ModelManifest | None
+            if given, the default models are resolved from the manifest and
+            the local huggingface cache only, without any network access.
+        index: ScanIndex | None
+            if given, only the directories changed since the last scan are listed.
+    """
     model_paths = []
 
     for dir_ in dirs:
         if not dir_:
             continue
-        model_paths.extend(scan_model_dir(Path(dir_)))
+        model_paths.extend(scan_model_dir(Path(dir_), index))
 
     models = OrderedDict()
-    to_download = [
-        "face_yolov8n.pt",
-        "face_yolov8s.pt",
-        "hand_yolov8n.pt",
-        "person_yolov8n-seg.pt",
-        "person_yolov8s-seg.pt",
-        "yolov8x-worldv2.pt",
-    ]
-    models.update(download_models(*to_download, check_remote=huggingface))
+    if manifest is not None:
+        models.update(resolve_models(*DEFAULT_MODELS, manifest=manifest))
+    else:
+        models.update(download_models(*DEFAULT_MODELS, check_remote=huggingface))
 
     models.update(
         {
@@ -120,39 +237,51 @@ def get_models(
 
 
 def create_mask_from_bbox(
-    bboxes: list[list[float]], shape: tuple[int, int]
-) -> list[Image.Image]:
+    bboxes: Sequence[Sequence[float]] | np.ndarray, shape: tuple[int, int]
+) -> list[CropMask]:
     """
     Parameters
     ----------
-        bboxes: list[list[float]]
-            list of [x1, y1, x2, y2]
+        bboxes: Sequence[Sequence[float]] | np.ndarray
+            list or (N, 4) array of [x1, y1, x2, y2]
             bounding boxes
         shape: tuple[int, int]
             shape of the image (width, height)
 
     Returns
     -------
-        masks: list[Image.Image]
+        masks: list[CropMask]
         A list of masks
 
     """
+    width, height = shape
     masks = []
     for bbox in bboxes:
-        mask = Image.new("L", shape, 0)
+        # only draw the region of the bbox, shifted by whole pixels
+        x1 = min(max(math.floor(bbox[0]), 0), width)
+        y1 = min(max(math.floor(bbox[1]), 0), height)
+        x2 = min(max(math.ceil(bbox[2]) + 1, x1), width)
+        y2 = min(max(math.ceil(bbox[3]) + 1, y1), height)
+        if x1 == x2 or y1 == y2:
+            masks.append(CropMask.empty(shape))
+            continue
+
+        mask = Image.new("L", (x2 - x1, y2 - y1), 0)
         mask_draw = ImageDraw.Draw(mask)
-        mask_draw.rectangle(bbox, fill=255)
-        masks.append(mask)
+        mask_draw.rectangle(
+            [bbox[0] - x1, bbox[1] - y1, bbox[2] - x1, bbox[3] - y1], fill=255
+        )
+        masks.append(CropMask(np.array(mask), x1, y1, shape).trim())
     return masks
 
 
 def create_bbox_from_mask(
-    masks: list[Image.Image], shape: tuple[int, int]
+    masks: list[Image.Image | CropMask], shape: tuple[int, int]
 ) -> list[list[int]]:
     """
     Parameters
     ----------
-        masks: list[Image.Image]
+        masks: list[Image.Image | CropMask]
             A list of masks
         shape: tuple[int, int]
             shape of the image (width, height)
@@ -165,6 +294,13 @@ def create_bbox_from_mask(
     """
     bboxes = []
     for mask in masks:
+        if isinstance(mask, CropMask):
+            if mask.size == shape:
+                bbox = mask.getbbox()
+                if bbox is not None:
+                    bboxes.append(list(bbox))
+                continue
+            mask = mask.to_pil()  # noqa: PLW2901
         mask = mask.resize(shape)  # noqa: PLW2901
         bbox = mask.getbbox()
         if bbox is not None:
@@ -173,8 +309,19 @@ def create_bbox_from_mask(
 
 
 def ensure_pil_image(image: Any, mode: str = "RGB") -> Image.Image:
-    if not isinstance(image, Image.Image):
+    if isinstance(image, CropMask):
+        image = image.to_pil()
+    elif not isinstance(image, Image.Image):
+        from torchvision.transforms.functional import to_pil_image
+
         image = to_pil_image(image)
     if image.mode != mode:
         image = image.convert(mode)
     return image
+
+
+def image_fingerprint(image: Image.Image) -> str:
+    "A content hash of `image`, used to tell whether an image changed."
+    h = hashlib.blake2b(image.tobytes(), digest_size=16)
+    h.update(f"{image.mode}{image.size}".encode())
+    return h.hexdigest()
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import numpy as np
+from PIL import Image
+
+
+@dataclass
+class CropMask:
+    """
+    A mask that only keeps the pixels inside its bounding box.
+
+    Parameters
+    ----------
+        array: np.ndarray
+            uint8 array of shape (h, w), the cropped region of the mask
+        x: int
+            x coordinate of the top-left corner of the crop on the canvas
+        y: int
+            y coordinate of the top-left corner of the crop on the canvas
+        size: tuple[int, int]
+            (width, height) of the canvas, same as `PIL.Image.Image.size`
+    """
+
+    array: np.ndarray
+    x: int = 0
+    y: int = 0
+    size: tuple[int, int] = (0, 0)
+
+    mode = "L"
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    @property
+    def bbox(self) -> tuple[int, int, int, int]:
+        "(x1, y1, x2, y2) of the stored crop on the canvas."
+        h, w = self.array.shape[:2]
+        return (self.x, self.y, self.x + w, self.y + h)
+
+    @classmethod
+    def empty(cls, size: tuple[int, int]) -> CropMask:
+        return cls(np.zeros((0, 0), dtype=np.uint8), 0, 0, size)
+
+    @classmethod
+    def from_array(cls, arr: np.ndarray) -> CropMask:
+        "Create a CropMask from a full-frame (H, W) uint8 array."
+        h, w = arr.shape[:2]
+        return cls(arr, 0, 0, (w, h)).trim()
+
+    @classmethod
+    def from_pil(cls, image: Image.Image) -> CropMask:
+        if image.mode != "L":
+            image = image.convert("L")
+        bbox = image.getbbox()
+        if bbox is None:
+            return cls.empty(image.size)
+        arr = np.array(image.crop(bbox))
+        return cls(arr, bbox[0], bbox[1], image.size)
+
+    @classmethod
+    def from_polygons(
+        cls, polygons: list[np.ndarray], size: tuple[int, int]
+    ) -> CropMask:
+        """
+        Rasterize filled polygons into a buffer that only covers their bounding box.
+
+        Parameters
+        ----------
+            polygons: list[np.ndarray]
+                int arrays of shape (n, 2), (x, y) vertices on the canvas
+            size: tuple[int, int]
+                (width, height) of the canvas
+        """
+        polygons = [
+            np.asarray(poly, dtype=np.int32).reshape(-1, 2) for poly in polygons
+        ]
+        polygons = [poly for poly in polygons if len(poly) > 0]
+        if not polygons:
+            return cls.empty(size)
+
+        points = np.concatenate(polygons)
+        x1, y1 = np.maximum(points.min(axis=0), 0)
+        x2, y2 = np.minimum(points.max(axis=0) + 1, size)
+        if x1 >= x2 or y1 >= y2:
+            return cls.empty(size)
+
+        import cv2
+
+        buf = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+        origin = np.array([x1, y1], dtype=np.int32)
+        cv2.fillPoly(buf, [poly - origin for poly in polygons], 255)
+        return cls(buf, int(x1), int(y1), size).trim()
+
+    def getbbox(self) -> Optional[tuple[int, int, int, int]]:
+        "Bounding box of the non-zero pixels on the canvas, like `PIL.Image.Image.getbbox`."
+        if self.array.size == 0:
+            return None
+        rows = np.flatnonzero(self.array.any(axis=1))
+        if rows.size == 0:
+            return None
+        cols = np.flatnonzero(self.array.any(axis=0))
+        return (
+            self.x + int(cols[0]),
+            self.y + int(rows[0]),
+            self.x + int(cols[-1]) + 1,
+            self.y + int(rows[-1]) + 1,
+        )
+
+    def trim(self) -> CropMask:
+        "Shrink the crop to the bounding box of its non-zero pixels."
+        bbox = self.getbbox()
+        if bbox is None:
+            return self.empty(self.size)
+        if bbox == self.bbox:
+            return self
+        x1, y1, x2, y2 = bbox
+        arr = self.array[y1 - self.y : y2 - self.y, x1 - self.x : x2 - self.x]
+        return CropMask(arr, x1, y1, self.size)
+
+    def window(self, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+        "Region (x1, y1, x2, y2) of the canvas as a new array."
+        out = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+        cx1, cy1, cx2, cy2 = self.bbox
+        ix1, iy1 = max(x1, cx1), max(y1, cy1)
+        ix2, iy2 = min(x2, cx2), min(y2, cy2)
+        if ix1 < ix2 and iy1 < iy2:
+            out[iy1 - y1 : iy2 - y1, ix1 - x1 : ix2 - x1] = self.array[
+                iy1 - cy1 : iy2 - cy1, ix1 - cx1 : ix2 - cx1
+            ]
+        return out
+
+    def to_array(self) -> np.ndarray:
+        "Materialize the full-frame (H, W) uint8 array."
+        return self.window(0, 0, self.width, self.height)
+
+    def to_pil(self) -> Image.Image:
+        "Materialize the full-frame mask image in mode 'L'."
+        return Image.fromarray(self.to_array())
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> np.ndarray:
+        arr = self.to_array()
+        return arr if dtype is None else arr.astype(dtype)
+
+
+def to_crop_mask(mask: Any) -> CropMask:
+    if isinstance(mask, CropMask):
+        return mask
+    if isinstance(mask, Image.Image):
+        return CropMask.from_pil(mask)
+    return CropMask.from_array(np.asarray(mask, dtype=np.uint8))
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import base64
+import io
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Literal
+
+from PIL import Image
+
+from adetailer.args import DetectArgs
+from adetailer.common import PredictOutput
+from adetailer.crop_mask import CropMask
+from adetailer.mask import filter_and_sort, mask_preprocess
+from adetailer.mediapipe import mediapipe_predict
+from adetailer.rle import encode
+from adetailer.ultralytics import ultralytics_predict_batch
+
+MaskFormat = Literal["rle", "png", "none"]
+
+
+@dataclass
+class Detection:
+    """
+    Detections kept by the mask filters on one image, and their
+    preprocessed masks.
+
+    The masks don't always match the detections one to one: empty masks
+    are dropped and "Merge" gives a single mask.
+    """
+
+    pred: PredictOutput[float]
+    masks: list[CropMask]
+
+    def to_json(self, mask_format: MaskFormat = "rle") -> dict[str, Any]:
+        out: dict[str, Any] = {
+            "image_size": list(self.pred.image_size),
+            "bboxes": [[round(float(v), 2) for v in bbox] for bbox in self.pred.bboxes],
+            "confidences": [round(float(c), 4) for c in self.pred.confidences],
+        }
+        if mask_format == "rle":
+            out["masks"] = [encode(mask) for mask in self.masks]
+        elif mask_format == "png":
+            out["masks"] = [encode_png(mask) for mask in self.masks]
+        return out
+
+
+def detect(
+    images: list[Image.Image],
+    args: DetectArgs,
+    model_path: str | Path = "",
+    device: str = "",
+) -> list[Detection]:
+    """
+    Detect with `args.ad_model` on every image, then apply the mask filters
+    and the mask preprocessing of `args`.
+
+    Parameters
+    ----------
+        images: list[PIL.Image.Image]
+            RGB images
+        args: DetectArgs
+        model_path: str | Path
+            path of the ultralytics model, unused for mediapipe models
+        device: str
+            ultralytics device
+
+    Returns
+    -------
+        list[Detection]
+            one per image, in the same order
+    """
+    if args.is_mediapipe():
+        preds = [
+            mediapipe_predict(args.ad_model, image, args.ad_confidence)
+            for image in images
+        ]
+    else:
+        # every image in one forward pass
+        preds = ultralytics_predict_batch(
+            model_path,
+            images=images,
+            confidence=args.ad_confidence,
+            device=device,
+            classes=args.ad_model_classes,
+        )
+    for pred, image in zip(preds, images):
+        # empty results of mediapipe don't know the image size
+        if pred.image_size == (0, 0):
+            pred.image_size = image.size
+    return [postprocess(pred, args) for pred in preds]
+
+
+def postprocess(pred: PredictOutput[float], args: DetectArgs) -> Detection:
+    kept = filter_and_sort(
+        pred,
+        low=args.ad_mask_min_ratio,
+        high=args.ad_mask_max_ratio,
+        k=args.ad_mask_k,
+        by=args.ad_mask_filter_method,
+        order=args.bbox_sort_order(),
+    )
+    masks = mask_preprocess(
+        kept.masks,
+        kernel=args.ad_dilate_erode,
+        x_offset=args.ad_x_offset,
+        y_offset=args.ad_y_offset,
+        merge_invert=args.ad_mask_merge_invert,
+    )
+    return Detection(kept, masks)
+
+
+def decode_image(data: str) -> Image.Image:
+    "Decode a base64 image, or a data url, into an RGB image."
+    if data.startswith("data:"):
+        data = data.partition(",")[2]
+    try:
+        image = Image.open(io.BytesIO(base64.b64decode(data, validate=True)))
+        image.load()
+    except Exception as e:
+        msg = f"[-] ADetailer: Invalid base64 image: {e}"
+        raise ValueError(msg) from e
+    return image.convert("RGB")
+
+
+def encode_png(mask: CropMask) -> str:
+    "Base64 PNG of the full-frame mask."
+    buf = io.BytesIO()
+    mask.to_pil().save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
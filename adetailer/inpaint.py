@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+from collections.abc import Hashable, Sequence
+from typing import NamedTuple
+
+from PIL import Image, ImageFilter
+
+from adetailer.crop_mask import CropMask
+
+Region = tuple[int, int, int, int]
+# (width, height, denoising strength) of an img2img pass
+BatchKey = tuple[int, int, float]
+
+
+class InpaintJob(NamedTuple):
+    j: int
+    region: Region
+    key: BatchKey
+
+
+def crop_region(mask: CropMask, padding: int, width: int, height: int) -> Region | None:
+    """
+    The region of the image that "inpaint only masked" crops for `mask`:
+    the bounding box of the mask grown by `padding`, then expanded to the
+    aspect ratio of the processing size.
+
+    Parameters
+    ----------
+        mask: CropMask
+        padding: int
+            inpaint only masked padding, in pixels
+        width: int
+            processing width
+        height: int
+            processing height
+
+    Returns
+    -------
+        tuple[int, int, int, int] | None
+            (x1, y1, x2, y2), None if the mask is empty
+    """
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+
+    image_width, image_height = mask.size
+    x1, y1, x2, y2 = bbox
+    region = (
+        max(x1 - padding, 0),
+        max(y1 - padding, 0),
+        min(x2 + padding, image_width),
+        min(y2 + padding, image_height),
+    )
+    return expand_crop_region(region, width, height, image_width, image_height)
+
+
+def expand_crop_region(
+    region: Region,
+    processing_width: int,
+    processing_height: int,
+    image_width: int,
+    image_height: int,
+) -> Region:
+    "Same as `modules.masking.expand_crop_region` of the webui."
+    x1, y1, x2, y2 = region
+
+    ratio_crop_region = (x2 - x1) / (y2 - y1)
+    ratio_processing = processing_width / processing_height
+
+    if ratio_crop_region > ratio_processing:
+        desired_height = (x2 - x1) / ratio_processing
+        desired_height_diff = int(desired_height - (y2 - y1))
+        y1 -= desired_height_diff // 2
+        y2 += desired_height_diff - desired_height_diff // 2
+        if y2 >= image_height:
+            diff = y2 - image_height
+            y2 -= diff
+            y1 -= diff
+        if y1 < 0:
+            y2 -= y1
+            y1 -= y1
+        y2 = min(y2, image_height)
+    else:
+        desired_width = (y2 - y1) * ratio_processing
+        desired_width_diff = int(desired_width - (x2 - x1))
+        x1 -= desired_width_diff // 2
+        x2 += desired_width_diff - desired_width_diff // 2
+        if x2 >= image_width:
+            diff = x2 - image_width
+            x2 -= diff
+            x1 -= diff
+        if x1 < 0:
+            x2 -= x1
+            x1 -= x1
+        x2 = min(x2, image_width)
+
+    return x1, y1, x2, y2
+
+
+def regions_overlap(a: Region, b: Region) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def group_regions(
+    regions: Sequence[Region],
+    keys: Sequence[Hashable] | None = None,
+    max_size: int = 4,
+) -> list[list[int]]:
+    """
+    Group the indices of `regions` so that the regions in a group don't
+    overlap and share the same key.
+
+    Overlapping regions are placed in groups in the order of their indices,
+    so processing the groups one after another gives every region the same
+    image content as processing the regions one by one.
+
+    Parameters
+    ----------
+        regions: Sequence[tuple[int, int, int, int]]
+        keys: Sequence[Hashable] | None
+            regions can only be grouped if their keys are equal
+        max_size: int
+            maximum number of regions in a group
+
+    Returns
+    -------
+        list[list[int]]
+    """
+    if keys is None:
+        keys = [None] * len(regions)
+
+    groups: list[list[int]] = []
+    group_of: list[int] = []
+    for i, region in enumerate(regions):
+        level = 0
+        for j in range(i):
+            if regions_overlap(regions[j], region):
+                level = max(level, group_of[j] + 1)
+
+        g = next(
+            (
+                g
+                for g in range(level, len(groups))
+                if len(groups[g]) < max_size and keys[groups[g][0]] == keys[i]
+            ),
+            len(groups),
+        )
+        if g == len(groups):
+            groups.append([])
+        groups[g].append(i)
+        group_of.append(g)
+
+    return groups
+
+
+def plan_batches(
+    masks: Sequence[CropMask],
+    keys: Sequence[BatchKey | None],
+    padding: int,
+    max_size: int = 4,
+) -> list[list[InpaintJob]]:
+    """
+    Batches of the masks to inpaint with "inpaint only masked", so that the
+    crop regions in a batch don't overlap and share the same processing size
+    and denoising strength.
+
+    Parameters
+    ----------
+        masks: Sequence[CropMask]
+        keys: Sequence[tuple[int, int, float] | None]
+            (width, height, denoising strength) of each mask, None skips it
+        padding: int
+            inpaint only masked padding plus the mask blur, in pixels
+        max_size: int
+            maximum number of masks in a batch
+
+    Returns
+    -------
+        list[list[InpaintJob]]
+    """
+    jobs = []
+    for j, (mask, key) in enumerate(zip(masks, keys)):
+        if key is None:
+            continue
+        width, height, _ = key
+        region = crop_region(mask, padding, width, height)
+        if region is not None:
+            jobs.append(InpaintJob(j, region, key))
+
+    groups = group_regions(
+        [job.region for job in jobs], [job.key for job in jobs], max_size=max_size
+    )
+    return [[jobs[k] for k in group] for group in groups]
+
+
+def paste_back(
+    image: Image.Image,
+    result: Image.Image,
+    region: Region,
+    mask: CropMask,
+    mask_blur: int = 0,
+) -> Image.Image:
+    """
+    Paste the inpainted crop `result` into `region` of `image`, only where
+    `mask` (blurred by `mask_blur`) covers it.
+    """
+    x1, y1, x2, y2 = region
+    result = result.resize((x2 - x1, y2 - y1), resample=Image.LANCZOS)
+    if result.mode != image.mode:
+        result = result.convert(image.mode)
+
+    alpha = Image.fromarray(mask.window(x1, y1, x2, y2))
+    if mask_blur > 0:
+        alpha = alpha.filter(ImageFilter.GaussianBlur(mask_blur))
+
+    image = image.copy()
+    image.paste(result, (x1, y1), alpha)
+    return image
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+from rich import print  # noqa: A004  Shadowing built-in 'print'
+
+MANIFEST_NAME = "manifest.json"
+
+
+@dataclass
+class ManifestEntry:
+    path: str
+    size: int
+    sha256: str
+
+
+def file_sha256(path: str | os.PathLike[str]) -> str:
+    h = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ModelManifest:
+    """
+    Persisted record of the resolved paths of the downloaded models,
+    so they can be found on startup without asking huggingface.
+
+    Parameters
+    ----------
+        path: str | os.PathLike[str]
+            path of the manifest json file
+    """
+
+    def __init__(self, path: str | os.PathLike[str]):
+        self.path = Path(path)
+        self.entries: dict[str, ManifestEntry] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str | os.PathLike[str]) -> ModelManifest:
+        "Read the manifest at `path`. A missing or broken file gives an empty manifest."
+        manifest = cls(path)
+        try:
+            data = json.loads(manifest.path.read_text("utf-8"))
+            manifest.entries = {
+                name: ManifestEntry(**entry) for name, entry in data["models"].items()
+            }
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[-] ADetailer: Failed to read model manifest {manifest.path}: {e}")
+        return manifest
+
+    def save(self) -> None:
+        with self._lock:
+            data = {
+                "models": {name: asdict(entry) for name, entry in self.entries.items()}
+            }
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            tmp.write_text(json.dumps(data, indent=2), "utf-8")
+            tmp.replace(self.path)
+        except OSError as e:
+            print(f"[-] ADetailer: Failed to write model manifest {self.path}: {e}")
+
+    def resolve(self, name: str) -> Optional[str]:
+        "The recorded path of `name`, if the file is still there with the same size."
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        try:
+            size = Path(entry.path).stat().st_size
+        except OSError:
+            return None
+        return entry.path if size == entry.size else None
+
+    def update(self, name: str, path: str) -> bool:
+        """
+        Record `path` for `name`. The file is hashed only if it changed.
+        Returns True if the manifest changed.
+        """
+        size = Path(path).stat().st_size
+        entry = self.entries.get(name)
+        if entry is not None and entry.path == path and entry.size == size:
+            return False
+        with self._lock:
+            self.entries[name] = ManifestEntry(path, size, file_sha256(path))
+        return True
@@ -1,16 +1,16 @@
 from __future__ import annotations
 
+from collections.abc import Sequence
 from enum import IntEnum
-from functools import partial, reduce
-from math import dist
+from functools import lru_cache, partial, reduce
 from typing import Any, TypeVar
 
-import cv2
 import numpy as np
 from PIL import Image, ImageChops
 
 from adetailer.args import MASK_MERGE_INVERT
 from adetailer.common import PredictOutput, ensure_pil_image
+from adetailer.crop_mask import CropMask, to_crop_mask
 
 
 class SortBy(IntEnum):
@@ -29,17 +29,28 @@ class MergeInvert(IntEnum):
 T = TypeVar("T", int, float)
 
 
-def _dilate(arr: np.ndarray, value: int) -> np.ndarray:
+@lru_cache(maxsize=64)
+def _kernel(value: int) -> np.ndarray:
+    import cv2
+
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (value, value))
-    return cv2.dilate(arr, kernel, iterations=1)
+    kernel.setflags(write=False)
+    return kernel
+
+
+def _dilate(arr: np.ndarray, value: int) -> np.ndarray:
+    import cv2
+
+    return cv2.dilate(arr, _kernel(value), iterations=1)
 
 
 def _erode(arr: np.ndarray, value: int) -> np.ndarray:
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (value, value))
-    return cv2.erode(arr, kernel, iterations=1)
+    import cv2
 
+    return cv2.erode(arr, _kernel(value), iterations=1)
 
-def dilate_erode(img: Image.Image, value: int) -> Image.Image:
+
+def dilate_erode(img: Image.Image | CropMask, value: int) -> Image.Image | CropMask:
     """
     The dilate_erode function takes an image and a value.
     If the value is positive, it dilates the image by that amount.
@@ -47,32 +58,150 @@ def dilate_erode(img: Image.Image, value: int) -> Image.Image:
 
     Parameters
     ----------
-        img: PIL.Image.Image
+        img: PIL.Image.Image | CropMask
             the image to be processed
         value: int
             kernel size of dilation or erosion
 
     Returns
     -------
-        PIL.Image.Image
+        PIL.Image.Image | CropMask
             The image that has been dilated or eroded
     """
     if value == 0:
         return img
 
+    if isinstance(img, CropMask):
+        return _dilate_erode_crop(img, value)
+
+    if img.mode == "L":
+        return _dilate_erode_crop(CropMask.from_pil(img), value).to_pil()
+
     arr = np.array(img)
     arr = _dilate(arr, value) if value > 0 else _erode(arr, -value)
 
     return Image.fromarray(arr)
 
 
-def offset(img: Image.Image, x: int = 0, y: int = 0) -> Image.Image:
+def _padded_window(mask: CropMask, k: int) -> tuple[int, int, int, int] | None:
+    """
+    The bbox of `mask` padded by the kernel size `k`, None if the mask is empty.
+    Where the padding is cut by the canvas, opencv's border handling gives
+    the same result as on the full frame.
+    """
+    x1, y1, x2, y2 = mask.bbox
+    if x1 == x2 or y1 == y2:
+        return None
+    width, height = mask.size
+    return max(x1 - k, 0), max(y1 - k, 0), min(x2 + k, width), min(y2 + k, height)
+
+
+def _dilate_erode_crop(mask: CropMask, value: int) -> CropMask:
+    k = abs(value)
+    window = _padded_window(mask, k)
+    if window is None:
+        return mask
+
+    arr = mask.window(*window)
+    arr = _dilate(arr, k) if value > 0 else _erode(arr, k)
+    return CropMask(arr, window[0], window[1], mask.size).trim()
+
+
+def dilate_erode_many(masks: Sequence[Any], value: int) -> list[Any]:
+    """
+    Same as `dilate_erode` on each mask, but the padded windows of the
+    CropMasks are stacked into one array and processed with a single
+    opencv call per group of similar widths.
+    """
+    if value == 0:
+        return list(masks)
+
+    out = list(masks)
+    windows = {}
+    for i, mask in enumerate(masks):
+        if not isinstance(mask, CropMask):
+            out[i] = dilate_erode(mask, value)
+            continue
+        window = _padded_window(mask, abs(value))
+        if window is not None:
+            windows[i] = window
+
+    for group in _stack_groups(windows, abs(value)):
+        stacked = _dilate_erode_stacked(
+            [masks[i] for i in group], [windows[i] for i in group], value
+        )
+        for i, mask in zip(group, stacked):
+            out[i] = mask
+    return out
+
+
+def _dilate_erode_stacked(
+    masks: list[CropMask], windows: list[tuple[int, int, int, int]], value: int
+) -> list[CropMask]:
+    """
+    Dilate or erode the `windows` of `masks` stacked on top of each other,
+    `k` rows apart. Around the windows the array is filled with the value
+    that doesn't change the result, 0 for dilation and 255 for erosion,
+    so every window sees the same border as on its own.
+    """
+    k = abs(value)
+    shapes = [(y2 - y1, x2 - x1) for x1, y1, x2, y2 in windows]
+    height = sum(h for h, _ in shapes) + k * (len(shapes) - 1)
+    width = max(w for _, w in shapes)
+    buf = np.full((height, width), 0 if value > 0 else 255, dtype=np.uint8)
+
+    tops = []
+    top = 0
+    for mask, (h, w), (wx1, wy1, _, _) in zip(masks, shapes, windows):
+        tile = buf[top : top + h, :w]
+        tile[:] = 0
+        x1, y1, x2, y2 = mask.bbox
+        tile[y1 - wy1 : y2 - wy1, x1 - wx1 : x2 - wx1] = mask.array
+        tops.append(top)
+        top += h + k
+
+    buf = _dilate(buf, k) if value > 0 else _erode(buf, k)
+    return [
+        CropMask(buf[top : top + h, :w], wx1, wy1, mask.size).trim()
+        for mask, top, (h, w), (wx1, wy1, _, _) in zip(masks, tops, shapes, windows)
+    ]
+
+
+def _stack_groups(
+    windows: dict[int, tuple[int, int, int, int]], k: int
+) -> list[list[int]]:
+    """
+    Group the windows, widest first, so that padding the windows of a group
+    to the widest one at most doubles the number of processed pixels.
+    """
+    groups: list[list[int]] = []
+    group: list[int] = []
+    width = rows = area = 0
+    for i in sorted(windows, key=lambda i: windows[i][2] - windows[i][0], reverse=True):
+        x1, y1, x2, y2 = windows[i]
+        w, h = x2 - x1, y2 - y1
+        if group and max(width, w) * (rows + h + k) > 2 * (area + w * h):
+            groups.append(group)
+            group = []
+            width = rows = area = 0
+        group.append(i)
+        width = max(width, w)
+        rows += h + k
+        area += w * h
+    if group:
+        groups.append(group)
+    return groups
+
+
+def offset(
+    img: Image.Image | CropMask, x: int = 0, y: int = 0
+) -> Image.Image | CropMask:
     """
     The offset function takes an image and offsets it by a given x(→) and y(↑) value.
 
     Parameters
     ----------
-        mask: Image.Image
+        mask: Image.Image | CropMask
             Pass the mask image to the function
         x: int
             →
@@ -81,43 +210,109 @@ def offset(img: Image.Image, x: int = 0, y: int = 0) -> Image.Image:
 
     Returns
     -------
-        PIL.Image.Image
+        PIL.Image.Image | CropMask
             A new image that is offset by x and y
     """
-    return ImageChops.offset(img, x, -y)
+    if not isinstance(img, CropMask):
+        return ImageChops.offset(img, x, -y)
+
+    x1, y1, x2, y2 = img.bbox
+    width, height = img.size
+    if x1 == x2 or y1 == y2:
+        return img
+    if x1 + x >= 0 and x2 + x <= width and y1 - y >= 0 and y2 - y <= height:
+        return CropMask(img.array, img.x + x, img.y - y, img.size)
 
+    # ImageChops.offset wraps around the edges
+    return CropMask.from_array(np.roll(img.to_array(), (-y, x), axis=(0, 1)))
 
-def is_all_black(img: Image.Image | np.ndarray) -> bool:
+
+def is_all_black(img: Image.Image | CropMask | np.ndarray) -> bool:
+    import cv2
+
+    if isinstance(img, CropMask):
+        return not img.array.any()
     if isinstance(img, Image.Image):
         img = np.array(ensure_pil_image(img, "L"))
     return cv2.countNonZero(img) == 0
 
 
 def has_intersection(im1: Any, im2: Any) -> bool:
-    arr1 = np.array(ensure_pil_image(im1, "L"))
-    arr2 = np.array(ensure_pil_image(im2, "L"))
+    """
+    Whether the two masks share a nonzero pixel. Masks whose bounding boxes
+    don't overlap are rejected without looking at the pixels, otherwise
+    only the overlapping window is compared.
+    """
+    import cv2
+
+    if isinstance(im1, CropMask) or isinstance(im2, CropMask):
+        return _crop_has_intersection(to_crop_mask(im1), to_crop_mask(im2))
+
+    im1 = ensure_pil_image(im1, "L")
+    im2 = ensure_pil_image(im2, "L")
+    if im1.size == im2.size:
+        window = bbox_intersection(im1.getbbox(), im2.getbbox())
+        if window is None:
+            return False
+        im1, im2 = im1.crop(window), im2.crop(window)
+
+    arr1 = np.array(im1)
+    arr2 = np.array(im2)
     return not is_all_black(cv2.bitwise_and(arr1, arr2))
 
 
-def bbox_area(bbox: list[T]) -> T:
-    return (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+def bbox_intersection(
+    bbox1: tuple[int, int, int, int] | None, bbox2: tuple[int, int, int, int] | None
+) -> tuple[int, int, int, int] | None:
+    "The overlap of two (x1, y1, x2, y2) boxes, None if they don't overlap."
+    if bbox1 is None or bbox2 is None:
+        return None
+    x1, y1 = max(bbox1[0], bbox2[0]), max(bbox1[1], bbox2[1])
+    x2, y2 = min(bbox1[2], bbox2[2]), min(bbox1[3], bbox2[3])
+    if x1 >= x2 or y1 >= y2:
+        return None
+    return x1, y1, x2, y2
+
+
+def _crop_has_intersection(m1: CropMask, m2: CropMask) -> bool:
+    window = bbox_intersection(m1.bbox, m2.bbox)
+    if window is None:
+        return False
+
+    x1, y1, x2, y2 = window
+    ax1, ay1 = m1.bbox[:2]
+    bx1, by1 = m2.bbox[:2]
+    win1 = m1.array[y1 - ay1 : y2 - ay1, x1 - ax1 : x2 - ax1]
+    win2 = m2.array[y1 - by1 : y2 - by1, x1 - bx1 : x2 - bx1]
+    return bool(np.bitwise_and(win1, win2).any())
+
+
+def bbox_area(bbox: Any) -> Any:
+    "Area of a [x1, y1, x2, y2] bbox, or of each row of a (N, 4) array."
+    bbox = np.asarray(bbox)
+    return (bbox[..., 2] - bbox[..., 0]) * (bbox[..., 3] - bbox[..., 1])
 
 
 def mask_preprocess(
-    masks: list[Image.Image],
+    masks: list[CropMask],
     kernel: int = 0,
     x_offset: int = 0,
     y_offset: int = 0,
     merge_invert: int | MergeInvert | str = MergeInvert.NONE,
-) -> list[Image.Image]:
+) -> list[CropMask]:
     """
     The mask_preprocess function takes a list of masks and preprocesses them.
     It dilates and erodes the masks, and offsets them by x_offset and y_offset.
 
+    The masks are converted to CropMasks once and every step works on the
+    cropped arrays: offsets only move the crops, dilation and erosion run
+    on the stacked crops and the emptiness check, merge and invert use the
+    crops as they are. PIL images are converted back once at the end.
+
     Parameters
     ----------
-        masks: list[Image.Image]
-            A list of masks
+        masks: list[CropMask]
+            A list of masks (PIL images are also accepted)
         kernel: int
             kernel size of dilation or erosion
         x_offset: int
@@ -127,72 +322,82 @@ def mask_preprocess(
 
     Returns
     -------
-        list[Image.Image]
-            A list of processed masks
+        list[CropMask]
+            A list of processed masks, PIL images if the input had any
     """
     if not masks:
         return []
 
+    to_pil = not all(isinstance(m, CropMask) for m in masks)
+    crops = [to_crop_mask(m) for m in masks]
+
     if x_offset != 0 or y_offset != 0:
-        masks = [offset(m, x_offset, y_offset) for m in masks]
+        crops = [offset(m, x_offset, y_offset) for m in crops]
 
     if kernel != 0:
-        masks = [dilate_erode(m, kernel) for m in masks]
-        masks = [m for m in masks if not is_all_black(m)]
+        crops = dilate_erode_many(crops, kernel)
+        crops = [m for m in crops if not is_all_black(m)]
 
-    return mask_merge_invert(masks, mode=merge_invert)
+    crops = mask_merge_invert(crops, mode=merge_invert)
+    return [m.to_pil() for m in crops] if to_pil else crops
 
 
 # Bbox sorting
-def _key_left_to_right(bbox: list[T]) -> T:
+def _key_left_to_right(bboxes: np.ndarray) -> np.ndarray:
     """
     Left to right
 
     Parameters
     ----------
-    bbox: list[int] | list[float]
-        list of [x1, y1, x2, y2]
+    bboxes: np.ndarray
+        (N, 4) array of [x1, y1, x2, y2]
     """
-    return bbox[0]
+    return bboxes[:, 0]
 
 
-def _key_center_to_edge(bbox: list[T], *, center: tuple[float, float]) -> float:
+def _key_center_to_edge(
+    bboxes: np.ndarray, *, center: tuple[float, float]
+) -> np.ndarray:
     """
     Center to edge
 
     Parameters
     ----------
-    bbox: list[int] | list[float]
-        list of [x1, y1, x2, y2]
-    image: Image.Image
-        the image
+    bboxes: np.ndarray
+        (N, 4) array of [x1, y1, x2, y2]
+    center: tuple[float, float]
+        center of the image
     """
-    bbox_center = ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
-    return dist(center, bbox_center)
+    cx = (bboxes[:, 0] + bboxes[:, 2]) / 2
+    cy = (bboxes[:, 1] + bboxes[:, 3]) / 2
+    return np.hypot(cx - center[0], cy - center[1])
 
 
-def _key_area(bbox: list[T]) -> T:
+def _key_area(bboxes: np.ndarray) -> np.ndarray:
     """
     Large to small
 
     Parameters
     ----------
-    bbox: list[int] | list[float]
-        list of [x1, y1, x2, y2]
+    bboxes: np.ndarray
+        (N, 4) array of [x1, y1, x2, y2]
     """
-    return -bbox_area(bbox)
+    return -bbox_area(bboxes)
 
 
-def sort_bboxes(
-    pred: PredictOutput[T], order: int | SortBy = SortBy.NONE
-) -> PredictOutput[T]:
-    if order == SortBy.NONE or len(pred.bboxes) <= 1:
-        return pred
+def sort_index(
+    bboxes: np.ndarray,
+    image_size: tuple[int, int],
+    order: int | SortBy = SortBy.NONE,
+) -> np.ndarray:
+    "Indices that sort `bboxes` by `order`. Ties keep their order."
+    if order == SortBy.NONE or len(bboxes) <= 1:
+        return np.arange(len(bboxes))
 
     if order == SortBy.LEFT_TO_RIGHT:
         key = _key_left_to_right
     elif order == SortBy.CENTER_TO_EDGE:
-        width, height = pred.preview.size
+        width, height = image_size
         center = (width / 2, height / 2)
         key = partial(_key_center_to_edge, center=center)
     elif order == SortBy.AREA:
@@ -200,56 +405,58 @@ def sort_bboxes(
     else:
         raise RuntimeError
 
-    items = len(pred.bboxes)
-    idx = sorted(range(items), key=lambda i: key(pred.bboxes[i]))
-    pred.bboxes = [pred.bboxes[i] for i in idx]
-    pred.masks = [pred.masks[i] for i in idx]
-    return pred
+    return np.argsort(key(bboxes), kind="stable")
+
+
+def sort_bboxes(
+    pred: PredictOutput[T], order: int | SortBy = SortBy.NONE
+) -> PredictOutput[T]:
+    return pred.select(sort_index(pred.bboxes, pred.image_size, order))
 
 
 # Filter by ratio
-def is_in_ratio(bbox: list[T], low: float, high: float, orig_area: int) -> bool:
-    area = bbox_area(bbox)
-    return low <= area / orig_area <= high
+def ratio_index(
+    bboxes: np.ndarray, image_size: tuple[int, int], low: float, high: float
+) -> np.ndarray:
+    "Indices of the bboxes whose area relative to the image is in [low, high]."
+    w, h = image_size
+    ratio = bbox_area(bboxes) / (w * h)
+    return np.flatnonzero((low <= ratio) & (ratio <= high))
 
 
 def filter_by_ratio(
     pred: PredictOutput[T], low: float, high: float
 ) -> PredictOutput[T]:
-    if not pred.bboxes:
+    if len(pred) == 0:
         return pred
+    return pred.select(ratio_index(pred.bboxes, pred.image_size, low, high))
 
-    w, h = pred.preview.size
-    orig_area = w * h
-    items = len(pred.bboxes)
-    idx = [i for i in range(items) if is_in_ratio(pred.bboxes[i], low, high, orig_area)]
-    pred.bboxes = [pred.bboxes[i] for i in idx]
-    pred.masks = [pred.masks[i] for i in idx]
-    pred.confidences = [pred.confidences[i] for i in idx]
-    return pred
+
+def filter_by_confidence(pred: PredictOutput[T], threshold: float) -> PredictOutput[T]:
+    """
+    A copy of `pred` with the detections whose confidence is above `threshold`,
+    the same rule ultralytics applies to its `conf` argument.
+    """
+    return pred.select(np.flatnonzero(pred.confidences > threshold))
+
+
+def top_k_index(values: np.ndarray, k: int = 0) -> np.ndarray:
+    "Indices of the `k` largest values, largest first. k=0 keeps all in order."
+    if k == 0:
+        return np.arange(len(values))
+    return np.argsort(values)[-k:][::-1]
 
 
 def filter_k_largest(pred: PredictOutput[T], k: int = 0) -> PredictOutput[T]:
-    if not pred.bboxes or k == 0:
+    if len(pred) == 0 or k == 0:
         return pred
-    areas = [bbox_area(bbox) for bbox in pred.bboxes]
-    idx = np.argsort(areas)[-k:]
-    idx = idx[::-1]
-    pred.bboxes = [pred.bboxes[i] for i in idx]
-    pred.masks = [pred.masks[i] for i in idx]
-    pred.confidences = [pred.confidences[i] for i in idx]
-    return pred
+    return pred.select(top_k_index(bbox_area(pred.bboxes), k))
 
 
 def filter_k_most_confident(pred: PredictOutput[T], k: int = 0) -> PredictOutput[T]:
-    if not pred.bboxes or not pred.confidences or k == 0:
+    if len(pred) == 0 or k == 0:
         return pred
-    idx = np.argsort(pred.confidences)[-k:]
-    idx = idx[::-1]
-    pred.bboxes = [pred.bboxes[i] for i in idx]
-    pred.masks = [pred.masks[i] for i in idx]
-    pred.confidences = [pred.confidences[i] for i in idx]
-    return pred
+    return pred.select(top_k_index(pred.confidences, k))
 
 
 def filter_k_by(
@@ -262,20 +469,75 @@ def filter_k_by(
     raise RuntimeError
 
 
+def filter_and_sort(  # noqa: PLR0913
+    pred: PredictOutput[T],
+    *,
+    low: float = 0.0,
+    high: float = 1.0,
+    k: int = 0,
+    by: str = "Area",
+    order: int | SortBy = SortBy.NONE,
+) -> PredictOutput[T]:
+    """
+    Same as `filter_by_ratio`, `filter_k_by` and `sort_bboxes` applied in turn,
+    but the indices are composed first and the detections are gathered once.
+    """
+    if by not in ("Area", "Confidence"):
+        raise RuntimeError
+
+    idx = ratio_index(pred.bboxes, pred.image_size, low, high)
+    values = bbox_area(pred.bboxes[idx]) if by == "Area" else pred.confidences[idx]
+    idx = idx[top_k_index(values, k)]
+    idx = idx[sort_index(pred.bboxes[idx], pred.image_size, order)]
+    return pred.select(idx)
+
+
 # Merge / Invert
 def mask_merge(masks: list[Image.Image]) -> list[Image.Image]:
+    import cv2
+
+    if any(isinstance(m, CropMask) for m in masks):
+        return [_crop_merge([to_crop_mask(m) for m in masks])]
+
     arrs = [np.array(m) for m in masks]
     arr = reduce(cv2.bitwise_or, arrs)
     return [Image.fromarray(arr)]
 
 
+def _crop_merge(masks: list[CropMask]) -> CropMask:
+    size = masks[0].size
+    if any(m.size != size for m in masks):
+        msg = f"[-] ADetailer: Sizes of masks do not match: {[m.size for m in masks]}"
+        raise ValueError(msg)
+
+    bboxes = [m.bbox for m in masks if m.array.size > 0]
+    if not bboxes:
+        return CropMask.empty(size)
+
+    x1 = min(b[0] for b in bboxes)
+    y1 = min(b[1] for b in bboxes)
+    x2 = max(b[2] for b in bboxes)
+    y2 = max(b[3] for b in bboxes)
+    out = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+    for m in masks:
+        mx1, my1, mx2, my2 = m.bbox
+        region = out[my1 - y1 : my2 - y1, mx1 - x1 : mx2 - x1]
+        np.bitwise_or(region, m.array, out=region)
+    return CropMask(out, x1, y1, size)
+
+
 def mask_invert(masks: list[Image.Image]) -> list[Image.Image]:
-    return [ImageChops.invert(m) for m in masks]
+    return [
+        CropMask.from_array(255 - m.to_array())
+        if isinstance(m, CropMask)
+        else ImageChops.invert(m)
+        for m in masks
+    ]
 
 
 def mask_merge_invert(
-    masks: list[Image.Image], mode: int | MergeInvert | str
-) -> list[Image.Image]:
+    masks: list[CropMask], mode: int | MergeInvert | str
+) -> list[CropMask]:
     if isinstance(mode, str):
         mode = MASK_MERGE_INVERT.index(mode)
 
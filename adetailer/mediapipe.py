@@ -1,18 +1,70 @@
 from __future__ import annotations
 
+from contextlib import AbstractContextManager
 from functools import partial
+from typing import Any
 
-import cv2
 import numpy as np
 from PIL import Image, ImageDraw
 
 from adetailer import PredictOutput
-from adetailer.common import create_bbox_from_mask, create_mask_from_bbox
+from adetailer.cache import ObjectPool
+from adetailer.common import (
+    create_bbox_from_mask,
+    create_mask_from_bbox,
+    ensure_pil_image,
+)
+from adetailer.crop_mask import CropMask
+
+# key: ("face_detection", model_selection, confidence) | ("face_mesh", confidence)
+detector_pool: ObjectPool[tuple[Any, ...], Any] = ObjectPool(
+    max_idle=2, max_keys=4, close=lambda detector: detector.close()
+)
+
+
+def close_detectors() -> None:
+    "Close every pooled mediapipe detector."
+    detector_pool.clear()
+
+
+def face_detection_detector(
+    model_selection: int, confidence: float
+) -> AbstractContextManager[Any]:
+    import mediapipe as mp
+
+    key = ("face_detection", model_selection, confidence)
+    factory = partial(
+        mp.solutions.face_detection.FaceDetection,
+        model_selection=model_selection,
+        min_detection_confidence=confidence,
+    )
+    return detector_pool.acquire(key, factory)
+
+
+def face_mesh_detector(confidence: float) -> AbstractContextManager[Any]:
+    import mediapipe as mp
+
+    key = ("face_mesh", confidence)
+    factory = partial(
+        mp.solutions.face_mesh.FaceMesh,
+        static_image_mode=True,
+        max_num_faces=20,
+        min_detection_confidence=confidence,
+    )
+    return detector_pool.acquire(key, factory)
 
 
 def mediapipe_predict(
-    model_type: str, image: Image.Image, confidence: float = 0.3
+    model_type: str,
+    image: Image.Image,
+    confidence: float = 0.3,
+    *,
+    strict: bool = False,
 ) -> PredictOutput:
+    """
+    Detect with the mediapipe model `model_type`. Errors of the detector
+    give an empty result, unless `strict` is set.
+    """
     mapping = {
         "mediapipe_face_short": partial(mediapipe_face_detection, 0),
         "mediapipe_face_full": partial(mediapipe_face_detection, 1),
@@ -24,6 +76,8 @@ def mediapipe_predict(
         try:
             return func(image, confidence)
         except Exception:
+            if strict:
+                raise
             return PredictOutput()
     msg = f"[-] ADetailer: Invalid mediapipe model type: {model_type}, Available: {list(mapping.keys())!r}"
     raise RuntimeError(msg)
@@ -32,30 +86,19 @@ def mediapipe_predict(
 def mediapipe_face_detection(
     model_type: int, image: Image.Image, confidence: float = 0.3
 ) -> PredictOutput[float]:
-    import mediapipe as mp
-
     img_width, img_height = image.size
 
-    mp_face_detection = mp.solutions.face_detection
-    draw_util = mp.solutions.drawing_utils
-
     img_array = np.array(image)
 
-    with mp_face_detection.FaceDetection(
-        model_selection=model_type, min_detection_confidence=confidence
-    ) as face_detector:
+    with face_detection_detector(model_type, confidence) as face_detector:
         pred = face_detector.process(img_array)
 
     if pred.detections is None:
         return PredictOutput()
 
-    preview_array = img_array.copy()
-
     bboxes = []
     confidences = []
     for detection in pred.detections:
-        draw_util.draw_detection(preview_array, detection)
-
         bbox = detection.location_data.relative_bounding_box
         x1 = bbox.xmin * img_width
         y1 = bbox.ymin * img_height
@@ -64,122 +107,176 @@ def mediapipe_face_detection(
         x2 = x1 + w
         y2 = y1 + h
 
-        confidences.append(detection.score)
+        confidences.append(detection.score[0])
         bboxes.append([x1, y1, x2, y2])
 
     masks = create_mask_from_bbox(bboxes, image.size)
-    preview = Image.fromarray(preview_array)
 
     return PredictOutput(
-        bboxes=bboxes, masks=masks, confidences=confidences, preview=preview
+        bboxes=bboxes,
+        masks=masks,
+        confidences=confidences,
+        image_size=image.size,
+        render_preview=partial(draw_detections, img_array, pred.detections),
     )
 
 
+def landmarks_to_points(
+    landmarks: Any, size: tuple[int, int], indices: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    Convert normalized face mesh landmarks to pixel coordinates.
+
+    Parameters
+    ----------
+        landmarks: NormalizedLandmarkList
+            one element of `multi_face_landmarks`
+        size: tuple[int, int]
+            (width, height) of the image
+        indices: np.ndarray | None
+            landmark indices to convert. None converts all of them.
+
+    Returns
+    -------
+        np.ndarray
+            int32 array of shape (n, 2)
+    """
+    lands = landmarks.landmark
+    if indices is not None:
+        lands = [lands[i] for i in indices]
+    xy = np.fromiter(
+        (v for land in lands for v in (land.x, land.y)),
+        dtype=np.float64,
+        count=2 * len(lands),
+    ).reshape(-1, 2)
+    return (xy * size).astype(np.int32)
+
+
 def mediapipe_face_mesh(
     image: Image.Image, confidence: float = 0.3
 ) -> PredictOutput[int]:
-    import mediapipe as mp
-
-    mp_face_mesh = mp.solutions.face_mesh
-    draw_util = mp.solutions.drawing_utils
-    drawing_styles = mp.solutions.drawing_styles
-
-    w, h = image.size
+    import cv2
 
-    with mp_face_mesh.FaceMesh(
-        static_image_mode=True, max_num_faces=20, min_detection_confidence=confidence
-    ) as face_mesh:
+    with face_mesh_detector(confidence) as face_mesh:
         arr = np.array(image)
         pred = face_mesh.process(arr)
 
         if pred.multi_face_landmarks is None:
             return PredictOutput()
 
-        preview = arr.copy()
         masks = []
         confidences = []
 
         for landmarks in pred.multi_face_landmarks:
-            draw_util.draw_landmarks(
-                image=preview,
-                landmark_list=landmarks,
-                connections=mp_face_mesh.FACEMESH_TESSELATION,
-                landmark_drawing_spec=None,
-                connection_drawing_spec=drawing_styles.get_default_face_mesh_tesselation_style(),
-            )
-
-            points = np.array(
-                [[land.x * w, land.y * h] for land in landmarks.landmark], dtype=int
-            )
-            outline = cv2.convexHull(points).reshape(-1).tolist()
-
-            mask = Image.new("L", image.size, "black")
-            draw = ImageDraw.Draw(mask)
-            draw.polygon(outline, fill="white")
-            masks.append(mask)
+            points = landmarks_to_points(landmarks, image.size)
+            outline = cv2.convexHull(points).reshape(-1, 2)
+            masks.append(CropMask.from_polygons([outline], image.size))
             confidences.append(1.0)  # Confidence is unknown
 
         bboxes = create_bbox_from_mask(masks, image.size)
-        preview = Image.fromarray(preview)
         return PredictOutput(
-            bboxes=bboxes, masks=masks, confidences=confidences, preview=preview
+            bboxes=bboxes,
+            masks=masks,
+            confidences=confidences,
+            image_size=image.size,
+            render_preview=partial(draw_face_mesh, arr, pred.multi_face_landmarks),
         )
 
 
 def mediapipe_face_mesh_eyes_only(
     image: Image.Image, confidence: float = 0.3
 ) -> PredictOutput[int]:
+    import cv2
     import mediapipe as mp
 
     mp_face_mesh = mp.solutions.face_mesh
 
-    left_idx = np.array(list(mp_face_mesh.FACEMESH_LEFT_EYE)).flatten()
-    right_idx = np.array(list(mp_face_mesh.FACEMESH_RIGHT_EYE)).flatten()
+    left_idx = np.unique(list(mp_face_mesh.FACEMESH_LEFT_EYE))
+    right_idx = np.unique(list(mp_face_mesh.FACEMESH_RIGHT_EYE))
+    indices = np.concatenate([left_idx, right_idx])
 
-    w, h = image.size
-
-    with mp_face_mesh.FaceMesh(
-        static_image_mode=True, max_num_faces=20, min_detection_confidence=confidence
-    ) as face_mesh:
+    with face_mesh_detector(confidence) as face_mesh:
         arr = np.array(image)
         pred = face_mesh.process(arr)
 
         if pred.multi_face_landmarks is None:
             return PredictOutput()
 
-        preview = image.copy()
         masks = []
         confidences = []
 
         for landmarks in pred.multi_face_landmarks:
-            points = np.array(
-                [[land.x * w, land.y * h] for land in landmarks.landmark], dtype=int
-            )
-            left_eyes = points[left_idx]
-            right_eyes = points[right_idx]
-            left_outline = cv2.convexHull(left_eyes).reshape(-1).tolist()
-            right_outline = cv2.convexHull(right_eyes).reshape(-1).tolist()
-
-            mask = Image.new("L", image.size, "black")
-            draw = ImageDraw.Draw(mask)
-            for outline in (left_outline, right_outline):
-                draw.polygon(outline, fill="white")
-            masks.append(mask)
+            points = landmarks_to_points(landmarks, image.size, indices)
+            left_eyes, right_eyes = np.split(points, [len(left_idx)])
+            outlines = [
+                cv2.convexHull(eyes).reshape(-1, 2) for eyes in (left_eyes, right_eyes)
+            ]
+            masks.append(CropMask.from_polygons(outlines, image.size))
             confidences.append(1.0)  # Confidence is unknown
 
         bboxes = create_bbox_from_mask(masks, image.size)
-        preview = draw_preview(preview, bboxes, masks)
         return PredictOutput(
-            bboxes=bboxes, masks=masks, confidences=confidences, preview=preview
+            bboxes=bboxes,
+            masks=masks,
+            confidences=confidences,
+            image_size=image.size,
+            render_preview=partial(draw_preview, image.copy(), bboxes, masks),
+        )
+
+
+def draw_detections(
+    img_array: np.ndarray, detections: Any, indices: list[int] | None = None
+) -> Image.Image:
+    import mediapipe as mp
+
+    if indices is not None:
+        detections = [detections[i] for i in indices]
+
+    draw_util = mp.solutions.drawing_utils
+
+    preview = img_array.copy()
+    for detection in detections:
+        draw_util.draw_detection(preview, detection)
+    return Image.fromarray(preview)
+
+
+def draw_face_mesh(
+    img_array: np.ndarray, multi_face_landmarks: Any, indices: list[int] | None = None
+) -> Image.Image:
+    import mediapipe as mp
+
+    if indices is not None:
+        multi_face_landmarks = [multi_face_landmarks[i] for i in indices]
+
+    mp_face_mesh = mp.solutions.face_mesh
+    draw_util = mp.solutions.drawing_utils
+    drawing_styles = mp.solutions.drawing_styles
+
+    preview = img_array.copy()
+    for landmarks in multi_face_landmarks:
+        draw_util.draw_landmarks(
+            image=preview,
+            landmark_list=landmarks,
+            connections=mp_face_mesh.FACEMESH_TESSELATION,
+            landmark_drawing_spec=None,
+            connection_drawing_spec=drawing_styles.get_default_face_mesh_tesselation_style(),
         )
+    return Image.fromarray(preview)
 
 
 def draw_preview(
-    preview: Image.Image, bboxes: list[list[int]], masks: list[Image.Image]
+    preview: Image.Image,
+    bboxes: list[list[int]],
+    masks: list[CropMask],
+    indices: list[int] | None = None,
 ) -> Image.Image:
+    if indices is not None:
+        bboxes = [bboxes[i] for i in indices]
+        masks = [masks[i] for i in indices]
+
     red = Image.new("RGB", preview.size, "red")
     for mask in masks:
-        masked = Image.composite(red, preview, mask)
+        masked = Image.composite(red, preview, ensure_pil_image(mask, "L"))
         preview = Image.blend(preview, masked, 0.25)
 
     draw = ImageDraw.Draw(preview)
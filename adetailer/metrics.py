@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from typing import Any, Optional
+
+PREFIX = "adetailer_"
+
+# seconds, from a fast detection to a long hires inpaint
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "images_total": "Images processed by ADetailer.",
+    "detections_total": "Objects detected, per model.",
+    "masks_total": "Masks left after filtering and preprocessing, per model.",
+    "inpaint_passes_total": "Successful inpaint passes.",
+    "skipped_passes_total": "Inpaint passes skipped, per reason.",
+    "cond_cache_hits_total": "Prompt conditionings reused between inpaint passes.",
+    "cond_cache_misses_total": "Prompt conditionings computed for inpaint passes.",
+    "model_cache_hits_total": "Detection model loads served from the model cache.",
+    "model_cache_misses_total": "Detection models loaded from disk.",
+    "stage_seconds_total": "Seconds spent in each stage, when ad_timing is enabled.",
+    "stage_calls_total": "Calls of each stage, when ad_timing is enabled.",
+    "detection_seconds": "Detection time, per model.",
+    "batch_detection_seconds": "Detection time of a whole batch, per model.",
+    "inpaint_seconds": "Time of one inpaint pass.",
+    "image_seconds": "ADetailer time for one image.",
+    "warmup_seconds": "Load and first inference time of a warmed up model.",
+}
+
+Labels = tuple[tuple[str, str], ...]
+# a collector returns (name, labels, value) samples of counters kept elsewhere
+Collector = Callable[[], Iterable[tuple[str, dict[str, Any], float]]]
+
+
+def _labels(labels: dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus format.
+
+    Parameters
+    ----------
+        buckets: tuple[float, ...]
+            increasing upper bounds, the +Inf bucket is implicit
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # counts[i] is the number of values in (buckets[i-1], buckets[i]]
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        "(upper bound, number of values <= bound), ending with +Inf."
+        out = []
+        total = 0
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            total += count
+            out.append((bound, total))
+        return out
+
+
+class Metrics:
+    """
+    Thread-safe counters and latency histograms of the extension,
+    exported as json or in the Prometheus text format.
+
+    Parameters
+    ----------
+        buckets: tuple[float, ...]
+            bucket bounds of the histograms, in seconds
+        clock: Callable[[], float]
+            time source of `time`, in seconds
+    """
+
+    def __init__(
+        self,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        self.buckets = buckets
+        self.clock = clock
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+        self.collectors: dict[str, Collector] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    @contextmanager
+    def time(self, name: str, **labels: Any) -> Iterator[None]:
+        "Observe the time spent in the `with` block, unless it raises."
+        start = self.clock()
+        yield
+        self.observe(name, self.clock() - start, **labels)
+
+    def set_collector(self, key: str, collector: Collector) -> None:
+        "Register `collector` under `key`, replacing the previous one."
+        with self._lock:
+            self.collectors[key] = collector
+
+    def _samples(self) -> tuple[dict[tuple[str, Labels], float], list]:
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = [
+                (name, labels, hist.cumulative(), hist.sum, hist.count)
+                for (name, labels), hist in self.histograms.items()
+            ]
+            collectors = list(self.collectors.values())
+
+        for collector in collectors:
+            for name, labels, value in collector():
+                key = (name, _labels(labels))
+                counters[key] = counters.get(key, 0) + value
+        return counters, histograms
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Returns
+        -------
+            dict[str, Any]
+
+            {"counters": {name: [{"labels": {...}, "value": v}]},
+             "histograms": {name: [{"labels": {...}, "buckets": {"0.1": n, ..., "+Inf": n},
+             "sum": s, "count": n}]}}
+        """
+        counters, histograms = self._samples()
+        out: dict[str, Any] = {"counters": {}, "histograms": {}}
+        for (name, labels), value in sorted(counters.items()):
+            out["counters"].setdefault(name, []).append(
+                {"labels": dict(labels), "value": value}
+            )
+        for name, labels, cumulative, total, count in sorted(
+            histograms, key=lambda h: (h[0], h[1])
+        ):
+            out["histograms"].setdefault(name, []).append(
+                {
+                    "labels": dict(labels),
+                    "buckets": {_bound(b): n for b, n in cumulative},
+                    "sum": total,
+                    "count": count,
+                }
+            )
+        return out
+
+    def to_prometheus(self) -> str:
+        "The metrics in the Prometheus text exposition format 0.0.4."
+        counters, histograms = self._samples()
+        lines: list[str] = []
+        last: Optional[str] = None
+        for (name, labels), value in sorted(counters.items()):
+            if name != last:
+                lines.extend(_header(name, "counter"))
+                last = name
+            lines.append(f"{PREFIX}{name}{_format_labels(labels)} {_number(value)}")
+
+        for name, labels, cumulative, total, count in sorted(
+            histograms, key=lambda h: (h[0], h[1])
+        ):
+            if name != last:
+                lines.extend(_header(name, "histogram"))
+                last = name
+            for bound, n in cumulative:
+                le = _format_labels((*labels, ("le", _bound(bound))))
+                lines.append(f"{PREFIX}{name}_bucket{le} {n}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {_number(total)}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def reset(self) -> None:
+        "Drop the counters and histograms, the collectors are kept."
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+def _header(name: str, kind: str) -> list[str]:
+    lines = []
+    if name in HELP:
+        lines.append(f"# HELP {PREFIX}{name} {HELP[name]}")
+    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+    return lines
+
+
+def _bound(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else repr(float(bound))
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + body + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+metrics = Metrics()
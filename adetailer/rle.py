@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+from adetailer.common import PredictOutput
+from adetailer.crop_mask import CropMask
+
+RLE = dict[str, Any]
+SIDECAR_SUFFIX = ".masks.json"
+
+
+def encode(mask: np.ndarray | CropMask | Image.Image) -> RLE:
+    """
+    COCO-style run-length encoding of a mask, the same format as
+    `pycocotools.mask.encode`.
+
+    The mask is read in column-major order and `counts` alternates the
+    lengths of the runs of zeros and non-zeros, starting with zeros.
+
+    Parameters
+    ----------
+        mask: np.ndarray | CropMask | PIL.Image.Image
+            (H, W) mask, every non-zero pixel is foreground
+
+    Returns
+    -------
+        dict[str, Any]
+            {"size": [H, W], "counts": str}
+    """
+    if isinstance(mask, Image.Image):
+        mask = CropMask.from_pil(mask)
+
+    if isinstance(mask, CropMask):
+        width, height = mask.size
+        x1, _, x2, _ = mask.bbox
+        if x1 >= x2:
+            return {
+                "size": [height, width],
+                "counts": counts_to_string([width * height]),
+            }
+        # only the columns of the crop, the others are all zeros
+        cols = mask.window(x1, 0, x2, height)
+        counts = _runs(cols.ravel(order="F") > 0)
+        counts[0] += x1 * height
+        if len(counts) % 2 == 1:
+            counts[-1] += (width - x2) * height
+        elif x2 < width:
+            counts.append((width - x2) * height)
+        return {"size": [height, width], "counts": counts_to_string(counts)}
+
+    height, width = mask.shape[:2]
+    counts = _runs(np.asarray(mask).ravel(order="F") > 0)
+    return {"size": [height, width], "counts": counts_to_string(counts)}
+
+
+def _runs(flat: np.ndarray) -> list[int]:
+    "Lengths of the runs of a flat bool array, starting with a run of False."
+    if flat.size == 0:
+        return [0]
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], changes, [flat.size]))
+    counts = np.diff(bounds).tolist()
+    if flat[0]:
+        counts.insert(0, 0)
+    return counts
+
+
+def decode(rle: RLE) -> np.ndarray:
+    "Decode `rle` into a (H, W) uint8 mask with values 0 or 255."
+    height, width = rle["size"]
+    counts = rle["counts"]
+    if isinstance(counts, (str, bytes)):
+        counts = string_to_counts(counts)
+
+    values = np.zeros(len(counts), dtype=np.uint8)
+    values[1::2] = 255
+    flat = np.repeat(values, counts)
+    if flat.size != height * width:
+        msg = f"[-] ADetailer: RLE counts sum to {flat.size}, expected {height * width}"
+        raise ValueError(msg)
+    return np.ascontiguousarray(flat.reshape((height, width), order="F"))
+
+
+def decode_crop_mask(rle: RLE) -> CropMask:
+    return CropMask.from_array(decode(rle))
+
+
+def area(rle: RLE) -> int:
+    "Number of foreground pixels, without decoding the mask."
+    counts = rle["counts"]
+    if isinstance(counts, (str, bytes)):
+        counts = string_to_counts(counts)
+    return int(sum(counts[1::2]))
+
+
+def counts_to_string(counts: list[int]) -> str:
+    "The compressed `counts` string of pycocotools (`rleToString` in maskApi.c)."
+    out = []
+    for i, count in enumerate(counts):
+        x = count - counts[i - 2] if i > 2 else count
+        more = True
+        while more:
+            c = x & 0x1F
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            out.append(chr(c + 48))
+    return "".join(out)
+
+
+def string_to_counts(s: str | bytes) -> list[int]:
+    "Inverse of `counts_to_string` (`rleFrString` in maskApi.c)."
+    if isinstance(s, bytes):
+        s = s.decode("ascii")
+
+    counts: list[int] = []
+    p = 0
+    while p < len(s):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1F) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+
+def detections_to_json(
+    pred: PredictOutput, masks: list[CropMask] | None = None
+) -> list[dict[str, Any]]:
+    """
+    The detections of `pred` as json-serializable dicts, with the masks
+    encoded as RLE.
+
+    Parameters
+    ----------
+        pred: PredictOutput
+        masks: list[CropMask] | None
+            masks to encode instead of `pred.masks`
+    """
+    if masks is None:
+        masks = pred.masks
+    return [
+        {
+            "bbox": [round(float(v), 2) for v in bbox],
+            "confidence": round(float(conf), 4),
+            "mask": encode(mask),
+        }
+        for bbox, conf, mask in zip(pred.bboxes, pred.confidences, masks)
+    ]
+
+
+def write_sidecar(
+    image_path: str | os.PathLike[str], pred: PredictOutput, **meta: Any
+) -> Path:
+    """
+    Write the detections of `pred` next to `image_path`,
+    as `<name>.masks.json`.
+    """
+    path = Path(image_path).with_suffix(SIDECAR_SUFFIX)
+    data = {
+        **meta,
+        "image_size": list(pred.image_size),
+        "detections": detections_to_json(pred),
+    }
+    path.write_text(json.dumps(data), "utf-8")
+    return path
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from rich import print  # noqa: A004  Shadowing built-in 'print'
+
+SCAN_INDEX_NAME = "scan_index.json"
+
+
+@dataclass
+class DirEntry:
+    mtime_ns: int
+    files: list[str] = field(default_factory=list)
+    dirs: list[str] = field(default_factory=list)
+
+
+class ScanIndex:
+    """
+    Persisted listing of the model directories.
+
+    A directory is listed again only when its mtime changed, which happens
+    when an entry is added, removed or renamed directly in it. Unchanged
+    directories cost a single `stat` call.
+
+    Parameters
+    ----------
+        path: str | os.PathLike[str] | None
+            path of the index json file. None keeps the index in memory.
+        suffixes: tuple[str, ...]
+            suffixes of the files to index
+    """
+
+    def __init__(
+        self,
+        path: str | os.PathLike[str] | None = None,
+        suffixes: tuple[str, ...] = (".pt",),
+    ):
+        self.path = Path(path) if path is not None else None
+        self.suffixes = suffixes
+        self.dirs: dict[str, DirEntry] = {}
+        self.changed = False
+
+    @classmethod
+    def load(
+        cls, path: str | os.PathLike[str], suffixes: tuple[str, ...] = (".pt",)
+    ) -> ScanIndex:
+        "Read the index at `path`. A missing or broken file gives an empty index."
+        index = cls(path, suffixes)
+        try:
+            data = json.loads(index.path.read_text("utf-8"))
+            if data.get("suffixes") == list(suffixes):
+                index.dirs = {
+                    key: DirEntry(**entry) for key, entry in data["dirs"].items()
+                }
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[-] ADetailer: Failed to read scan index {index.path}: {e}")
+        return index
+
+    def save(self) -> None:
+        if self.path is None or not self.changed:
+            return
+        data = {
+            "suffixes": list(self.suffixes),
+            "dirs": {key: asdict(entry) for key, entry in self.dirs.items()},
+        }
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            tmp.write_text(json.dumps(data), "utf-8")
+            tmp.replace(self.path)
+        except OSError as e:
+            print(f"[-] ADetailer: Failed to write scan index {self.path}: {e}")
+            return
+        self.changed = False
+
+    def clear(self) -> None:
+        "Forget every listing, the next scans walk the whole trees."
+        self.dirs.clear()
+        self.changed = True
+
+    def scan(self, root: str | os.PathLike[str]) -> list[Path]:
+        "Files with the suffixes under `root`, listing only the changed directories."
+        root = Path(root)
+        files = []
+        visited = set()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            key = str(path)
+            try:
+                mtime_ns = path.stat().st_mtime_ns
+            except OSError:
+                continue
+
+            entry = self.dirs.get(key)
+            if entry is None or entry.mtime_ns != mtime_ns:
+                entry = self._list_dir(path, mtime_ns)
+                self.dirs[key] = entry
+                self.changed = True
+
+            visited.add(key)
+            files.extend(path / name for name in entry.files)
+            stack.extend(path / name for name in reversed(entry.dirs))
+
+        self._prune(root, visited)
+        return files
+
+    def _list_dir(self, path: Path, mtime_ns: int) -> DirEntry:
+        entry = DirEntry(mtime_ns)
+        try:
+            with os.scandir(path) as it:
+                for item in it:
+                    if item.is_dir(follow_symlinks=False):
+                        entry.dirs.append(item.name)
+                    elif item.name.endswith(self.suffixes) and item.is_file():
+                        entry.files.append(item.name)
+        except OSError:
+            pass
+        entry.files.sort()
+        entry.dirs.sort()
+        return entry
+
+    def _prune(self, root: Path, visited: set[str]) -> None:
+        "Drop the listings of directories under `root` that no longer exist."
+        prefix = str(root) + os.sep
+        stale = [
+            key
+            for key in self.dirs
+            if key not in visited and (key == str(root) or key.startswith(prefix))
+        ]
+        for key in stale:
+            del self.dirs[key]
+        if stale:
+            self.changed = True
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from typing import Optional
+
+# a shared no-op context, so a disabled timer doesn't allocate anything
+_NULL_CONTEXT = nullcontext()
+
+
+class StageTimer:
+    """
+    Wall clock time spent in the stages of ADetailer for one image.
+
+    Parameters
+    ----------
+        enabled: bool
+            a disabled timer records nothing and `stage` costs a function call
+        clock: Callable[[], float]
+            time source, in seconds
+    """
+
+    def __init__(
+        self, enabled: bool = True, clock: Callable[[], float] = time.perf_counter
+    ):
+        self.enabled = enabled
+        self.clock = clock
+        # key: (stage, tab). tab is None for stages outside of a tab
+        self.totals: dict[tuple[str, Optional[int]], float] = {}
+        self.counts: dict[tuple[str, Optional[int]], int] = {}
+
+    def stage(
+        self, name: str, tab: Optional[int] = None
+    ) -> AbstractContextManager[None]:
+        "Add the time spent in the `with` block to `name`."
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._measure(name, tab)
+
+    @contextmanager
+    def _measure(self, name: str, tab: Optional[int]) -> Iterator[None]:
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add(name, self.clock() - start, tab)
+
+    def add(self, name: str, seconds: float, tab: Optional[int] = None) -> None:
+        key = (name, tab)
+        self.totals[key] = self.totals.get(key, 0.0) + seconds
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def by_stage(self) -> dict[str, float]:
+        "Seconds per stage, summed over the tabs, in the order they were first seen."
+        out: dict[str, float] = {}
+        for (name, _), seconds in self.totals.items():
+            out[name] = out.get(name, 0.0) + seconds
+        return out
+
+    def by_tab(self) -> dict[int, float]:
+        out: dict[int, float] = {}
+        for (_, tab), seconds in self.totals.items():
+            if tab is not None:
+                out[tab] = out.get(tab, 0.0) + seconds
+        return out
+
+    def total(self) -> float:
+        return sum(self.totals.values())
+
+    def summary(self) -> str:
+        """
+        One line summary, e.g.
+        "detect 45ms, masks 3ms, inpaint 2.31s (total 2.36s; tab 1 1.20s, tab 2 1.16s)"
+        """
+        stages = ", ".join(
+            f"{name} {format_seconds(seconds)}"
+            for name, seconds in self.by_stage().items()
+        )
+        detail = f"total {format_seconds(self.total())}"
+        tabs = self.by_tab()
+        if len(tabs) > 1:
+            per_tab = ", ".join(
+                f"tab {tab + 1} {format_seconds(seconds)}"
+                for tab, seconds in tabs.items()
+            )
+            detail = f"{detail}; {per_tab}"
+        return f"{stages} ({detail})"
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    return f"{seconds:.2f}s"
+
+
+class TimingRegistry:
+    "Process-wide totals of the stage timers of every processed image."
+
+    def __init__(self):
+        self.images = 0
+        self.totals: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, timer: StageTimer) -> None:
+        if not timer.totals:
+            return
+        with self._lock:
+            self.images += 1
+            for (name, _), seconds in timer.totals.items():
+                self.totals[name] = self.totals.get(name, 0.0) + seconds
+            for (name, _), count in timer.counts.items():
+                self.counts[name] = self.counts.get(name, 0) + count
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        "{stage: {'count': n, 'seconds': total}}"
+        with self._lock:
+            return {
+                name: {"count": self.counts[name], "seconds": seconds}
+                for name, seconds in self.totals.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.images = 0
+            self.totals.clear()
+            self.counts.clear()
+
+
+timing_registry = TimingRegistry()
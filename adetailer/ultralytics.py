@@ -1,18 +1,36 @@
 from __future__ import annotations
 
+from functools import partial
 from pathlib import Path
 from typing import TYPE_CHECKING
 
-import cv2
+import numpy as np
 from PIL import Image
-from torchvision.transforms.functional import to_pil_image
 
 from adetailer import PredictOutput
+from adetailer.cache import LRUCache
 from adetailer.common import create_mask_from_bbox
+from adetailer.crop_mask import CropMask
 
 if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+    from contextlib import AbstractContextManager
+
     import torch
     from ultralytics import YOLO, YOLOWorld
+    from ultralytics.engine.results import Results
+
+
+def model_nbytes(model: YOLO | YOLOWorld) -> int:
+    module = model.model
+    tensors = [*module.parameters(), *module.buffers()]
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+# key: (model path, device, classes)
+model_cache: LRUCache[tuple[str, str, tuple[str, ...]], YOLO | YOLOWorld] = LRUCache(
+    max_entries=2, sizeof=model_nbytes
+)
 
 
 def ultralytics_predict(
@@ -22,39 +40,127 @@ def ultralytics_predict(
     device: str = "",
     classes: str = "",
 ) -> PredictOutput[float]:
-    from ultralytics import YOLO
+    with use_model(model_path, device, classes) as model:
+        pred = model(image, conf=confidence, device=device)
+    return to_predict_output(pred[0], image.size)
+
 
-    model = YOLO(model_path)
-    apply_classes(model, model_path, classes)
-    pred = model(image, conf=confidence, device=device)
+def ultralytics_predict_batch(
+    model_path: str | Path,
+    images: list[Image.Image],
+    confidence: float = 0.3,
+    device: str = "",
+    classes: str = "",
+) -> list[PredictOutput[float]]:
+    """
+    Same as `ultralytics_predict`, but runs all images through the model
+    in a single forward pass.
+    """
+    if not images:
+        return []
+
+    with use_model(model_path, device, classes) as model:
+        preds = model(images, conf=confidence, device=device)
+    return [to_predict_output(pred, image.size) for pred, image in zip(preds, images)]
+
+
+def to_predict_output(pred: Results, shape: tuple[int, int]) -> PredictOutput[float]:
+    """
+    Parameters
+    ----------
+    pred: ultralytics.engine.results.Results
+        result of a single image
 
-    bboxes = pred[0].boxes.xyxy.cpu().numpy()
+    shape: tuple[int, int]
+        (W, H) of the original image
+    """
+    bboxes = pred.boxes.xyxy.cpu().numpy()
     if bboxes.size == 0:
         return PredictOutput()
-    bboxes = bboxes.tolist()
 
-    if pred[0].masks is None:
-        masks = create_mask_from_bbox(bboxes, image.size)
+    if pred.masks is None:
+        masks = create_mask_from_bbox(bboxes, shape)
     else:
-        masks = mask_to_pil(pred[0].masks.data, image.size)
+        masks = mask_to_crop_mask(pred.masks.data, shape)
 
-    confidences = pred[0].boxes.conf.cpu().numpy().tolist()
-
-    preview = pred[0].plot()
-    preview = cv2.cvtColor(preview, cv2.COLOR_BGR2RGB)
-    preview = Image.fromarray(preview)
+    confidences = pred.boxes.conf.cpu().numpy()
 
     return PredictOutput(
-        bboxes=bboxes, masks=masks, confidences=confidences, preview=preview
+        bboxes=bboxes,
+        masks=masks,
+        confidences=confidences,
+        image_size=shape,
+        render_preview=partial(plot_preview, pred),
     )
 
 
-def apply_classes(model: YOLO | YOLOWorld, model_path: str | Path, classes: str):
+def plot_preview(pred: Results, indices: list[int] | None = None) -> Image.Image:
+    import cv2
+
+    if indices is not None:
+        pred = pred[indices]
+    preview = pred.plot()
+    preview = cv2.cvtColor(preview, cv2.COLOR_BGR2RGB)
+    return Image.fromarray(preview)
+
+
+def load_model(
+    model_path: str | Path, device: str = "", classes: str = ""
+) -> YOLO | YOLOWorld:
+    """
+    Load a YOLO model, reusing a cached instance if one was already loaded
+    with the same path, device and classes.
+
+    The instance is shared, run it through `use_model` instead.
+    """
+    return model_cache.get(*_model_entry(model_path, device, classes))
+
+
+def use_model(
+    model_path: str | Path, device: str = "", classes: str = ""
+) -> AbstractContextManager[YOLO | YOLOWorld]:
+    """
+    Same as `load_model`, but the model is used by one thread at a time
+    until the end of the `with` block: ultralytics predictors are not
+    thread-safe, and the api and the generation share the cached models.
+    """
+    return model_cache.use(*_model_entry(model_path, device, classes))
+
+
+def _model_entry(
+    model_path: str | Path, device: str, classes: str
+) -> tuple[tuple[str, str, tuple[str, ...]], Callable[[], YOLO | YOLOWorld]]:
+    from ultralytics import YOLO
+
+    def factory() -> YOLO | YOLOWorld:
+        model = YOLO(model_path)
+        apply_classes(model, model_path, classes)
+        return model
+
+    key = (str(model_path), device, parse_classes(model_path, classes))
+    return key, factory
+
+
+def evict_model(model_path: str | Path) -> None:
+    "Drop every cached instance of `model_path`."
+    path = str(model_path)
+    model_cache.evict(lambda key: key[0] == path)
+
+
+def clear_model_cache() -> None:
+    model_cache.clear()
+
+
+def parse_classes(model_path: str | Path, classes: str) -> tuple[str, ...]:
     if not classes or "-world" not in Path(model_path).stem:
-        return
-    parsed = [c.strip() for c in classes.split(",") if c.strip()]
+        return ()
+    return tuple(c.strip() for c in classes.split(",") if c.strip())
+
+
+def apply_classes(model: YOLO | YOLOWorld, model_path: str | Path, classes: str):
+    parsed = parse_classes(model_path, classes)
     if parsed:
-        model.set_classes(parsed)
+        model.set_classes(list(parsed))
 
 
 def mask_to_pil(masks: torch.Tensor, shape: tuple[int, int]) -> list[Image.Image]:
@@ -62,10 +168,74 @@ def mask_to_pil(masks: torch.Tensor, shape: tuple[int, int]) -> list[Image.Image
     Parameters
     ----------
     masks: torch.Tensor, dtype=torch.float32, shape=(N, H, W).
-        The device can be CUDA, but `to_pil_image` takes care of that.
+        The device can be CUDA.
+
+    shape: tuple[int, int]
+        (W, H) of the original image
+    """
+    return [Image.fromarray(arr) for arr in scale_masks(masks, shape)]
+
+
+def mask_to_crop_mask(masks: torch.Tensor, shape: tuple[int, int]) -> list[CropMask]:
+    """
+    Same as `mask_to_pil`, but each mask is cropped to its bounding box.
+    """
+    crops = []
+    for arr in scale_masks(masks, shape):
+        rows = np.flatnonzero(arr.any(axis=1))
+        if rows.size == 0:
+            crops.append(CropMask.empty(shape))
+            continue
+        cols = np.flatnonzero(arr.any(axis=0))
+        y1, y2 = rows[0], rows[-1] + 1
+        x1, x2 = cols[0], cols[-1] + 1
+        crop = arr[y1:y2, x1:x2].copy()
+        crops.append(CropMask(crop, int(x1), int(y1), shape))
+    return crops
+
+
+# upper bound of mask pixels interpolated at once, 128M float32 = 512MB
+MASK_CHUNK_PIXELS = 2**27
+
+
+def scale_masks(masks: torch.Tensor, shape: tuple[int, int]) -> Iterator[np.ndarray]:
+    """
+    Remove the letterbox padding from the masks, resize all of them to the
+    original image size in one batched interpolation and copy the result
+    to host memory at once.
+
+    Parameters
+    ----------
+    masks: torch.Tensor, shape=(N, h, w)
+        masks in the model input resolution (letterboxed)
 
     shape: tuple[int, int]
         (W, H) of the original image
+
+    Yields
+    ------
+    np.ndarray
+        uint8 mask of shape (H, W) with values 0 or 255
     """
-    n = masks.shape[0]
-    return [to_pil_image(masks[i], mode="L").resize(shape) for i in range(n)]
+    import torch
+    from torch.nn.functional import interpolate
+
+    width, height = shape
+    mh, mw = masks.shape[1:]
+    gain = min(mh / height, mw / width)
+    pad_w = (mw - width * gain) / 2
+    pad_h = (mh - height * gain) / 2
+    top, left = round(pad_h - 0.1), round(pad_w - 0.1)
+    bottom, right = mh - round(pad_h + 0.1), mw - round(pad_w + 0.1)
+    masks = masks[:, top:bottom, left:right]
+
+    chunk = max(MASK_CHUNK_PIXELS // (width * height), 1)
+    for i in range(0, masks.shape[0], chunk):
+        scaled = interpolate(
+            masks[None, i : i + chunk].float(),
+            size=(height, width),
+            mode="bilinear",
+            align_corners=False,
+        )[0]
+        arrs = (scaled > 0.5).to(torch.uint8).mul_(255).cpu().numpy()
+        yield from arrs
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+from PIL import Image
+
+from adetailer.mediapipe import mediapipe_predict
+from adetailer.ultralytics import load_model, ultralytics_predict
+
+# a typical generation size, the models letterbox the input anyway
+WARMUP_SIZE = 1024
+
+
+@dataclass
+class WarmupResult:
+    """
+    Seconds spent warming up a detection model.
+
+    `load` is 0 when the model was already in the cache, `inference` is the
+    first inference, which pays for the device initialization.
+    """
+
+    model: str
+    load: float = 0.0
+    inference: float = 0.0
+    error: str = ""
+
+    @property
+    def total(self) -> float:
+        return self.load + self.inference
+
+    def to_json(self) -> dict[str, Any]:
+        return {**asdict(self), "total": self.total}
+
+
+def warmup_model(
+    name: str,
+    model_path: str | Path,
+    device: str = "",
+    size: int = WARMUP_SIZE,
+    classes: str = "",
+) -> WarmupResult:
+    """
+    Load `model_path` into the model cache and run one inference on a blank
+    `size` x `size` image. Errors are reported in the result, not raised.
+    """
+    result = WarmupResult(name)
+    image = Image.new("RGB", (size, size))
+    try:
+        if name.lower().startswith("mediapipe"):
+            # the detector is created and pooled by the first inference
+            start = time.perf_counter()
+            mediapipe_predict(name, image, strict=True)
+            result.inference = time.perf_counter() - start
+            return result
+
+        start = time.perf_counter()
+        load_model(model_path, device, classes)
+        result.load = time.perf_counter() - start
+
+        # under the lock of the model, a generation may be using it
+        start = time.perf_counter()
+        ultralytics_predict(model_path, image=image, device=device, classes=classes)
+        result.inference = time.perf_counter() - start
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+def warmup(
+    models: dict[str, str],
+    device: str = "",
+    size: int = WARMUP_SIZE,
+    classes: str = "",
+) -> list[WarmupResult]:
+    """
+    Warm up every model of `models`, {name: path}, in order.
+
+    `classes` only applies to YOLO-World models. They are cached per set of
+    classes, so a generation only uses the warmed up model with the same
+    `ad_model_classes`.
+    """
+    return [
+        warmup_model(name, path, device=device, size=size, classes=classes)
+        for name, path in models.items()
+    ]
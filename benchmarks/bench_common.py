@@ -0,0 +1,36 @@
+"""
+Masks from bounding boxes and bounding boxes from masks.
+
+    pytest benchmarks/bench_common.py --benchmark-group-by=func,param:n
+"""
+
+from __future__ import annotations
+
+import pytest
+
+from adetailer.common import create_bbox_from_mask, create_mask_from_bbox
+from benchmarks.synthetic import (
+    COUNTS,
+    SIZES,
+    make_bboxes,
+    make_crop_masks,
+    make_pil_masks,
+)
+
+
+@pytest.mark.parametrize("n", COUNTS)
+@pytest.mark.parametrize("size", SIZES)
+def test_create_mask_from_bbox(benchmark, size: int, n: int):
+    bboxes = make_bboxes(n, size)
+    masks = benchmark(create_mask_from_bbox, bboxes, (size, size))
+    assert len(masks) == n
+
+
+@pytest.mark.parametrize("n", COUNTS)
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("kind", ["crop", "pil"])
+def test_create_bbox_from_mask(benchmark, kind: str, size: int, n: int):
+    make = make_crop_masks if kind == "crop" else make_pil_masks
+    masks = make(n, size)
+    bboxes = benchmark(create_bbox_from_mask, masks, (size, size))
+    assert len(bboxes) == n
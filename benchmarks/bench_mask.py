@@ -0,0 +1,78 @@
+"""
+Mask filters, sorting and preprocessing, on the masks of synthetic detections.
+
+    pytest benchmarks/bench_mask.py --benchmark-group-by=func,param:size
+"""
+
+from __future__ import annotations
+
+import pytest
+
+from adetailer.mask import (
+    filter_and_sort,
+    filter_by_confidence,
+    filter_by_ratio,
+    filter_k_largest,
+    filter_k_most_confident,
+    has_intersection,
+    mask_preprocess,
+    sort_bboxes,
+)
+from benchmarks.synthetic import (
+    COUNTS,
+    SIZES,
+    make_crop_masks,
+    make_pil_masks,
+    make_pred,
+)
+
+
+@pytest.mark.parametrize("n", COUNTS)
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("kind", ["crop", "pil"])
+def test_mask_preprocess(benchmark, kind: str, size: int, n: int):
+    make = make_crop_masks if kind == "crop" else make_pil_masks
+    masks = make(n, size)
+    out = benchmark(mask_preprocess, masks, kernel=8, x_offset=4, y_offset=-4)
+    assert len(out) == n
+
+
+@pytest.mark.parametrize("merge_invert", ["Merge", "Merge and Invert"])
+@pytest.mark.parametrize("size", SIZES)
+def test_mask_preprocess_merge(benchmark, size: int, merge_invert: str):
+    masks = make_crop_masks(10, size)
+    out = benchmark(mask_preprocess, masks, kernel=8, merge_invert=merge_invert)
+    assert len(out) == 1
+
+
+FILTERS = {
+    "filter_by_ratio": lambda pred: filter_by_ratio(pred, low=0.01, high=0.03),
+    "filter_by_confidence": lambda pred: filter_by_confidence(pred, 0.6),
+    "filter_k_largest": lambda pred: filter_k_largest(pred, k=3),
+    "filter_k_most_confident": lambda pred: filter_k_most_confident(pred, k=3),
+    "sort_bboxes": lambda pred: sort_bboxes(pred, order=2),
+    "filter_and_sort": lambda pred: filter_and_sort(
+        pred, low=0.01, high=0.03, k=3, by="Area", order=2
+    ),
+}
+
+
+@pytest.mark.parametrize("n", COUNTS)
+@pytest.mark.parametrize("name", FILTERS)
+def test_filters(benchmark, name: str, n: int):
+    # the filters only look at the boxes, the image size doesn't matter
+    pred = make_pred(n, 1024)
+    out = benchmark(FILTERS[name], pred)
+    assert len(out) <= n
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("kind", ["crop", "pil"])
+@pytest.mark.parametrize("overlap", [True, False], ids=["overlap", "disjoint"])
+def test_has_intersection(benchmark, overlap: bool, kind: str, size: int):
+    make = make_crop_masks if kind == "crop" else make_pil_masks
+    masks = make(50, size)
+    # the first mask against the next one that (doesn't) intersect it
+    first = masks[0]
+    other = next(m for m in masks[1:] if has_intersection(first, m) is overlap)
+    assert benchmark(has_intersection, first, other) is overlap
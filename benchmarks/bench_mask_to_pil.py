@@ -0,0 +1,43 @@
+"""
+Per-mask cost of converting segmentation masks to full-size masks.
+
+    pytest benchmarks/bench_mask_to_pil.py --benchmark-group-by=param:n
+"""
+
+from __future__ import annotations
+
+import pytest
+import torch
+from torchvision.transforms.functional import to_pil_image
+
+from adetailer.ultralytics import mask_to_crop_mask, mask_to_pil
+
+SHAPE = (1024, 1536)  # (W, H) of the original image
+INPUT = (640, 448)  # (h, w) of the letterboxed model input
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def per_mask_to_pil(masks: torch.Tensor, shape: tuple[int, int]):
+    "The previous implementation: one host copy and one resize per mask."
+    return [to_pil_image(masks[i], mode="L").resize(shape) for i in range(len(masks))]
+
+
+def make_masks(n: int) -> torch.Tensor:
+    gen = torch.Generator().manual_seed(n)
+    masks = torch.zeros(n, *INPUT)
+    for i in range(n):
+        y, x = torch.randint(0, INPUT[0] - 64, (2,), generator=gen).tolist()
+        masks[i, y : y + 64, x : x + 48] = 1
+    return masks.to(DEVICE)
+
+
+@pytest.mark.parametrize("n", [1, 5, 10, 25, 50])
+@pytest.mark.parametrize(
+    "func", [per_mask_to_pil, mask_to_pil, mask_to_crop_mask], ids=lambda f: f.__name__
+)
+def test_mask_to_pil(benchmark, func, n: int):
+    masks = make_masks(n)
+    result = benchmark(func, masks, SHAPE)
+    assert len(result) == n
+    if benchmark.stats is not None:  # None with --benchmark-disable
+        benchmark.extra_info["ms_per_mask"] = benchmark.stats.stats.mean * 1000 / n
@@ -0,0 +1,32 @@
+"""
+Removal of the exclusion words from prompts.
+
+    pytest benchmarks/bench_prompt.py
+"""
+
+from __future__ import annotations
+
+import pytest
+
+from adetailer.prompt_processor import process_prompt_with_exclusions
+
+TAGS = [
+    "masterpiece",
+    "best quality",
+    "(detailed face:1.2)",
+    "[blue eyes]",
+    "smile",
+    "long hair",
+    "(red dress, lace:1.1)",
+    "outdoors",
+    "sunlight",
+    "<lora:detail:0.6>",
+]
+EXCLUSIONS = "smile\nlace\nsunlight\nred dress"
+
+
+@pytest.mark.parametrize("n_tags", [10, 50, 200])
+def test_process_prompt_with_exclusions(benchmark, n_tags: int):
+    prompt = ", ".join(TAGS[i % len(TAGS)] for i in range(n_tags))
+    out = benchmark(process_prompt_with_exclusions, prompt, EXCLUSIONS)
+    assert "smile" not in out
@@ -0,0 +1,53 @@
+"""
+A CPU YOLO detection, from the PIL image to the `PredictOutput`.
+
+The models are built from the ultralytics configs with random weights, so no
+download is needed and the numbers only depend on the architecture. The
+torch threads are fixed for comparable numbers across machines.
+
+    pytest benchmarks/bench_yolo.py --benchmark-group-by=param:model
+"""
+
+from __future__ import annotations
+
+import pytest
+import torch
+
+from adetailer.args import DetectArgs
+from adetailer.detect import detect
+from adetailer.ultralytics import clear_model_cache, ultralytics_predict
+from benchmarks.synthetic import SIZES, make_image
+
+THREADS = 4
+MODELS = ["yolov8n.yaml", "yolov8n-seg.yaml"]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _torch_threads():
+    threads = torch.get_num_threads()
+    torch.set_num_threads(THREADS)
+    yield
+    torch.set_num_threads(threads)
+    clear_model_cache()
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("model", MODELS)
+def test_ultralytics_predict(benchmark, model: str, size: int):
+    image = make_image(size)
+    # the first call loads the model, it's not part of the measure
+    ultralytics_predict(model, image, confidence=0.01, device="cpu")
+    pred = benchmark(ultralytics_predict, model, image, confidence=0.01, device="cpu")
+    # random weights rarely detect anything, the forward pass is what's measured
+    assert pred.bboxes.shape[1] == 4
+
+
+@pytest.mark.parametrize("batch", [1, 4])
+def test_detect(benchmark, batch: int):
+    "The whole detection path of the detect endpoint and the cli."
+    model = "yolov8n-seg.yaml"
+    images = [make_image(1024, seed) for seed in range(batch)]
+    args = DetectArgs(ad_model=model, ad_confidence=0.01)
+    detect(images[:1], args, model_path=model, device="cpu")
+    results = benchmark(detect, images, args, model_path=model, device="cpu")
+    assert len(results) == batch
@@ -0,0 +1,54 @@
+"""
+Deterministic synthetic inputs shared by the benchmarks.
+
+Every function is seeded by its arguments, so two runs benchmark the same
+images, boxes and masks.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+from PIL import Image
+
+from adetailer import PredictOutput
+from adetailer.common import create_mask_from_bbox
+from adetailer.crop_mask import CropMask
+
+# square images of side `size`
+SIZES = [512, 1024, 2048, 4096]
+# detections per image
+COUNTS = [1, 10, 50]
+
+
+def make_bboxes(n: int, size: int, seed: int = 0) -> np.ndarray:
+    "(n, 4) boxes with sides between 5% and 20% of the image."
+    rng = np.random.default_rng((seed, n, size))
+    wh = rng.uniform(0.05, 0.2, (n, 2)) * size
+    xy = rng.uniform(0, 1, (n, 2)) * (size - wh)
+    return np.concatenate([xy, xy + wh], axis=1).round(2)
+
+
+def make_pred(n: int, size: int, seed: int = 0) -> PredictOutput[float]:
+    bboxes = make_bboxes(n, size, seed)
+    rng = np.random.default_rng((seed, n, size, 1))
+    return PredictOutput(
+        bboxes=bboxes,
+        masks=create_mask_from_bbox(bboxes, (size, size)),
+        confidences=rng.uniform(0.3, 1.0, n),
+        image_size=(size, size),
+    )
+
+
+def make_crop_masks(n: int, size: int, seed: int = 0) -> list[CropMask]:
+    return make_pred(n, size, seed).masks
+
+
+def make_pil_masks(n: int, size: int, seed: int = 0) -> list[Image.Image]:
+    return [mask.to_pil() for mask in make_crop_masks(n, size, seed)]
+
+
+def make_image(size: int, seed: int = 0) -> Image.Image:
+    "RGB noise, so that no codec or model shortcut applies."
+    rng = np.random.default_rng((seed, size))
+    arr = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    return Image.fromarray(arr)
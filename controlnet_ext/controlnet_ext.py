@@ -5,6 +5,8 @@ import sys
 from functools import lru_cache
 from pathlib import Path
 
+from adetailer.cache import ModelHashCache
+from adetailer.scan_index import ScanIndex
 from modules import extensions, sd_models, shared
 from modules.paths import extensions_builtin_dir, extensions_dir, models_path
 
@@ -113,24 +115,27 @@ def _get_cn_models() -> list[str]:
     """
     Since we can't import ControlNet, we use a function that does something like
     controlnet's `list(global_state.cn_models_names.values())`.
+
+    The directory listings and the model hashes are kept in `models/adetailer`,
+    so a restart only reads the directories and files that changed.
     """
     cn_model_exts = (".pt", ".pth", ".ckpt", ".safetensors")
     dirs = get_cn_model_dirs()
     name_filter = shared.opts.data.get("control_net_models_name_filter", "")
     name_filter = name_filter.strip(" ").lower()
 
+    cache_dir = Path(models_path, "adetailer")
+    scan_index = ScanIndex.load(cache_dir / "cn_scan_index.json", cn_model_exts)
+    hash_cache = ModelHashCache.load(cache_dir / "cn_model_hashes.json")
+
     model_paths = []
 
     for base in dirs:
-        if not base.exists():
+        if not base.is_dir():
             continue
 
-        for p in base.rglob("*"):
-            if (
-                p.is_file()
-                and p.suffix in cn_model_exts
-                and cn_model_regex.search(p.name)
-            ):
+        for p in scan_index.scan(base):
+            if cn_model_regex.search(p.name):
                 if name_filter and name_filter not in p.name.lower():
                     continue
                 model_paths.append(p)
@@ -138,9 +143,13 @@ def _get_cn_models() -> list[str]:
 
     models = []
     for p in model_paths:
-        model_hash = sd_models.model_hash(p)
+        model_hash = hash_cache.get(p, sd_models.model_hash)
         name = f"{p.stem} [{model_hash}]"
         models.append(name)
+
+    if cache_dir.is_dir():
+        scan_index.save()
+        hash_cache.save()
     return models
 
 
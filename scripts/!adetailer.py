@@ -3,25 +3,32 @@ from __future__ import annotations
 import platform
 import re
 import sys
+import threading
 import traceback
 from collections.abc import Sequence
+from contextlib import AbstractContextManager, nullcontext
 from copy import copy
 from functools import partial
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, NamedTuple, cast
+from typing import TYPE_CHECKING, Any, Literal, NamedTuple, cast
 
 import gradio as gr
+from fastapi import HTTPException
+from fastapi.responses import PlainTextResponse
 from PIL import Image, ImageChops
 from rich import print  # noqa: A004  Shadowing built-in 'print'
 
 import modules
 from aaaaaa.conditional import create_binary_mask, schedulers
 from aaaaaa.helper import (
+    ConditioningCache,
+    PPBatchList,
     PPImage,
     copy_extra_params,
     disable_safe_unpickle,
     pause_total_tqdm,
     preserve_prompts,
+    samples_to_pil,
 )
 from aaaaaa.p_method import (
     get_i,
@@ -39,6 +46,7 @@ from adetailer import (
     get_models,
     mediapipe_predict,
     ultralytics_predict,
+    ultralytics_predict_batch,
 )
 from adetailer.args import (
     BBOX_SORTBY,
@@ -46,19 +54,38 @@ from adetailer.args import (
     INPAINT_BBOX_MATCH_MODES,
     SCRIPT_DEFAULT,
     ADetailerArgs,
+    DetectRequest,
     InpaintBBoxMatchMode,
     SkipImg2ImgOrig,
+    WarmupRequest,
 )
-from adetailer.common import PredictOutput, ensure_pil_image, safe_mkdir
+from adetailer.common import (
+    DEFAULT_MODELS,
+    PredictOutput,
+    ensure_pil_image,
+    image_fingerprint,
+    resolve_models,
+    safe_mkdir,
+)
+from adetailer.crop_mask import CropMask, to_crop_mask
+from adetailer.detect import decode_image, detect
+from adetailer.inpaint import InpaintJob, paste_back, plan_batches
+from adetailer.manifest import MANIFEST_NAME, ModelManifest
 from adetailer.mask import (
-    filter_by_ratio,
-    filter_k_by,
+    filter_and_sort,
+    filter_by_confidence,
     has_intersection,
     is_all_black,
     mask_preprocess,
-    sort_bboxes,
 )
+from adetailer.mediapipe import close_detectors
+from adetailer.metrics import metrics
 from adetailer.opts import dynamic_denoise_strength, optimal_crop_size
+from adetailer.rle import write_sidecar
+from adetailer.scan_index import SCAN_INDEX_NAME, ScanIndex
+from adetailer.timing import StageTimer, format_seconds, timing_registry
+from adetailer.ultralytics import clear_model_cache, model_cache
+from adetailer.warmup import WARMUP_SIZE, WarmupResult, warmup
 from controlnet_ext import (
     CNHijackRestore,
     ControlNetExt,
@@ -67,7 +94,7 @@ from controlnet_ext import (
     controlnet_type,
     get_cn_models,
 )
-from modules import images, paths, script_callbacks, scripts, shared
+from modules import devices, images, paths, script_callbacks, scripts, shared
 from modules.devices import NansException
 from modules.processing import (
     Processed,
@@ -83,17 +110,26 @@ if TYPE_CHECKING:
     from fastapi import FastAPI
 
 PARAMS_TXT = "params.txt"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
 
 no_huggingface = getattr(cmd_opts, "ad_no_huggingface", False)
 adetailer_dir = Path(paths.models_path, "adetailer")
 safe_mkdir(adetailer_dir)
 
+# the default models are resolved from the manifest and the local huggingface cache,
+# huggingface itself is only checked in the background after startup
+model_manifest = ModelManifest.load(adetailer_dir / MANIFEST_NAME)
+# only the model directories that changed since the last launch are listed
+scan_index = ScanIndex.load(adetailer_dir / SCAN_INDEX_NAME)
 extra_models_dirs = shared.opts.data.get("ad_extra_models_dir", "")
 model_mapping = get_models(
     adetailer_dir,
     *extra_models_dirs.split("|"),
     huggingface=not no_huggingface,
+    manifest=model_manifest,
+    index=scan_index,
 )
+scan_index.save()
 
 txt2img_submit_button = img2img_submit_button = None
 txt2img_submit_button = cast(gr.Button, txt2img_submit_button)
@@ -137,6 +173,7 @@ class AfterDetailerScript(scripts.Script):
             i2i_button=img2img_submit_button,
             checkpoints_list=checkpoint_list,
             vae_list=vae_list,
+            rescan_models=partial(rescan_models, full=True),
         )
 
         components, infotext_fields = adui(num_models, is_img2img, webui_info)
@@ -277,6 +314,14 @@ class AfterDetailerScript(scripts.Script):
 
         return ""
 
+    @staticmethod
+    def configure_model_cache() -> None:
+        max_models = opts.data.get("ad_model_cache_size", 2)
+        max_mb = opts.data.get("ad_model_cache_max_mb", 0)
+        model_cache.configure(
+            max_entries=int(max_models), max_bytes=int(max_mb * 1024 * 1024)
+        )
+
     def prompt_blank_replacement(
         self, all_prompts: list[str], i: int, default: str
     ) -> str:
@@ -570,9 +615,10 @@ class AfterDetailerScript(scripts.Script):
 
         return i2i
 
-    def save_image(self, p, image, *, condition: str, suffix: str) -> None:
+    def save_image(self, p, image, *, condition: str, suffix: str) -> str | None:
+        "Save `image` if the `condition` option is on. Returns the saved path."
         if not opts.data.get(condition, False):
-            return
+            return None
 
         i = get_i(p)
         if p.all_prompts:
@@ -587,17 +633,19 @@ class AfterDetailerScript(scripts.Script):
         if not ad_save_images_dir.strip():
             ad_save_images_dir = p.outpath_samples
 
-        images.save_image(
-            image=image,
-            path=ad_save_images_dir,
-            basename="",
-            seed=seed,
-            prompt=save_prompt,
-            extension=opts.samples_format,
-            info=self.infotext(p),
-            p=p,
-            suffix=suffix,
-        )
+        with self.stage(p, "save"):
+            fullfn, _ = images.save_image(
+                image=image,
+                path=ad_save_images_dir,
+                basename="",
+                seed=seed,
+                prompt=save_prompt,
+                extension=opts.samples_format,
+                info=self.infotext(p),
+                p=p,
+                suffix=suffix,
+            )
+        return fullfn
 
     def get_ad_model(self, name: str):
         if name not in model_mapping:
@@ -605,17 +653,98 @@ class AfterDetailerScript(scripts.Script):
             raise ValueError(msg)
         return model_mapping[name]
 
-    def sort_bboxes(self, pred: PredictOutput) -> PredictOutput:
-        sortby = opts.data.get("ad_bbox_sortby", BBOX_SORTBY[0])
-        sortby_idx = BBOX_SORTBY.index(sortby)
-        return sort_bboxes(pred, sortby_idx)
+    @staticmethod
+    def detection_key(args: ADetailerArgs, image: Image.Image) -> tuple[Any, ...]:
+        # mediapipe results can't be refiltered by confidence, reuse them only as is
+        confidence = args.ad_confidence if args.is_mediapipe() else None
+        return (
+            args.ad_model,
+            args.ad_model_classes,
+            confidence,
+            image_fingerprint(image),
+        )
+
+    @staticmethod
+    def detection_confidence(
+        args: ADetailerArgs, arg_list: Sequence[ADetailerArgs]
+    ) -> float:
+        "The lowest confidence among the tabs that detect with the same model as `args`."
+        if args.is_mediapipe():
+            return args.ad_confidence
+        confidences = [
+            arg.ad_confidence
+            for arg in arg_list
+            if not arg.need_skip()
+            and arg.ad_model == args.ad_model
+            and arg.ad_model_classes == args.ad_model_classes
+        ]
+        return min([args.ad_confidence, *confidences])
+
+    def predict(
+        self,
+        p,
+        args: ADetailerArgs,
+        image: Image.Image,
+        confidence: float | None = None,
+    ) -> PredictOutput:
+        """
+        Detection result of `args` on `image`.
+
+        Results are memoized on `p` by model and image content. A miss detects
+        at `confidence` (the lowest one of the tabs sharing the model), so the
+        other tabs only refilter the result by their own `ad_confidence`.
+        """
+        memo = getattr(p, "_ad_detections", None)
+        if memo is None:
+            memo = p._ad_detections = {}
+
+        key = self.detection_key(args, image)
+        item = memo.get(key)
+        if item is None or item[0] > args.ad_confidence:
+            if confidence is None or confidence > args.ad_confidence:
+                confidence = args.ad_confidence
+            with metrics.time("detection_seconds", model=args.ad_model):
+                pred = self._predict(args, image, confidence)
+            item = memo[key] = (confidence, pred)
+
+        memo_confidence, pred = item
+        if memo_confidence == args.ad_confidence:
+            return pred
+        return filter_by_confidence(pred, args.ad_confidence)
+
+    def _predict(
+        self, args: ADetailerArgs, image: Image.Image, confidence: float
+    ) -> PredictOutput:
+        if args.is_mediapipe():
+            return mediapipe_predict(args.ad_model, image, confidence)
+
+        ad_model = self.get_ad_model(args.ad_model)
+        with disable_safe_unpickle():
+            return ultralytics_predict(
+                ad_model,
+                image=image,
+                confidence=confidence,
+                device=self.ultralytics_device,
+                classes=args.ad_model_classes,
+            )
 
-    def pred_preprocessing(self, p, pred: PredictOutput, args: ADetailerArgs):
-        pred = filter_by_ratio(
-            pred, low=args.ad_mask_min_ratio, high=args.ad_mask_max_ratio
+    @staticmethod
+    def bbox_sort_order() -> int:
+        sortby = opts.data.get("ad_bbox_sortby", BBOX_SORTBY[0])
+        return BBOX_SORTBY.index(sortby)
+
+    def pred_preprocessing(
+        self, p, pred: PredictOutput, args: ADetailerArgs
+    ) -> tuple[PredictOutput, list[CropMask]]:
+        "The detections kept by the mask filters, and their preprocessed masks."
+        pred = filter_and_sort(
+            pred,
+            low=args.ad_mask_min_ratio,
+            high=args.ad_mask_max_ratio,
+            k=args.ad_mask_k,
+            by=args.ad_mask_filter_method,
+            order=self.bbox_sort_order(),
         )
-        pred = filter_k_by(pred, k=args.ad_mask_k, by=args.ad_mask_filter_method)
-        pred = self.sort_bboxes(pred)
         masks = mask_preprocess(
             pred.masks,
             kernel=args.ad_dilate_erode,
@@ -624,21 +753,23 @@ class AfterDetailerScript(scripts.Script):
             merge_invert=args.ad_mask_merge_invert,
         )
 
-        if is_img2img_inpaint(p) and not is_inpaint_only_masked(p):
-            image_mask = self.get_image_mask(p)
+        if masks and is_img2img_inpaint(p) and not is_inpaint_only_masked(p):
+            image_mask = self.get_image_crop_mask(p, masks[0].size)
             masks = self.inpaint_mask_filter(image_mask, masks)
-        return masks
+        return pred, masks
 
     @staticmethod
-    def i2i_prompts_replace(
-        i2i, prompts: list[str], negative_prompts: list[str], j: int
-    ) -> None:
+    def prompt_at(
+        prompts: list[str], negative_prompts: list[str], j: int
+    ) -> tuple[str, str]:
         i1 = min(j, len(prompts) - 1)
         i2 = min(j, len(negative_prompts) - 1)
-        prompt = prompts[i1]
-        negative_prompt = negative_prompts[i2]
-        i2i.prompt = prompt
-        i2i.negative_prompt = negative_prompt
+        return prompts[i1], negative_prompts[i2]
+
+    def i2i_prompts_replace(
+        self, i2i, prompts: list[str], negative_prompts: list[str], j: int
+    ) -> None:
+        i2i.prompt, i2i.negative_prompt = self.prompt_at(prompts, negative_prompts, j)
 
     @staticmethod
     def compare_prompt(extra_params: dict[str, Any], processed, n: int = 0):
@@ -667,12 +798,34 @@ class AfterDetailerScript(scripts.Script):
 
     @staticmethod
     def inpaint_mask_filter(
-        img2img_mask: Image.Image, ad_mask: list[Image.Image]
-    ) -> list[Image.Image]:
-        if ad_mask and img2img_mask.size != ad_mask[0].size:
+        img2img_mask: Image.Image | CropMask, ad_mask: list[CropMask]
+    ) -> list[CropMask]:
+        if not ad_mask:
+            return []
+        if img2img_mask.size != ad_mask[0].size:
+            img2img_mask = ensure_pil_image(img2img_mask, "L")
             img2img_mask = img2img_mask.resize(ad_mask[0].size, resample=Image.LANCZOS)
+        # convert once, has_intersection then only compares bbox windows
+        img2img_mask = to_crop_mask(img2img_mask)
         return [mask for mask in ad_mask if has_intersection(img2img_mask, mask)]
 
+    def get_image_crop_mask(self, p, size: tuple[int, int]) -> CropMask:
+        """
+        The img2img mask resized to `size`. It is computed once and kept on `p`
+        until the mask or the size changes.
+        """
+        # the mask itself is kept, an id could be reused by a new mask
+        cached = getattr(p, "_ad_image_mask", None)
+        if cached is not None and cached[0] is p.image_mask and cached[1] == size:
+            return cached[2]
+
+        mask = self.get_image_mask(p)
+        if mask.size != size:
+            mask = mask.resize(size, resample=Image.LANCZOS)
+        crop = CropMask.from_pil(mask)
+        p._ad_image_mask = (p.image_mask, size, crop)
+        return crop
+
     @staticmethod
     def get_image_mask(p) -> Image.Image:
         mask = p.image_mask
@@ -760,19 +913,58 @@ class AfterDetailerScript(scripts.Script):
         seed, subseed = self.get_seed(p)
         p2.seed = self.get_each_tab_seed(seed, j)
         p2.subseed = self.get_each_tab_seed(subseed, j)
+        bbox = pred.bboxes[j].tolist()
         p2.denoising_strength = self.get_dynamic_denoise_strength(
-            p2.denoising_strength, pred.bboxes[j], pp.image.size
+            p2.denoising_strength, bbox, pp.image.size
         )
 
-        p2.cached_c = [None, None]
-        p2.cached_uc = [None, None]
-
         # Don't override user-defined dimensions.
         if not args.ad_use_inpaint_width_height:
             p2.width, p2.height = self.get_optimal_crop_image_size(
-                p2.width, p2.height, pred.bboxes[j]
+                p2.width, p2.height, bbox
             )
 
+        self.assign_cond_cache(p, p2)
+
+    @staticmethod
+    def assign_cond_cache(p, p2) -> None:
+        """
+        Share the prompt conditioning of `p2` with the other masks and tabs
+        of the current image. Without a cache, start from empty ones.
+        """
+        cache: ConditioningCache | None = getattr(p, "_ad_cond_cache", None)
+        if cache is None:
+            p2.cached_c = [None, None]
+            p2.cached_uc = [None, None]
+            return
+
+        clip_skip = p2.override_settings.get(
+            "CLIP_stop_at_last_layers", opts.data.get("CLIP_stop_at_last_layers", 1)
+        )
+        model_hash = getattr(p2.sd_model, "sd_model_hash", None)
+        cache.assign(p2, p2.steps, clip_skip, model_hash)
+
+    @staticmethod
+    def track_cond_cache(p, p2) -> AbstractContextManager[None]:
+        cache: ConditioningCache | None = getattr(p, "_ad_cond_cache", None)
+        return cache.track(p2) if cache is not None else nullcontext()
+
+    @staticmethod
+    def stage(p, name: str, n: int | None = None) -> AbstractContextManager[None]:
+        "Time the `with` block as stage `name` of tab `n` when timing is enabled."
+        timer: StageTimer | None = getattr(p, "_ad_timer", None)
+        return timer.stage(name, n) if timer is not None else nullcontext()
+
+    @staticmethod
+    def report_timing(p, timer: StageTimer) -> None:
+        "Add the timing of the current image to its infotext, when ad_timing is on."
+        if not timer.totals:
+            return
+        timing_registry.observe(timer)
+        summary = timer.summary()
+        p.extra_generation_params["ADetailer timing"] = summary
+        print(f"[-] ADetailer: image {get_i(p) + 1} timing -- {summary}")
+
     @rich_traceback
     def process(self, p, *args_):
         if getattr(p, "_ad_disabled", False):
@@ -808,7 +1000,13 @@ class AfterDetailerScript(scripts.Script):
         p.extra_generation_params.update(extra_params)
 
     def _postprocess_image_inner(
-        self, p, pp: PPImage, args: ADetailerArgs, *, n: int = 0
+        self,
+        p,
+        pp: PPImage,
+        args: ADetailerArgs,
+        *,
+        n: int = 0,
+        confidence: float | None = None,
     ) -> bool:
         """
         Returns
@@ -822,64 +1020,59 @@ class AfterDetailerScript(scripts.Script):
 
         i = get_i(p)
 
-        i2i = self.get_i2i_p(p, args, pp.image)
+        with self.stage(p, "i2i", n):
+            i2i = self.get_i2i_p(p, args, pp.image)
         ad_prompts, ad_negatives = self.get_prompt(p, args)
 
         is_mediapipe = args.is_mediapipe()
+        with self.stage(p, "detect", n):
+            pred = self.predict(p, args, pp.image, confidence)
+        metrics.inc("detections_total", len(pred), model=args.ad_model)
 
-        if is_mediapipe:
-            pred = mediapipe_predict(args.ad_model, pp.image, args.ad_confidence)
-
-        else:
-            ad_model = self.get_ad_model(args.ad_model)
-            with disable_safe_unpickle():
-                pred = ultralytics_predict(
-                    ad_model,
-                    image=pp.image,
-                    confidence=args.ad_confidence,
-                    device=self.ultralytics_device,
-                    classes=args.ad_model_classes,
-                )
-
-        if pred.preview is None:
+        if len(pred) == 0:
             print(
                 f"[-] ADetailer: nothing detected on image {i + 1} with {ordinal(n + 1)} settings."
             )
             return False
 
-        masks = self.pred_preprocessing(p, pred, args)
-        shared.state.assign_current_image(pred.preview)
+        with self.stage(p, "masks", n):
+            kept, masks = self.pred_preprocessing(p, pred, args)
+        metrics.inc("masks_total", len(masks), model=args.ad_model)
 
-        self.save_image(
-            p,
-            pred.preview,
-            condition="ad_save_previews",
-            suffix="-ad-preview" + suffix(n, "-"),
-        )
+        self.show_preview(p, args, pred, kept, n=n)
 
         steps = len(masks)
         processed = None
-        state.job_count += steps
 
         if is_mediapipe:
             print(f"mediapipe: {steps} detected.")
 
+        if self.use_batch_inpaint(args, masks):
+            prompts = (ad_prompts, ad_negatives)
+            return self._inpaint_batched(
+                p, pp, i2i, args, pred=kept, masks=masks, prompts=prompts, n=n
+            )
+
+        state.job_count += steps
         p2 = copy(i2i)
         for j in range(steps):
-            p2.image_mask = masks[j]
+            p2.image_mask = ensure_pil_image(masks[j], "L")
             p2.init_images[0] = ensure_pil_image(p2.init_images[0], "RGB")
             self.i2i_prompts_replace(p2, ad_prompts, ad_negatives, j)
 
             if re.match(r"^\s*\[SKIP\]\s*$", p2.prompt):
+                metrics.inc("skipped_passes_total", reason="prompt")
                 continue
 
-            self.fix_p2(p, p2, pp, args, pred, j)
+            self.fix_p2(p, p2, pp, args, kept, j)
 
             try:
-                processed = process_images(p2)
+                with self.track_cond_cache(p, p2), self.stage(p, "inpaint", n):
+                    processed = self.inpaint(p2)
             except NansException as e:
                 msg = f"[-] ADetailer: 'NansException' occurred with {ordinal(n + 1)} settings.\n{e}"
                 print(msg, file=sys.stderr)
+                metrics.inc("skipped_passes_total", reason="nan")
                 continue
             finally:
                 p2.close()
@@ -898,11 +1091,243 @@ class AfterDetailerScript(scripts.Script):
 
         return False
 
+    @staticmethod
+    def inpaint(p2) -> Processed:
+        with metrics.time("inpaint_seconds"):
+            processed = process_images(p2)
+        metrics.inc("inpaint_passes_total")
+        return processed
+
+    @staticmethod
+    def live_preview_due() -> bool:
+        "Whether the webui shows live previews now, as in `State.set_current_image`."
+        return (
+            opts.data.get("live_previews_enable", True)
+            and opts.data.get("show_progress_every_n_steps", 10) != -1
+            and getattr(shared, "parallel_processing_allowed", True)
+        )
+
+    def show_preview(
+        self,
+        p,
+        args: ADetailerArgs,
+        pred: PredictOutput,
+        kept: PredictOutput,
+        *,
+        n: int = 0,
+    ) -> None:
+        "Show and save the preview of `pred`, with the masks of `kept` as sidecar."
+        live = self.live_preview_due()
+        save = opts.data.get("ad_save_previews", False)
+        if not live and not save:
+            return
+
+        # the preview is rendered lazily, only when someone needs it
+        with self.stage(p, "preview", n):
+            preview = pred.preview
+
+        if live:
+            shared.state.assign_current_image(preview)
+
+        if save:
+            path = self.save_image(
+                p,
+                preview,
+                condition="ad_save_previews",
+                suffix="-ad-preview" + suffix(n, "-"),
+            )
+            if path and opts.data.get("ad_save_mask_sidecars", False):
+                write_sidecar(path, kept, model=args.ad_model)
+
+    @staticmethod
+    def use_batch_inpaint(args: ADetailerArgs, masks: list[CropMask]) -> bool:
+        return (
+            opts.data.get("ad_batch_inpaint", False)
+            and len(masks) > 1
+            and args.ad_inpaint_only_masked
+            and args.ad_mask_merge_invert == "None"
+            and args.ad_controlnet_model == "None"
+        )
+
+    def plan_batch_inpaint(
+        self,
+        i2i,
+        args: ADetailerArgs,
+        pred: PredictOutput,
+        masks: list[CropMask],
+        prompts: tuple[list[str], list[str]],
+    ) -> list[list[InpaintJob]]:
+        "Split the masks into batches of jobs whose crop regions don't overlap."
+        keys = []
+        for j, mask in enumerate(masks):
+            prompt, _ = self.prompt_at(*prompts, j)
+            if re.match(r"^\s*\[SKIP\]\s*$", prompt):
+                keys.append(None)
+                continue
+
+            bbox = pred.bboxes[j].tolist()
+            width, height = i2i.width, i2i.height
+            if not args.ad_use_inpaint_width_height:
+                width, height = self.get_optimal_crop_image_size(width, height, bbox)
+            denoise = self.get_dynamic_denoise_strength(
+                i2i.denoising_strength, bbox, mask.size
+            )
+            keys.append((width, height, denoise))
+
+        padding = args.ad_inpaint_only_masked_padding + args.ad_mask_blur
+        max_size = int(opts.data.get("ad_batch_inpaint_size", 4))
+        return plan_batches(masks, keys, padding, max_size=max_size)
+
+    def get_batch_i2i_p(
+        self,
+        p,
+        i2i,
+        image: Image.Image,
+        batch: list[InpaintJob],
+        prompts: tuple[list[str], list[str]],
+    ):
+        """
+        img2img processing of the crops of `batch`, with one seed per mask.
+
+        img2img takes a single mask for the whole batch, so every crop is
+        inpainted whole and blended back through its own mask by `paste_back`.
+        """
+        width, height, denoise = batch[0].key
+        seed, subseed = self.get_seed(p)
+        job_prompts = [self.prompt_at(*prompts, job.j) for job in batch]
+
+        p2 = copy(i2i)
+        p2.init_images = [
+            images.resize_image(2, image.crop(job.region), width, height)
+            for job in batch
+        ]
+        p2.image_mask = Image.new("L", (width, height), 255)
+        # the mask is blurred once, when the result is pasted back
+        p2.mask_blur = 0
+        p2.inpaint_full_res = False
+        p2.batch_size = len(batch)
+        p2.width, p2.height = width, height
+        p2.denoising_strength = denoise
+        p2.prompt = [prompt for prompt, _ in job_prompts]
+        p2.negative_prompt = [negative for _, negative in job_prompts]
+        p2.seed = [self.get_each_tab_seed(seed, job.j) for job in batch]
+        p2.subseed = [self.get_each_tab_seed(subseed, job.j) for job in batch]
+        self.assign_cond_cache(p, p2)
+        return p2
+
+    def _inpaint_batched(  # noqa: PLR0913
+        self,
+        p,
+        pp: PPImage,
+        i2i,
+        args: ADetailerArgs,
+        *,
+        pred: PredictOutput,
+        masks: list[CropMask],
+        prompts: tuple[list[str], list[str]],
+        n: int = 0,
+    ) -> bool:
+        """
+        Inpaint the masks whose crop regions don't overlap in one img2img batch,
+        then paste every result back with its own mask.
+
+        Returns
+        -------
+            bool
+
+            `True` if image was processed, `False` otherwise.
+        """
+        image = ensure_pil_image(pp.image, "RGB")
+        batches = self.plan_batch_inpaint(i2i, args, pred, masks, prompts)
+        state.job_count += len(batches)
+
+        is_processed = False
+        for k, batch in enumerate(batches):
+            with self.stage(p, "i2i", n):
+                p2 = self.get_batch_i2i_p(p, i2i, image, batch, prompts)
+            try:
+                with self.track_cond_cache(p, p2), self.stage(p, "inpaint", n):
+                    processed = self.inpaint(p2)
+            except NansException as e:
+                msg = f"[-] ADetailer: 'NansException' occurred with {ordinal(n + 1)} settings.\n{e}"
+                print(msg, file=sys.stderr)
+                metrics.inc("skipped_passes_total", reason="nan")
+                continue
+            finally:
+                p2.close()
+
+            if len(processed.images) < len(batch):
+                skipped = sum(len(b) for b in batches[k:])
+                msg = f"[-] ADetailer: img2img returned {len(processed.images)} of {len(batch)} images, skipping the remaining {skipped} masks with {ordinal(n + 1)} settings."
+                print(msg, file=sys.stderr)
+                metrics.inc("skipped_passes_total", skipped, reason="interrupted")
+                break
+
+            with self.stage(p, "composite", n):
+                for job, result in zip(batch, processed.images):
+                    x1, y1, x2, y2 = job.region
+                    # resized like the webui pastes an "inpaint only masked" result
+                    crop = images.resize_image(1, result, x2 - x1, y2 - y1)
+                    image = paste_back(
+                        image, crop, job.region, masks[job.j], args.ad_mask_blur
+                    )
+            self.compare_prompt(p.extra_generation_params, processed, n=n)
+            is_processed = True
+
+        if is_processed:
+            pp.image = image
+        return is_processed
+
+    @rich_traceback
+    def postprocess_batch_list(self, p, pp: PPBatchList, *args_, **_kwargs):
+        """
+        Detect objects on every image of the batch in a single forward pass.
+        The results are used by the first tab in `postprocess_image`.
+        """
+        p._ad_detections = {}
+        if (
+            getattr(p, "_ad_disabled", False)
+            or not opts.data.get("ad_batch_detection", True)
+            or len(pp.images) <= 1
+            or is_skip_img2img(p)
+            or getattr(p, "restore_faces", False)
+            or not self.is_ad_enabled(*args_)
+        ):
+            return
+
+        arg_list = self.get_args(p, *args_)
+        args = next((arg for arg in arg_list if not arg.need_skip()), None)
+        if args is None or args.is_mediapipe():
+            return
+
+        self.configure_model_cache()
+        images = samples_to_pil(pp.images)
+        confidence = self.detection_confidence(args, arg_list)
+        ad_model = self.get_ad_model(args.ad_model)
+        timer = metrics.time("batch_detection_seconds", model=args.ad_model)
+        with disable_safe_unpickle(), timer:
+            preds = ultralytics_predict_batch(
+                ad_model,
+                images=images,
+                confidence=confidence,
+                device=self.ultralytics_device,
+                classes=args.ad_model_classes,
+            )
+
+        p._ad_detections = {
+            self.detection_key(args, image): (confidence, pred)
+            for image, pred in zip(images, preds)
+        }
+
     @rich_traceback
     def postprocess_image(self, p, pp: PPImage, *args_):
+        # the infotext of the previous image is written, its timing is not ours
+        p.extra_generation_params.pop("ADetailer timing", None)
         if getattr(p, "_ad_disabled", False) or not self.is_ad_enabled(*args_):
             return
 
+        start = metrics.clock()
+        self.configure_model_cache()
         pp.image = self.get_i2i_init_image(p, pp)
         pp.image = ensure_pil_image(pp.image, "RGB")
         init_image = copy(pp.image)
@@ -915,17 +1340,37 @@ class AfterDetailerScript(scripts.Script):
                 p.scripts.postprocess(copy(p), dummy)
 
         is_processed = False
-        with CNHijackRestore(), pause_total_tqdm(), cn_allow_script_control():
-            for n, args in enumerate(arg_list):
-                if args.need_skip():
-                    continue
-                is_processed |= self._postprocess_image_inner(p, pp, args, n=n)
+        p._ad_cond_cache = cond_cache = ConditioningCache()
+        p._ad_timer = timer = StageTimer(enabled=opts.data.get("ad_timing", False))
+        try:
+            with CNHijackRestore(), pause_total_tqdm(), cn_allow_script_control():
+                for n, args in enumerate(arg_list):
+                    if args.need_skip():
+                        continue
+                    confidence = self.detection_confidence(args, arg_list)
+                    is_processed |= self._postprocess_image_inner(
+                        p, pp, args, n=n, confidence=confidence
+                    )
+        finally:
+            # the cached conditionings are tensors, don't keep them after this image
+            del p._ad_cond_cache
+
+        metrics.inc("cond_cache_hits_total", cond_cache.hits)
+        metrics.inc("cond_cache_misses_total", cond_cache.misses)
+        if cond_cache.hits + cond_cache.misses > 0:
+            print(
+                f"[-] ADetailer: prompt conditioning cache -- {cond_cache.hits} hits, {cond_cache.misses} misses"
+            )
 
         if is_processed and not is_skip_img2img(p):
             self.save_image(
                 p, init_image, condition="ad_save_images_before", suffix="-ad-before"
             )
 
+        self.report_timing(p, timer)
+        metrics.inc("images_total")
+        metrics.observe("image_seconds", metrics.clock() - start)
+
         if need_call_process(p):
             with preserve_prompts(p):
                 copy_p = copy(p)
@@ -945,6 +1390,168 @@ def on_after_component(component, **_kwargs):
         img2img_submit_button = component
 
 
+def on_model_loaded(_sd_model):
+    # called after the new checkpoint is in memory, there is no earlier hook
+    if not shared.opts.data.get("ad_model_cache_release_on_checkpoint_change", True):
+        return
+    if len(model_cache) > 0:
+        clear_model_cache()
+        devices.torch_gc()
+
+
+def refresh_models() -> dict[str, str]:
+    "Check huggingface for the default models, update the manifest and the model list."
+    models = resolve_models(
+        *DEFAULT_MODELS, manifest=model_manifest, check_remote=not no_huggingface
+    )
+    # the dropdowns are already built, they only show these after a rescan
+    new = [name for name in models if name not in model_mapping]
+    model_mapping.update(models)
+    if new:
+        print(
+            f"[-] ADetailer: downloaded {', '.join(new)}. Press \U0001f504 next to the detector or reload the UI to list them."
+        )
+    return models
+
+
+def rescan_models(*, full: bool = False) -> list[str]:
+    "Scan the model directories again. `full` lists every directory, changed or not."
+    if full:
+        scan_index.clear()
+    dirs = shared.opts.data.get("ad_extra_models_dir", "")
+    models = get_models(
+        adetailer_dir,
+        *dirs.split("|"),
+        huggingface=not no_huggingface,
+        manifest=model_manifest,
+        index=scan_index,
+    )
+    scan_index.save()
+    # never empty, a generation or an api call may be looking a model up
+    model_mapping.update(models)
+    for name in [name for name in model_mapping if name not in models]:
+        model_mapping.pop(name, None)
+    return list(models)
+
+
+def detect_images(req: DetectRequest) -> list[dict[str, Any]]:
+    "Run the detection and the mask filters of `req`, without the SD model."
+    if req.ad_model not in model_mapping:
+        msg = f"[-] ADetailer: Model {req.ad_model!r} not found."
+        raise HTTPException(status_code=404, detail=msg)
+    try:
+        images = [decode_image(data) for data in req.images]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    timer = metrics.time("batch_detection_seconds", model=req.ad_model)
+    with disable_safe_unpickle(), timer:
+        results = detect(
+            images,
+            req,
+            model_path=model_mapping[req.ad_model],
+            device=AfterDetailerScript.get_ultralytics_device(),
+        )
+
+    for result in results:
+        metrics.inc("detections_total", len(result.pred), model=req.ad_model)
+        metrics.inc("masks_total", len(result.masks), model=req.ad_model)
+    return [result.to_json(req.mask_format) for result in results]
+
+
+def preload_models(
+    names: list[str] | None = None, size: int = WARMUP_SIZE, classes: str = ""
+) -> list[WarmupResult]:
+    """
+    Load the detection models `names` into the cache and run a dummy inference
+    with each of them. `None` warms up the models of the `ad_preload_models` option.
+    Empty `classes` uses the `ad_preload_model_classes` option for YOLO-World models.
+    """
+    if names is None:
+        names = shared.opts.data.get("ad_preload_models", [])
+    if not classes:
+        classes = shared.opts.data.get("ad_preload_model_classes", "")
+    missing = [name for name in names if name not in model_mapping]
+    if missing:
+        print(f"[-] ADetailer: skipping the warm up of unknown models {missing!r}")
+        names = [name for name in names if name in model_mapping]
+
+    AfterDetailerScript.configure_model_cache()
+    n_yolo = sum(not name.lower().startswith("mediapipe") for name in names)
+    if n_yolo > model_cache.max_entries:
+        print(
+            f"[-] ADetailer: preloading {n_yolo} models, but only {model_cache.max_entries} are kept loaded."
+        )
+
+    models = {name: model_mapping[name] for name in names}
+    with disable_safe_unpickle():
+        results = warmup(
+            models,
+            device=AfterDetailerScript.get_ultralytics_device(),
+            size=size,
+            classes=classes,
+        )
+
+    for result in results:
+        if result.error:
+            print(f"[-] ADetailer: failed to warm up {result.model}: {result.error}")
+            continue
+        metrics.observe("warmup_seconds", result.total, model=result.model)
+        print(
+            f"[-] ADetailer: warmed up {result.model} -- load {format_seconds(result.load)}, first inference {format_seconds(result.inference)}"
+        )
+    return results
+
+
+def warmup_models(req: WarmupRequest) -> list[dict[str, Any]]:
+    missing = [name for name in req.models if name not in model_mapping]
+    if missing:
+        msg = f"[-] ADetailer: Model(s) {missing!r} not found."
+        raise HTTPException(status_code=404, detail=msg)
+    results = preload_models(req.models or None, size=req.size, classes=req.classes)
+    return [result.to_json() for result in results]
+
+
+def start_preload(*_args) -> None:
+    if not shared.opts.data.get("ad_preload_models", []):
+        return
+    thread = threading.Thread(
+        target=preload_models, name="adetailer-preload", daemon=True
+    )
+    thread.start()
+
+
+def metrics_response(fmt: str):
+    if fmt == "prometheus":
+        return PlainTextResponse(
+            metrics.to_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE
+        )
+    return metrics.snapshot()
+
+
+def collect_metrics():
+    "Counters kept outside of `metrics`, read when the metrics are exported."
+    yield "model_cache_hits_total", {}, model_cache.hits
+    yield "model_cache_misses_total", {}, model_cache.misses
+    for stage, item in timing_registry.snapshot().items():
+        yield "stage_seconds_total", {"stage": stage}, item["seconds"]
+        yield "stage_calls_total", {"stage": stage}, item["count"]
+
+
+def start_model_refresh(*_args) -> None:
+    if no_huggingface or not shared.opts.data.get("ad_refresh_models_on_startup", True):
+        return
+    thread = threading.Thread(
+        target=refresh_models, name="adetailer-model-refresh", daemon=True
+    )
+    thread.start()
+
+
+def on_script_unloaded():
+    close_detectors()
+    clear_model_cache()
+
+
 def on_ui_settings():
     section = ("ADetailer", ADETAILER)
     shared.opts.add_option(
@@ -970,6 +1577,17 @@ def on_ui_settings():
         .needs_reload_ui(),
     )
 
+    shared.opts.add_option(
+        "ad_refresh_models_on_startup",
+        shared.OptionInfo(
+            default=True,
+            label="Check huggingface for updated default models in the background after startup",
+            section=section,
+        ).info(
+            "models downloaded this way are listed after pressing \U0001f504 next to the detector or reloading the UI"
+        ),
+    )
+
     shared.opts.add_option(
         "ad_save_images_dir",
         shared.OptionInfo(
@@ -985,6 +1603,24 @@ def on_ui_settings():
         shared.OptionInfo(default=False, label="Save mask previews", section=section),
     )
 
+    shared.opts.add_option(
+        "ad_save_mask_sidecars",
+        shared.OptionInfo(
+            default=False,
+            label="Save the detected masks as RLE json next to the mask previews",
+            section=section,
+        ),
+    )
+
+    shared.opts.add_option(
+        "ad_timing",
+        shared.OptionInfo(
+            default=False,
+            label="Log the time spent in each stage and add it to the infotext",
+            section=section,
+        ),
+    )
+
     shared.opts.add_option(
         "ad_save_images_before",
         shared.OptionInfo(
@@ -1037,6 +1673,95 @@ def on_ui_settings():
         ),
     )
 
+    shared.opts.add_option(
+        "ad_batch_detection",
+        shared.OptionInfo(
+            default=True,
+            label="Detect objects on all images of a batch at once",
+            section=section,
+        ).info("used by the first tab only"),
+    )
+
+    shared.opts.add_option(
+        "ad_batch_inpaint",
+        shared.OptionInfo(
+            default=False,
+            label="Inpaint non-overlapping masks together in one img2img batch",
+            section=section,
+        ).info(
+            "approximate: each crop is inpainted whole and blended back through its own mask, results can differ slightly from one by one inpainting; only with 'Inpaint only masked', no mask merge and no ControlNet model"
+        ),
+    )
+
+    shared.opts.add_option(
+        "ad_batch_inpaint_size",
+        shared.OptionInfo(
+            default=4,
+            label="Max number of masks inpainted in one batch",
+            component=gr.Slider,
+            component_args={"minimum": 2, "maximum": 16, "step": 1},
+            section=section,
+        ),
+    )
+
+    shared.opts.add_option(
+        "ad_model_cache_size",
+        shared.OptionInfo(
+            default=2,
+            label="Number of detection models to keep loaded",
+            component=gr.Slider,
+            component_args={"minimum": 0, "maximum": 10, "step": 1},
+            section=section,
+        ).info("0 = load the model from disk on every detection"),
+    )
+
+    shared.opts.add_option(
+        "ad_preload_models",
+        shared.OptionInfo(
+            default=[],
+            label="Detection models to load and warm up on startup",
+            component=gr.Dropdown,
+            component_args=lambda: {
+                "choices": list(model_mapping),
+                "multiselect": True,
+            },
+            section=section,
+        ),
+    )
+
+    shared.opts.add_option(
+        "ad_preload_model_classes",
+        shared.OptionInfo(
+            default="",
+            label="Classes of the YOLO-World models to warm up",
+            component=gr.Textbox,
+            section=section,
+        ).info(
+            "same as 'ADetailer detector classes', a YOLO-World model warmed up with other classes is not reused"
+        ),
+    )
+
+    shared.opts.add_option(
+        "ad_model_cache_max_mb",
+        shared.OptionInfo(
+            default=0,
+            label="Memory budget for loaded detection models (MB)",
+            component=gr.Number,
+            section=section,
+        ).info("0 = no limit"),
+    )
+
+    shared.opts.add_option(
+        "ad_model_cache_release_on_checkpoint_change",
+        shared.OptionInfo(
+            default=True,
+            label="Release loaded detection models after the stable diffusion checkpoint changes",
+            section=section,
+        ).info(
+            "the webui has no hook before a checkpoint loads, so they are released once the new checkpoint is loaded"
+        ),
+    )
+
     shared.opts.add_option(
         "ad_dynamic_denoise_power",
         shared.OptionInfo(
@@ -1213,8 +1938,34 @@ def add_api_endpoints(_: gr.Blocks, app: FastAPI):
     async def ad_model():
         return {"ad_model": list(model_mapping)}
 
+    @app.post("/adetailer/v1/refresh_models")
+    def refresh():
+        refresh_models()
+        return {"ad_model": list(model_mapping)}
+
+    @app.post("/adetailer/v1/rescan_models")
+    def rescan(full: bool = True):
+        return {"ad_model": rescan_models(full=full)}
+
+    @app.post("/adetailer/v1/detect")
+    def detect_(req: DetectRequest):
+        return {"results": detect_images(req)}
+
+    @app.post("/adetailer/v1/warmup")
+    def warmup_(req: WarmupRequest):
+        return {"warmup": warmup_models(req)}
+
+    @app.get("/adetailer/v1/metrics")
+    def get_metrics(format: Literal["json", "prometheus"] = "json"):  # noqa: A002
+        return metrics_response(format)
+
 
+metrics.set_collector("adetailer", collect_metrics)
 script_callbacks.on_ui_settings(on_ui_settings)
 script_callbacks.on_after_component(on_after_component)
 script_callbacks.on_app_started(add_api_endpoints)
+script_callbacks.on_app_started(start_model_refresh)
+script_callbacks.on_app_started(start_preload)
 script_callbacks.on_before_ui(on_before_ui)
+script_callbacks.on_model_loaded(on_model_loaded)
+script_callbacks.on_script_unloaded(on_script_unloaded)
@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from adetailer.cache import LRUCache, ModelHashCache, ObjectPool
+
+
+def test_lru_cache_hit_and_miss():
+    cache = LRUCache(max_entries=2)
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return object()
+
+    a = cache.get("a", factory)
+    assert cache.get("a", factory) is a
+    assert len(calls) == 1
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.get("a", lambda: 1)
+    cache.get("b", lambda: 2)
+    cache.get("a", lambda: 1)
+    cache.get("c", lambda: 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+
+
+def test_lru_cache_max_bytes():
+    cache = LRUCache(max_entries=10, max_bytes=10, sizeof=lambda v: v)
+    cache.get("a", lambda: 4)
+    cache.get("b", lambda: 4)
+    assert len(cache) == 2
+
+    cache.get("c", lambda: 4)
+    assert "a" not in cache
+    assert cache.nbytes == 8
+
+    cache.get("d", lambda: 100)
+    assert len(cache) == 1
+    assert "d" in cache
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(max_entries=0)
+    assert cache.get("a", lambda: 1) == 1
+    assert len(cache) == 0
+
+
+def test_lru_cache_configure_and_evict():
+    cache = LRUCache(max_entries=3)
+    for key in ("a", "b", "c"):
+        cache.get(key, lambda: 0)
+
+    cache.configure(max_entries=2)
+    assert len(cache) == 2
+    assert "a" not in cache
+
+    assert cache.evict(lambda key: key == "b") == ["b"]
+    assert len(cache) == 1
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lru_cache_thread_safe():
+    cache = LRUCache(max_entries=4)
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return object()
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: cache.get("a", factory), range(64)))
+
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+
+
+class Detector:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs) -> ObjectPool[str, Detector]:
+    return ObjectPool(close=Detector.close, **kwargs)
+
+
+def test_object_pool_reuse():
+    pool = make_pool(max_idle=2)
+    with pool.acquire("a", Detector) as d1:
+        pass
+    with pool.acquire("a", Detector) as d2:
+        assert "a" not in pool
+    assert d1 is d2
+    assert not d1.closed
+    assert pool.created == 1
+    assert pool.reused == 1
+    assert "a" in pool
+
+
+def test_object_pool_exclusive():
+    pool = make_pool(max_idle=2)
+    with pool.acquire("a", Detector) as d1, pool.acquire("a", Detector) as d2:
+        assert d1 is not d2
+    assert len(pool) == 2
+
+    with pool.acquire("a", Detector), pool.acquire("a", Detector):
+        pass
+    assert pool.created == 2
+
+
+def test_object_pool_max_idle_and_keys():
+    pool = make_pool(max_idle=1, max_keys=2)
+    with pool.acquire("a", Detector) as d1, pool.acquire("a", Detector) as d2:
+        pass
+    assert len(pool) == 1
+    assert d1.closed != d2.closed
+
+    with pool.acquire("b", Detector), pool.acquire("c", Detector):
+        pass
+    assert "a" not in pool
+    assert "b" in pool
+    assert "c" in pool
+
+
+def test_object_pool_evict_and_clear():
+    pool = make_pool()
+    with pool.acquire("a", Detector) as a, pool.acquire("b", Detector) as b:
+        pass
+
+    assert pool.evict(lambda key: key == "a") == ["a"]
+    assert a.closed
+    assert not b.closed
+
+    with pool.acquire("c", Detector) as c:
+        pool.clear()
+        assert b.closed
+    assert c.closed
+    assert len(pool) == 0
+
+
+def test_object_pool_close_on_error():
+    pool = make_pool()
+    with pytest.raises(RuntimeError), pool.acquire("a", Detector) as d:
+        raise RuntimeError
+    assert d.closed
+    assert len(pool) == 0
+
+
+def test_object_pool_thread_safe():
+    pool = make_pool(max_idle=8)
+
+    def work(_):
+        with pool.acquire("a", Detector) as d:
+            assert not d.closed
+            return d
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(work, range(64)))
+
+    assert pool.created == len({id(d) for d in results})
+    assert pool.created + pool.reused == 64
+
+
+def test_lru_cache_use_is_exclusive():
+    cache = LRUCache(max_entries=2)
+    active = []
+    overlaps = []
+
+    def work(_):
+        with cache.use("a", object) as value:
+            active.append(value)
+            overlaps.append(len(active))
+            active.remove(value)
+            return value
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(work, range(64)))
+
+    assert max(overlaps) == 1
+    assert all(r is results[0] for r in results)
+    assert cache._key_locks == {}
+
+
+def test_lru_cache_use_other_keys_concurrently():
+    cache = LRUCache(max_entries=2)
+    with cache.use("a", lambda: 1) as a, cache.use("b", lambda: 2) as b:
+        assert (a, b) == (1, 2)
+        assert len(cache._key_locks) == 2
+    assert cache._key_locks == {}
+
+
+def test_lru_cache_factory_does_not_block_other_keys():
+    cache = LRUCache(max_entries=2)
+    cache.get("b", lambda: 2)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 1
+
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(cache.get, "a", slow)
+        assert started.wait(5)
+        # a hit on another key while "a" is being created
+        assert cache.get("b", lambda: 3) == 2
+        release.set()
+        assert future.result() == 1
+
+
+def test_lru_cache_concurrent_misses_create_once():
+    cache = LRUCache(max_entries=2)
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.01)
+        return object()
+
+    with ThreadPoolExecutor(8) as executor:
+        values = list(executor.map(lambda _: cache.get("a", factory), range(8)))
+
+    assert len(calls) == 1
+    assert all(v is values[0] for v in values)
+    assert cache.misses == 1
+    assert cache._key_locks == {}
+
+
+@pytest.fixture
+def model_file(tmp_path: Path) -> Path:
+    path = tmp_path / "control_v11p_sd15_inpaint.pth"
+    path.write_bytes(b"model")
+    return path
+
+
+class CountingHash:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path: Path) -> str:
+        self.calls += 1
+        return f"{path.read_bytes().hex()}-{self.calls}"
+
+
+def test_model_hash_cache_reuses_unchanged(tmp_path: Path, model_file: Path):
+    cache = ModelHashCache(tmp_path / "hashes.json")
+    compute = CountingHash()
+
+    value = cache.get(model_file, compute)
+    assert cache.get(model_file, compute) == value
+    assert compute.calls == 1
+    assert cache.changed
+
+
+def test_model_hash_cache_recomputes_changed(tmp_path: Path, model_file: Path):
+    cache = ModelHashCache(tmp_path / "hashes.json")
+    compute = CountingHash()
+    first = cache.get(model_file, compute)
+
+    # same size, newer mtime
+    st = model_file.stat()
+    os.utime(model_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    second = cache.get(model_file, compute)
+    assert second != first
+    assert compute.calls == 2
+
+    # new size, same mtime
+    st = model_file.stat()
+    model_file.write_bytes(b"a larger model")
+    os.utime(model_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+    third = cache.get(model_file, compute)
+    assert third.startswith(b"a larger model".hex())
+    assert compute.calls == 3
+
+
+def test_model_hash_cache_roundtrip(tmp_path: Path, model_file: Path):
+    path = tmp_path / "hashes.json"
+    cache = ModelHashCache.load(path)
+    assert cache.hashes == {}
+    compute = CountingHash()
+    value = cache.get(model_file, compute)
+    cache.save()
+    assert not cache.changed
+
+    loaded = ModelHashCache.load(path)
+    assert loaded.get(model_file, compute) == value
+    assert compute.calls == 1
+    assert not loaded.changed
+
+
+def test_model_hash_cache_bad_file(tmp_path: Path, capsys):
+    assert ModelHashCache.load(tmp_path / "missing.json").hashes == {}
+    assert capsys.readouterr().out == ""
+
+    path = tmp_path / "hashes.json"
+    path.write_text("not json")
+    assert ModelHashCache.load(path).hashes == {}
+    assert "Failed to read model hash cache" in capsys.readouterr().out
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from adetailer import PredictOutput, cli
+from adetailer.args import DetectArgs
+from adetailer.common import create_mask_from_bbox
+from adetailer.detect import postprocess
+from adetailer.rle import decode
+
+SIZE = (64, 48)
+BBOXES = [[4, 4, 20, 20], [30, 10, 60, 40]]
+
+
+def fake_detect(images, args, model_path="", device=""):
+    return [
+        postprocess(
+            PredictOutput(
+                bboxes=BBOXES,
+                masks=create_mask_from_bbox(BBOXES, image.size),
+                confidences=[0.9, 0.8],
+                image_size=image.size,
+            ),
+            args,
+        )
+        for image in images
+    ]
+
+
+@pytest.fixture
+def images(tmp_path: Path) -> Path:
+    root = tmp_path / "images"
+    (root / "sub").mkdir(parents=True)
+    for name in ["a.png", "b.jpg", "sub/c.png"]:
+        Image.new("RGB", SIZE).save(root / name)
+    (root / "notes.txt").write_text("not an image")
+    return root
+
+
+def read_jsonl(path: Path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def run(root: Path, output: Path, **kwargs):
+    args = DetectArgs(ad_model="face_yolov8n.pt", ad_dilate_erode=0)
+    return cli.run(
+        root, output, args, model_path="face_yolov8n.pt", workers=0, **kwargs
+    )
+
+
+def test_run(monkeypatch, images: Path, tmp_path: Path):
+    monkeypatch.setattr(cli, "detect", fake_detect)
+    output = tmp_path / "out.jsonl"
+    masks_dir = tmp_path / "masks"
+
+    assert run(images, output, batch_size=2, masks_dir=masks_dir) == (3, 0)
+
+    records = read_jsonl(output)
+    assert sorted(r["path"] for r in records) == ["a.png", "b.jpg", "sub/c.png"]
+    record = next(r for r in records if r["path"] == "sub/c.png")
+    assert record["bboxes"] == BBOXES
+    assert record["mask_files"] == ["sub/c-0.png", "sub/c-1.png"]
+    mask = Image.open(masks_dir / "sub/c-1.png")
+    assert (decode(record["masks"][1]) == mask).all()
+
+
+def test_resume(monkeypatch, images: Path, tmp_path: Path):
+    monkeypatch.setattr(cli, "detect", fake_detect)
+    output = tmp_path / "out.jsonl"
+    # one finished record, one failed record and a line cut by an interruption
+    output.write_text(
+        json.dumps({"path": "a.png", "bboxes": []})
+        + "\n"
+        + json.dumps({"path": "b.jpg", "error": "OSError"})
+        + '\n{"path": "sub/c.pn'
+    )
+
+    assert run(images, output) == (2, 0)
+    records = read_jsonl(output)
+    # the failed record is replaced by the new one
+    assert sorted(r["path"] for r in records) == ["a.png", "b.jpg", "sub/c.png"]
+    assert all("error" not in r for r in records)
+
+    assert run(images, output) == (0, 0)
+    assert run(images, output, resume=False) == (3, 0)
+    assert len(read_jsonl(output)) == 3
+
+
+def test_run_inside_input(monkeypatch, images: Path):
+    monkeypatch.setattr(cli, "detect", fake_detect)
+    output = images / "out.jsonl"
+    masks_dir = images / "masks"
+
+    assert run(images, output, masks_dir=masks_dir) == (3, 0)
+    assert (masks_dir / "a-0.png").is_file()
+    # the saved masks are not images to process
+    assert run(images, output, masks_dir=masks_dir, resume=False) == (3, 0)
+    assert masks_dir / "a-0.png" in cli.find_images(images)
+    assert masks_dir / "a-0.png" not in cli.find_images(images, [masks_dir])
+
+
+def test_broken_image(monkeypatch, images: Path, tmp_path: Path):
+    monkeypatch.setattr(cli, "detect", fake_detect)
+    (images / "broken.png").write_bytes(b"not a png")
+    output = tmp_path / "out.jsonl"
+
+    assert run(images, output, batch_size=8) == (4, 1)
+    broken = next(r for r in read_jsonl(output) if r["path"] == "broken.png")
+    assert broken["error"].startswith("UnidentifiedImageError")
+    assert "broken.png" not in cli.read_done(output)
+
+
+def test_main_process_pool(images: Path, tmp_path: Path):
+    output = tmp_path / "out.jsonl"
+    argv = [str(images), "-o", str(output), "-m", "mediapipe_face_full", "-j", "2"]
+    assert cli.main(argv) == 0
+
+    records = read_jsonl(output)
+    assert len(records) == 3
+    assert all(r["bboxes"] == [] and r["image_size"] == list(SIZE) for r in records)
+
+
+def test_main_errors(tmp_path: Path):
+    assert cli.main([str(tmp_path / "missing")]) == 2
+    assert cli.main([str(tmp_path), "-m", "no_such_model.pt"]) == 2
+
+
+def test_main_invalid_args(tmp_path: Path, capsys):
+    with pytest.raises(SystemExit) as e:
+        cli.main([str(tmp_path), "--confidence", "2"])
+    assert e.value.code == 2
+    assert "ad_confidence" in capsys.readouterr().err
@@ -1,7 +1,11 @@
 import numpy as np
 from PIL import Image, ImageDraw
 
-from adetailer.common import create_bbox_from_mask, create_mask_from_bbox
+from adetailer.common import (
+    PredictOutput,
+    create_bbox_from_mask,
+    create_mask_from_bbox,
+)
 
 
 def test_create_mask_from_bbox():
@@ -67,3 +71,57 @@ def test_create_bbox_from_mask():
 
     result = create_bbox_from_mask([mask], (256, 256))
     assert result[0] == [38, 38, 166, 166]
+
+
+def test_predict_output_lazy_preview():
+    calls = []
+
+    def render():
+        calls.append(1)
+        return Image.new("RGB", (10, 10))
+
+    pred = PredictOutput(
+        bboxes=[[0, 0, 5, 5]], image_size=(10, 10), render_preview=render
+    )
+    assert not calls
+
+    assert pred.preview is not None
+    assert pred.preview.size == (10, 10)
+    assert len(calls) == 1
+
+    pred.preview = None
+    assert pred.preview is None
+    assert len(calls) == 1
+
+
+def test_predict_output_empty_preview():
+    assert PredictOutput().preview is None
+
+
+def test_predict_output_select():
+    rendered = []
+
+    def render(indices=None):
+        rendered.append(indices)
+        return Image.new("RGB", (10, 10))
+
+    pred = PredictOutput(
+        bboxes=[[0, 0, 1, 1], [1, 1, 2, 2], [2, 2, 3, 3]],
+        masks=["a", "b", "c"],
+        confidences=[0.1, 0.5, 0.9],
+        image_size=(10, 10),
+        render_preview=render,
+    )
+    selected = pred.select([2, 0])
+    assert selected.bboxes.tolist() == [[2, 2, 3, 3], [0, 0, 1, 1]]
+    assert selected.masks == ["c", "a"]
+    assert selected.confidences.tolist() == [0.9, 0.1]
+    assert selected.image_size == (10, 10)
+    assert pred.bboxes.tolist() == [[0, 0, 1, 1], [1, 1, 2, 2], [2, 2, 3, 3]]
+
+    again = selected.select([1])
+    assert again.bboxes.tolist() == [[0, 0, 1, 1]]
+
+    assert again.preview is not None
+    assert selected.preview is not None
+    assert rendered == [[0], [2, 0]]
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import cv2
+import numpy as np
+import pytest
+from hypothesis import given, settings
+from hypothesis import strategies as st
+from PIL import Image, ImageDraw
+
+from adetailer.crop_mask import CropMask, to_crop_mask
+from adetailer.mask import (
+    dilate_erode,
+    dilate_erode_many,
+    has_intersection,
+    is_all_black,
+    mask_invert,
+    mask_merge,
+    offset,
+)
+
+
+def make_mask(size: tuple[int, int], *rects: tuple[int, int, int, int]) -> Image.Image:
+    img = Image.new("L", size, color="black")
+    draw = ImageDraw.Draw(img)
+    for rect in rects:
+        draw.rectangle(rect, fill="white")
+    return img
+
+
+rects = st.tuples(
+    st.integers(-5, 40), st.integers(-5, 40), st.integers(0, 40), st.integers(0, 40)
+).map(lambda r: (r[0], r[1], r[0] + r[2], r[1] + r[3]))
+
+
+def test_from_pil():
+    img = make_mask((10, 10), (2, 3, 5, 6))
+    mask = CropMask.from_pil(img)
+
+    assert mask.size == (10, 10)
+    assert mask.bbox == (2, 3, 6, 7)
+    assert mask.array.shape == (4, 4)
+    assert mask.getbbox() == img.getbbox()
+    assert np.array_equal(np.array(mask), np.array(img))
+    assert np.array_equal(np.array(mask.to_pil()), np.array(img))
+
+
+def test_empty():
+    mask = CropMask.from_pil(Image.new("L", (10, 10)))
+    assert mask.getbbox() is None
+    assert is_all_black(mask)
+    assert np.array_equal(mask.to_array(), np.zeros((10, 10), dtype=np.uint8))
+
+
+def test_window():
+    mask = CropMask(np.full((2, 2), 255, dtype=np.uint8), 3, 3, (10, 10))
+    window = mask.window(2, 2, 5, 4)
+    expect = np.array([[0, 0, 0], [0, 255, 255]], dtype=np.uint8)
+    assert np.array_equal(window, expect)
+
+
+def test_to_crop_mask():
+    arr = np.zeros((10, 10), dtype=np.uint8)
+    arr[4:6, 5:7] = 255
+    mask = to_crop_mask(arr)
+    assert mask.bbox == (5, 4, 7, 6)
+    assert to_crop_mask(mask) is mask
+
+
+@settings(deadline=None)
+@given(rect=rects, value=st.integers(-8, 8))
+def test_dilate_erode_same_as_full_frame(rect: tuple[int, int, int, int], value: int):
+    img = make_mask((32, 24), rect)
+    expect = np.array(img)
+    if value != 0:
+        k = abs(value)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (k, k))
+        op = cv2.dilate if value > 0 else cv2.erode
+        expect = op(expect, kernel, iterations=1)
+
+    result = dilate_erode(CropMask.from_pil(img), value)
+    assert isinstance(result, CropMask)
+    assert np.array_equal(np.array(result), expect)
+    assert np.array_equal(np.array(dilate_erode(img, value)), expect)
+
+
+@settings(deadline=None)
+@given(rects=st.lists(rects, max_size=6), value=st.integers(-8, 8))
+def test_dilate_erode_many_same_as_each(
+    rects: list[tuple[int, int, int, int]], value: int
+):
+    masks = [CropMask.from_pil(make_mask((32, 24), rect)) for rect in rects]
+    result = dilate_erode_many(masks, value)
+    assert len(result) == len(masks)
+    for mask, res in zip(masks, result):
+        assert np.array_equal(np.array(res), np.array(dilate_erode(mask, value)))
+
+
+@settings(deadline=None)
+@given(rect=rects, x=st.integers(-40, 40), y=st.integers(-40, 40))
+def test_offset_same_as_full_frame(rect: tuple[int, int, int, int], x: int, y: int):
+    img = make_mask((32, 24), rect)
+    result = offset(CropMask.from_pil(img), x, y)
+    assert np.array_equal(np.array(result), np.array(offset(img, x, y)))
+
+
+@settings(deadline=None)
+@given(rect1=rects, rect2=rects)
+def test_has_intersection_and_merge_same_as_full_frame(
+    rect1: tuple[int, int, int, int], rect2: tuple[int, int, int, int]
+):
+    img1 = make_mask((32, 24), rect1)
+    img2 = make_mask((32, 24), rect2)
+    m1, m2 = CropMask.from_pil(img1), CropMask.from_pil(img2)
+
+    assert has_intersection(m1, m2) == has_intersection(img1, img2)
+    assert has_intersection(img1, m2) == has_intersection(img1, img2)
+
+    merged = mask_merge([m1, m2])
+    assert np.array_equal(np.array(merged[0]), np.array(mask_merge([img1, img2])[0]))
+
+    inverted = mask_invert([m1])
+    assert np.array_equal(np.array(inverted[0]), np.array(mask_invert([img1])[0]))
+
+
+@settings(deadline=None)
+@given(rect1=rects, rect2=rects)
+def test_has_intersection_same_as_pixel_and(
+    rect1: tuple[int, int, int, int], rect2: tuple[int, int, int, int]
+):
+    img1 = make_mask((32, 24), rect1)
+    img2 = make_mask((32, 24), rect2)
+    expect = bool(np.logical_and(np.array(img1), np.array(img2)).any())
+    assert has_intersection(img1, img2) == expect
+
+
+def test_merge_different_size():
+    m1 = CropMask.from_pil(make_mask((10, 10), (1, 1, 2, 2)))
+    m2 = CropMask.from_pil(make_mask((20, 20), (1, 1, 2, 2)))
+    with pytest.raises(ValueError, match="Sizes of masks do not match"):
+        mask_merge([m1, m2])
+
+
+points = st.lists(
+    st.tuples(st.integers(-20, 60), st.integers(-20, 60)), min_size=1, max_size=8
+)
+
+
+@settings(deadline=None)
+@given(polygons=st.lists(points, min_size=1, max_size=3))
+def test_from_polygons_same_as_full_frame(polygons: list[list[tuple[int, int]]]):
+    polys = [np.array(poly, dtype=np.int32) for poly in polygons]
+    expect = np.zeros((24, 32), dtype=np.uint8)
+    cv2.fillPoly(expect, polys, 255)
+
+    mask = CropMask.from_polygons(polys, (32, 24))
+    assert mask.size == (32, 24)
+    assert np.array_equal(mask.to_array(), expect)
+    assert mask.bbox == (mask.getbbox() or (0, 0, 0, 0))
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import base64
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from adetailer import PredictOutput
+from adetailer import detect as detect_module
+from adetailer.args import DetectArgs, DetectRequest
+from adetailer.common import create_mask_from_bbox
+from adetailer.detect import Detection, decode_image, detect, postprocess
+from adetailer.rle import decode
+
+SIZE = (64, 48)
+BBOXES = [[2, 2, 12, 10], [20, 10, 50, 40], [30, 5, 34, 9]]
+CONFIDENCES = [0.9, 0.5, 0.7]
+
+
+def make_pred() -> PredictOutput[float]:
+    masks = create_mask_from_bbox(BBOXES, SIZE)
+    return PredictOutput(
+        bboxes=BBOXES, masks=masks, confidences=CONFIDENCES, image_size=SIZE
+    )
+
+
+def png_base64(image: Image.Image) -> str:
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def test_postprocess():
+    args = DetectArgs(
+        ad_model="face_yolov8n.pt",
+        ad_mask_k=2,
+        ad_dilate_erode=0,
+        ad_bbox_sortby="Position (left to right)",
+    )
+    result = postprocess(make_pred(), args)
+
+    # the 2 largest, sorted left to right
+    assert result.pred.bboxes.tolist() == [BBOXES[0], BBOXES[1]]
+    assert result.pred.confidences.tolist() == [0.9, 0.5]
+    assert len(result.masks) == 2
+    assert result.masks[0].getbbox() == make_pred().masks[0].getbbox()
+
+
+def test_postprocess_merge():
+    args = DetectArgs(
+        ad_model="face_yolov8n.pt", ad_dilate_erode=0, ad_mask_merge_invert="Merge"
+    )
+    result = postprocess(make_pred(), args)
+    assert len(result.pred) == 3
+    assert len(result.masks) == 1
+
+
+@pytest.mark.parametrize("mask_format", ["rle", "png", "none"])
+def test_to_json(mask_format):
+    mask = create_mask_from_bbox([BBOXES[1]], SIZE)[0]
+    pred = PredictOutput(
+        bboxes=[BBOXES[1]], masks=[mask], confidences=[0.5], image_size=SIZE
+    )
+    out = Detection(pred, [mask]).to_json(mask_format)
+
+    assert out["image_size"] == list(SIZE)
+    assert out["bboxes"] == [BBOXES[1]]
+    assert out["confidences"] == [0.5]
+    if mask_format == "rle":
+        assert np.array_equal(decode(out["masks"][0]), mask.to_array())
+    elif mask_format == "png":
+        png = Image.open(io.BytesIO(base64.b64decode(out["masks"][0])))
+        assert np.array_equal(np.asarray(png), mask.to_array())
+    else:
+        assert "masks" not in out
+
+
+def test_detect_batches_ultralytics(monkeypatch):
+    calls = []
+
+    def fake_predict_batch(model_path, images, **kwargs):
+        calls.append((model_path, len(images), kwargs))
+        return [make_pred() for _ in images]
+
+    monkeypatch.setattr(detect_module, "ultralytics_predict_batch", fake_predict_batch)
+    args = DetectArgs(ad_model="face_yolov8n.pt", ad_confidence=0.4, ad_mask_k=1)
+    images = [Image.new("RGB", SIZE)] * 3
+    results = detect(images, args, model_path="face_yolov8n.pt", device="cpu")
+
+    assert len(calls) == 1
+    assert calls[0] == (
+        "face_yolov8n.pt",
+        3,
+        {"confidence": 0.4, "device": "cpu", "classes": ""},
+    )
+    assert [len(result.pred) for result in results] == [1, 1, 1]
+
+
+def test_decode_image():
+    image = Image.new("RGBA", SIZE, (10, 20, 30, 255))
+    data = png_base64(image)
+
+    decoded = decode_image(data)
+    assert decoded.mode == "RGB"
+    assert decoded.size == SIZE
+    assert decoded.getpixel((0, 0)) == (10, 20, 30)
+
+    assert decode_image("data:image/png;base64," + data).size == SIZE
+
+    with pytest.raises(ValueError, match="Invalid base64 image"):
+        decode_image("not an image")
+
+
+def test_detect_request():
+    req = DetectRequest(
+        ad_model="face_yolov8n.pt",
+        images=["abc"],
+        ad_bbox_sortby="Area (large to small)",
+    )
+    assert req.bbox_sort_order() == 3
+    assert req.mask_format == "rle"
+
+    with pytest.raises(ValueError, match="must be one of"):
+        DetectRequest(ad_model="face_yolov8n.pt", images=[], ad_bbox_sortby="Size")
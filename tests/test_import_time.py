@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+
+# modules the webui imports when loading the extension
+EXTENSION_MODULES = [
+    "adetailer",
+    "adetailer.crop_mask",
+    "adetailer.detect",
+    "adetailer.inpaint",
+    "adetailer.mask",
+    "adetailer.mediapipe",
+    "adetailer.opts",
+    "adetailer.ultralytics",
+    "adetailer.warmup",
+]
+HEAVY_MODULES = ["cv2", "mediapipe", "torch", "torchvision", "ultralytics"]
+
+# microseconds spent in the extension's own modules, excluding dependencies.
+# about 20 times the usual cost, to only catch an expensive import-time addition
+IMPORT_BUDGET_US = 300_000
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess[str]:
+    return subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True, check=True
+    )
+
+
+def self_import_times(stderr: str) -> dict[str, int]:
+    "Parse the `-X importtime` output into {module: self time in us}."
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        if self_us.strip().isdigit():
+            times[name.strip()] = int(self_us)
+    return times
+
+
+def own_import_time() -> dict[str, int]:
+    "Self import time of the extension's modules in a fresh interpreter."
+    code = "\n".join(f"import {name}" for name in EXTENSION_MODULES)
+    stderr = run_python("-X", "importtime", "-c", code).stderr
+    return {
+        name: us
+        for name, us in self_import_times(stderr).items()
+        if name == "adetailer" or name.startswith("adetailer.")
+    }
+
+
+def test_heavy_modules_not_imported():
+    code = (
+        "import sys\n"
+        f"for name in {EXTENSION_MODULES!r}:\n"
+        "    __import__(name)\n"
+        f"print(*sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    loaded = run_python("-c", code).stdout.split()
+    assert loaded == []
+
+
+def test_lazy_attribute():
+    code = (
+        "import sys, adetailer\n"
+        "adetailer.ultralytics_predict\n"
+        "print('adetailer.ultralytics' in sys.modules)\n"
+    )
+    assert run_python("-c", code).stdout.strip() == "True"
+
+
+def test_import_time_budget():
+    # the best of a few runs, a busy machine only makes a run slower
+    runs = [own_import_time() for _ in range(3)]
+    assert all(runs), "no import time recorded"
+    best = min(runs, key=lambda own: sum(own.values()))
+    assert sum(best.values()) < IMPORT_BUDGET_US, sorted(
+        best.items(), key=lambda x: -x[1]
+    )
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import numpy as np
+from hypothesis import given, settings
+from hypothesis import strategies as st
+from PIL import Image
+
+from adetailer.crop_mask import CropMask
+from adetailer.inpaint import (
+    crop_region,
+    expand_crop_region,
+    group_regions,
+    paste_back,
+    plan_batches,
+    regions_overlap,
+)
+from adetailer.mask import mask_preprocess
+
+
+def make_mask(size: tuple[int, int], x1: int, y1: int, x2: int, y2: int) -> CropMask:
+    arr = np.full((y2 - y1, x2 - x1), 255, dtype=np.uint8)
+    return CropMask(arr, x1, y1, size)
+
+
+def test_crop_region():
+    mask = make_mask((512, 512), 100, 100, 150, 200)
+    region = crop_region(mask, 10, 512, 512)
+    assert region == (65, 90, 185, 210)
+
+    assert crop_region(CropMask.empty((512, 512)), 10, 512, 512) is None
+
+
+def test_crop_region_aspect_ratio():
+    mask = make_mask((1024, 512), 0, 0, 100, 20)
+    x1, y1, x2, y2 = crop_region(mask, 0, 512, 256)
+    assert (x1, y1) == (0, 0)
+    assert (x2 - x1) / (y2 - y1) == 2
+
+
+def test_expand_crop_region_stays_in_image():
+    assert expand_crop_region((0, 480, 100, 512), 512, 512, 512, 512) == (
+        0,
+        412,
+        100,
+        512,
+    )
+
+
+def test_group_regions():
+    regions = [
+        (0, 0, 10, 10),
+        (20, 0, 30, 10),
+        (5, 5, 15, 15),  # overlaps 0
+        (40, 0, 50, 10),
+        (25, 5, 35, 15),  # overlaps 1
+    ]
+    assert group_regions(regions) == [[0, 1, 3], [2, 4]]
+    assert group_regions(regions, max_size=2) == [[0, 1], [2, 3], [4]]
+
+
+def test_group_regions_keys():
+    regions = [(0, 0, 10, 10), (20, 0, 30, 10), (40, 0, 50, 10)]
+    keys = ["a", "b", "a"]
+    assert group_regions(regions, keys) == [[0, 2], [1]]
+
+
+def test_group_regions_keeps_order_of_overlapping():
+    regions = [
+        (0, 0, 10, 10),
+        (5, 0, 15, 10),  # overlaps 0
+        (100, 0, 110, 10),
+        (105, 0, 115, 10),  # overlaps 2
+        (12, 0, 20, 10),  # overlaps 1, must come after it
+    ]
+    groups = group_regions(regions)
+    assert groups == [[0, 2], [1, 3], [4]]
+
+
+boxes = st.tuples(
+    st.integers(0, 90), st.integers(0, 90), st.integers(1, 30), st.integers(1, 30)
+).map(lambda b: (b[0], b[1], b[0] + b[2], b[1] + b[3]))
+
+
+@settings(deadline=None)
+@given(
+    regions=st.lists(boxes, max_size=12),
+    keys=st.lists(st.integers(0, 1), min_size=12, max_size=12),
+    max_size=st.integers(1, 5),
+)
+def test_group_regions_properties(regions, keys, max_size):
+    groups = group_regions(regions, keys[: len(regions)], max_size=max_size)
+    assert sorted(i for group in groups for i in group) == list(range(len(regions)))
+
+    group_of = {i: g for g, group in enumerate(groups) for i in group}
+    for group in groups:
+        assert len(group) <= max_size
+        assert len({keys[i] for i in group}) == 1
+
+    for i in range(len(regions)):
+        for j in range(i + 1, len(regions)):
+            if regions_overlap(regions[i], regions[j]):
+                assert group_of[i] < group_of[j]
+
+
+def test_plan_batches_separate_detections():
+    # four faces of different sizes, as detected with bbox masks
+    size = (1024, 1024)
+    bboxes = [
+        (40, 60, 150, 190),
+        (600, 80, 687, 171),
+        (90, 600, 301, 845),
+        (700, 650, 790, 771),
+    ]
+    masks = mask_preprocess(
+        [make_mask(size, *bbox) for bbox in bboxes], kernel=4, x_offset=3
+    )
+    keys = [(512, 512, 0.4)] * len(masks)
+
+    batches = plan_batches(masks, keys, padding=32 + 4)
+    assert [[job.j for job in batch] for batch in batches] == [[0, 1, 2, 3]]
+
+    keys[1] = None
+    keys[2] = (512, 768, 0.4)
+    batches = plan_batches(masks, keys, padding=36)
+    assert [[job.j for job in batch] for batch in batches] == [[0, 3], [2]]
+    assert batches[1][0].region == crop_region(masks[2], 36, 512, 768)
+
+
+def test_paste_back():
+    image = Image.new("RGB", (64, 64), "black")
+    result = Image.new("RGB", (32, 32), "white")
+    mask = make_mask((64, 64), 10, 10, 20, 20)
+
+    out = paste_back(image, result, (0, 0, 32, 32), mask)
+    arr = np.array(out)
+    assert out.size == (64, 64)
+    assert (arr[10:20, 10:20] == 255).all()
+    assert arr.sum() == 10 * 10 * 3 * 255
+    assert np.array(image).sum() == 0
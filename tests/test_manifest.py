@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from adetailer import common
+from adetailer.common import resolve_models
+from adetailer.manifest import ModelManifest
+
+
+@pytest.fixture
+def model_file(tmp_path: Path) -> Path:
+    path = tmp_path / "face_yolov8n.pt"
+    path.write_bytes(b"model")
+    return path
+
+
+def test_manifest_roundtrip(tmp_path: Path, model_file: Path):
+    manifest = ModelManifest.load(tmp_path / "manifest.json")
+    assert manifest.entries == {}
+
+    assert manifest.update("face_yolov8n.pt", str(model_file))
+    assert not manifest.update("face_yolov8n.pt", str(model_file))
+    manifest.save()
+
+    loaded = ModelManifest.load(tmp_path / "manifest.json")
+    entry = loaded.entries["face_yolov8n.pt"]
+    assert entry.path == str(model_file)
+    assert entry.size == 5
+    assert entry.sha256 == hashlib.sha256(b"model").hexdigest()
+    assert loaded.resolve("face_yolov8n.pt") == str(model_file)
+    assert loaded.resolve("hand_yolov8n.pt") is None
+
+
+def test_manifest_resolve_changed_file(tmp_path: Path, model_file: Path):
+    manifest = ModelManifest(tmp_path / "manifest.json")
+    manifest.update("face_yolov8n.pt", str(model_file))
+
+    model_file.write_bytes(b"another model")
+    assert manifest.resolve("face_yolov8n.pt") is None
+
+    model_file.unlink()
+    assert manifest.resolve("face_yolov8n.pt") is None
+
+
+def test_manifest_broken_file(tmp_path: Path):
+    path = tmp_path / "manifest.json"
+    path.write_text("{not json")
+    assert ModelManifest.load(path).entries == {}
+
+
+def test_resolve_models_trusts_manifest(
+    tmp_path: Path, model_file: Path, monkeypatch: pytest.MonkeyPatch
+):
+    manifest = ModelManifest(tmp_path / "manifest.json")
+    manifest.update("face_yolov8n.pt", str(model_file))
+
+    looked_up = []
+
+    def download_models(*names, check_remote=True):
+        looked_up.extend(names)
+        return dict.fromkeys(names, "INVALID")
+
+    monkeypatch.setattr(common, "download_models", download_models)
+    models = resolve_models("face_yolov8n.pt", "hand_yolov8n.pt", manifest=manifest)
+    assert models == {"face_yolov8n.pt": str(model_file)}
+    assert looked_up == ["hand_yolov8n.pt"]
+    assert not (tmp_path / "manifest.json").exists()
@@ -1,16 +1,26 @@
 import cv2
 import numpy as np
 import pytest
-from PIL import Image, ImageDraw
+from hypothesis import given, settings
+from hypothesis import strategies as st
+from PIL import Image, ImageChops, ImageDraw
 
+from adetailer.common import PredictOutput
+from adetailer.crop_mask import CropMask
 from adetailer.mask import (
     bbox_area,
     dilate_erode,
+    filter_and_sort,
+    filter_by_confidence,
+    filter_by_ratio,
+    filter_k_by,
     has_intersection,
     is_all_black,
     mask_invert,
     mask_merge,
+    mask_preprocess,
     offset,
+    sort_bboxes,
 )
 
 
@@ -234,3 +244,128 @@ def test_mask_invert():
     draw.rectangle((3, 3, 5, 5), fill="black")
 
     assert np.array_equal(np.array(inverted[0]), np.array(expect))
+
+
+def test_filter_by_confidence():
+    pred = PredictOutput(
+        bboxes=[[0, 0, 1, 1], [1, 1, 2, 2], [2, 2, 3, 3]],
+        masks=["a", "b", "c"],
+        confidences=[0.3, 0.5, 0.9],
+    )
+    result = filter_by_confidence(pred, 0.3)
+    assert result is not pred
+    assert result.bboxes.tolist() == [[1, 1, 2, 2], [2, 2, 3, 3]]
+    assert result.masks == ["b", "c"]
+    assert result.confidences.tolist() == [0.5, 0.9]
+    assert len(pred.bboxes) == 3
+
+    assert len(filter_by_confidence(pred, 0.95)) == 0
+
+
+def test_sort_bboxes_reorders_confidences():
+    pred = PredictOutput(
+        bboxes=[[5, 0, 6, 1], [0, 0, 1, 1], [2, 0, 3, 1]],
+        masks=["a", "b", "c"],
+        confidences=[0.1, 0.2, 0.3],
+        image_size=(10, 10),
+    )
+    result = sort_bboxes(pred, 1)  # left to right
+    assert result.masks == ["b", "c", "a"]
+    assert result.confidences.tolist() == [0.2, 0.3, 0.1]
+    assert pred.masks == ["a", "b", "c"]
+
+
+boxes = st.tuples(
+    st.integers(0, 60), st.integers(0, 60), st.integers(1, 40), st.integers(1, 40)
+).map(lambda b: [b[0], b[1], b[0] + b[2], b[1] + b[3]])
+
+
+@settings(deadline=None)
+@given(
+    bboxes=st.lists(boxes, max_size=12),
+    confidences=st.lists(st.floats(0, 1), min_size=12, max_size=12),
+    low=st.floats(0, 0.2),
+    high=st.floats(0.05, 1),
+    k=st.integers(0, 5),
+    by=st.sampled_from(["Area", "Confidence"]),
+    order=st.integers(0, 3),
+)
+def test_filter_and_sort_same_as_chain(  # noqa: PLR0913, PLR0917
+    bboxes, confidences, low, high, k, by, order
+):
+    pred = PredictOutput(
+        bboxes=bboxes,
+        masks=list(range(len(bboxes))),
+        confidences=confidences[: len(bboxes)],
+        image_size=(100, 80),
+    )
+    expect = filter_by_ratio(pred, low, high)
+    expect = filter_k_by(expect, k=k, by=by)
+    expect = sort_bboxes(expect, order)
+
+    result = filter_and_sort(pred, low=low, high=high, k=k, by=by, order=order)
+    assert result.masks == expect.masks
+    assert np.array_equal(result.bboxes, expect.bboxes)
+    assert np.array_equal(result.confidences, expect.confidences)
+
+
+def full_frame_preprocess(
+    masks: list[Image.Image], kernel: int, x: int, y: int, mode: int
+) -> list[Image.Image]:
+    "mask_preprocess done step by step on full-frame images, as it used to be."
+    if x != 0 or y != 0:
+        masks = [ImageChops.offset(m, x, -y) for m in masks]
+    if kernel != 0:
+        k = abs(kernel)
+        op = cv2.dilate if kernel > 0 else cv2.erode
+        element = cv2.getStructuringElement(cv2.MORPH_RECT, (k, k))
+        masks = [Image.fromarray(op(np.array(m), element)) for m in masks]
+        masks = [m for m in masks if np.array(m).any()]
+    if mode != 0 and masks:
+        merged = np.bitwise_or.reduce([np.array(m) for m in masks])
+        if mode == 2:
+            merged = 255 - merged
+        masks = [Image.fromarray(merged)]
+    return masks
+
+
+mask_rects = st.tuples(
+    st.integers(-5, 40), st.integers(-5, 30), st.integers(0, 20), st.integers(0, 20)
+).map(lambda r: (r[0], r[1], r[0] + r[2], r[1] + r[3]))
+
+
+@settings(deadline=None)
+@given(
+    rects=st.lists(mask_rects, max_size=5),
+    kernel=st.integers(-6, 6),
+    x=st.integers(-40, 40),
+    y=st.integers(-30, 30),
+    mode=st.integers(0, 2),
+)
+def test_mask_preprocess_same_as_full_frame(
+    rects: list[tuple[int, int, int, int]], kernel: int, x: int, y: int, mode: int
+):
+    images = []
+    for rect in rects:
+        img = Image.new("L", (32, 24))
+        ImageDraw.Draw(img).rectangle(rect, fill=255)
+        images.append(img)
+    expect = [np.array(m) for m in full_frame_preprocess(images, kernel, x, y, mode)]
+
+    crops = mask_preprocess(
+        [CropMask.from_pil(m) for m in images],
+        kernel=kernel,
+        x_offset=x,
+        y_offset=y,
+        merge_invert=mode,
+    )
+    assert all(isinstance(m, CropMask) for m in crops)
+    assert len(crops) == len(expect)
+    assert all(np.array_equal(a.to_array(), b) for a, b in zip(crops, expect))
+
+    pils = mask_preprocess(
+        images, kernel=kernel, x_offset=x, y_offset=y, merge_invert=mode
+    )
+    assert all(isinstance(m, Image.Image) for m in pils)
+    assert len(pils) == len(expect)
+    assert all(np.array_equal(np.array(a), b) for a, b in zip(pils, expect))
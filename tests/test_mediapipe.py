@@ -1,7 +1,10 @@
+from types import SimpleNamespace
+
+import numpy as np
 import pytest
 from PIL import Image
 
-from adetailer.mediapipe import mediapipe_predict
+from adetailer.mediapipe import detector_pool, landmarks_to_points, mediapipe_predict
 
 
 @pytest.mark.parametrize(
@@ -20,3 +23,25 @@ def test_mediapipe(sample_image2: Image.Image, model_name: str):
         assert len(result.masks) > 0
         assert len(result.confidences) > 0
         assert len(result.bboxes) == len(result.masks) == len(result.confidences)
+
+
+def test_mediapipe_reuse_detector():
+    image = Image.new("RGB", (256, 256), "white")
+    detector_pool.clear()
+    created = detector_pool.created
+    for _ in range(3):
+        mediapipe_predict("mediapipe_face_mesh", image)
+    assert detector_pool.created == created + 1
+
+
+def test_landmarks_to_points():
+    lands = [SimpleNamespace(x=i / 10, y=1 - i / 10) for i in range(5)]
+    landmarks = SimpleNamespace(landmark=lands)
+
+    points = landmarks_to_points(landmarks, (100, 50))
+    expect = np.array([[land.x * 100, land.y * 50] for land in lands], dtype=int)
+    assert points.shape == (5, 2)
+    assert np.array_equal(points, expect)
+
+    points = landmarks_to_points(landmarks, (100, 50), np.array([3, 1]))
+    assert np.array_equal(points, expect[[3, 1]])
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import threading
+
+import pytest
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from adetailer.metrics import Histogram, Metrics
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_counters():
+    metrics = Metrics()
+    metrics.inc("detections_total", 3, model="face_yolov8n.pt")
+    metrics.inc("detections_total", 2, model="face_yolov8n.pt")
+    metrics.inc("detections_total", model="hand_yolov8n.pt")
+    metrics.inc("images_total")
+
+    counters = metrics.snapshot()["counters"]
+    assert counters["detections_total"] == [
+        {"labels": {"model": "face_yolov8n.pt"}, "value": 5},
+        {"labels": {"model": "hand_yolov8n.pt"}, "value": 1},
+    ]
+    assert counters["images_total"] == [{"labels": {}, "value": 1}]
+
+
+def test_time():
+    clock = FakeClock()
+    metrics = Metrics(buckets=(0.1, 1.0), clock=clock)
+    with metrics.time("detection_seconds", model="a"):
+        clock.now += 0.05
+    with metrics.time("detection_seconds", model="a"):
+        clock.now += 0.5
+
+    hist = metrics.snapshot()["histograms"]["detection_seconds"][0]
+    assert hist["labels"] == {"model": "a"}
+    assert hist["buckets"] == {"0.1": 1, "1.0": 2, "+Inf": 2}
+    assert hist["sum"] == pytest.approx(0.55)
+    assert hist["count"] == 2
+
+
+def test_time_not_observed_on_error():
+    metrics = Metrics()
+
+    def fail():
+        with metrics.time("inpaint_seconds"):
+            raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        fail()
+    assert metrics.snapshot()["histograms"] == {}
+
+
+@settings(deadline=None)
+@given(values=st.lists(st.floats(0, 100, allow_nan=False)))
+def test_histogram_cumulative(values: list[float]):
+    hist = Histogram(buckets=(0.1, 1.0, 10.0))
+    for value in values:
+        hist.observe(value)
+
+    cumulative = hist.cumulative()
+    for bound, count in cumulative:
+        assert count == sum(v <= bound for v in values)
+    assert cumulative[-1][1] == hist.count == len(values)
+
+
+def test_collectors():
+    metrics = Metrics()
+    hits = [0]
+    metrics.set_collector("cache", lambda: [("model_cache_hits_total", {}, hits[0])])
+    hits[0] = 4
+    metrics.inc("model_cache_hits_total", 1)
+
+    counters = metrics.snapshot()["counters"]
+    assert counters["model_cache_hits_total"] == [{"labels": {}, "value": 5}]
+
+    # a collector registered again with the same key replaces the old one
+    metrics.set_collector("cache", list)
+    metrics.reset()
+    assert metrics.snapshot()["counters"] == {}
+
+
+def test_to_prometheus():
+    clock = FakeClock()
+    metrics = Metrics(buckets=(0.5,), clock=clock)
+    metrics.inc("skipped_passes_total", reason="nan")
+    metrics.inc("images_total", 2)
+    with metrics.time("inpaint_seconds"):
+        clock.now += 0.25
+
+    assert metrics.to_prometheus().splitlines() == [
+        "# HELP adetailer_images_total Images processed by ADetailer.",
+        "# TYPE adetailer_images_total counter",
+        "adetailer_images_total 2",
+        "# HELP adetailer_skipped_passes_total Inpaint passes skipped, per reason.",
+        "# TYPE adetailer_skipped_passes_total counter",
+        'adetailer_skipped_passes_total{reason="nan"} 1',
+        "# HELP adetailer_inpaint_seconds Time of one inpaint pass.",
+        "# TYPE adetailer_inpaint_seconds histogram",
+        'adetailer_inpaint_seconds_bucket{le="0.5"} 1',
+        'adetailer_inpaint_seconds_bucket{le="+Inf"} 1',
+        "adetailer_inpaint_seconds_sum 0.25",
+        "adetailer_inpaint_seconds_count 1",
+    ]
+
+
+def test_to_prometheus_escapes_labels():
+    metrics = Metrics()
+    metrics.inc("detections_total", model='a "b"\\c')
+    assert 'adetailer_detections_total{model="a \\"b\\"\\\\c"} 1' in (
+        metrics.to_prometheus()
+    )
+    assert Metrics().to_prometheus() == ""
+
+
+def test_thread_safe():
+    metrics = Metrics()
+
+    def work():
+        for _ in range(1000):
+            metrics.inc("masks_total")
+            metrics.observe("inpaint_seconds", 0.1)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["masks_total"][0]["value"] == 8000
+    assert snapshot["histograms"]["inpaint_seconds"][0]["count"] == 8000
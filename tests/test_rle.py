@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import json
+
+import numpy as np
+import pytest
+from hypothesis import given, settings
+from hypothesis import strategies as st
+from hypothesis.extra.numpy import arrays
+
+from adetailer.common import PredictOutput
+from adetailer.crop_mask import CropMask
+from adetailer.rle import (
+    area,
+    counts_to_string,
+    decode,
+    decode_crop_mask,
+    encode,
+    string_to_counts,
+    write_sidecar,
+)
+
+masks = arrays(
+    np.uint8,
+    st.tuples(st.integers(1, 24), st.integers(1, 24)),
+    elements=st.sampled_from([0, 255]),
+)
+
+
+def test_encode_known():
+    mask = np.zeros((5, 4), dtype=np.uint8)
+    mask[1:3, 1:3] = 255
+    rle = encode(mask)
+    assert rle["size"] == [5, 4]
+    assert string_to_counts(rle["counts"]) == [6, 2, 3, 2, 7]
+    assert area(rle) == 4
+
+
+@settings(deadline=None)
+@given(counts=st.lists(st.integers(0, 10**6), max_size=20))
+def test_counts_string_roundtrip(counts: list[int]):
+    assert string_to_counts(counts_to_string(counts)) == counts
+
+
+@settings(deadline=None)
+@given(mask=masks)
+def test_roundtrip(mask: np.ndarray):
+    rle = encode(mask)
+    assert np.array_equal(decode(rle), mask)
+    assert area(rle) == np.count_nonzero(mask)
+    assert np.array_equal(decode_crop_mask(rle).to_array(), mask)
+
+
+@settings(deadline=None)
+@given(mask=masks)
+def test_crop_mask_same_as_full_frame(mask: np.ndarray):
+    crop = CropMask.from_array(mask)
+    assert encode(crop) == encode(mask)
+    assert encode(crop.to_pil()) == encode(mask)
+
+
+def test_decode_wrong_size():
+    with pytest.raises(ValueError, match="RLE counts"):
+        decode({"size": [2, 2], "counts": [1, 2]})
+
+
+def test_same_as_pycocotools():
+    mask_util = pytest.importorskip("pycocotools.mask")
+    rng = np.random.default_rng(0)
+    mask = (rng.random((40, 30)) > 0.7).astype(np.uint8) * 255
+    expect = mask_util.encode(np.asfortranarray(mask > 0, dtype=np.uint8))
+    assert encode(mask)["counts"] == expect["counts"].decode()
+
+
+def test_write_sidecar(tmp_path):
+    mask = np.zeros((10, 10), dtype=np.uint8)
+    mask[2:5, 3:6] = 255
+    pred = PredictOutput(
+        bboxes=[[3, 2, 6, 5]],
+        masks=[CropMask.from_array(mask)],
+        confidences=[0.9],
+        image_size=(10, 10),
+    )
+    path = write_sidecar(tmp_path / "00001-123.png", pred, model="face_yolov8n.pt")
+    assert path.name == "00001-123.masks.json"
+
+    data = json.loads(path.read_text())
+    assert data["model"] == "face_yolov8n.pt"
+    assert data["image_size"] == [10, 10]
+    (det,) = data["detections"]
+    assert det["bbox"] == [3, 2, 6, 5]
+    assert det["confidence"] == 0.9
+    assert np.array_equal(decode(det["mask"]), mask)
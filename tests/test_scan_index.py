@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from adetailer.common import scan_model_dir
+from adetailer.scan_index import ScanIndex
+
+
+@pytest.fixture
+def model_dir(tmp_path: Path) -> Path:
+    root = tmp_path / "models"
+    (root / "a" / "b").mkdir(parents=True)
+    (root / "c").mkdir()
+    (root / "face.pt").write_bytes(b"")
+    (root / "readme.txt").write_bytes(b"")
+    (root / "a" / "hand.pt").write_bytes(b"")
+    (root / "a" / "b" / "person.pt").write_bytes(b"")
+    return root
+
+
+def names(paths: list[Path]) -> set[str]:
+    return {p.name for p in paths}
+
+
+def touch_dir(path: Path, offset: int) -> None:
+    "Make sure the mtime of `path` differs from the indexed one."
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + offset))
+
+
+def test_scan_same_as_rglob(model_dir: Path):
+    index = ScanIndex()
+    assert names(index.scan(model_dir)) == names(scan_model_dir(model_dir))
+    assert names(scan_model_dir(model_dir, index)) == {
+        "face.pt",
+        "hand.pt",
+        "person.pt",
+    }
+
+
+def test_scan_lists_only_changed_dirs(model_dir: Path, monkeypatch: pytest.MonkeyPatch):
+    index = ScanIndex()
+    index.scan(model_dir)
+    assert index.changed
+
+    listed = []
+    list_dir = index._list_dir
+
+    def spy(path, mtime_ns):
+        listed.append(path)
+        return list_dir(path, mtime_ns)
+
+    monkeypatch.setattr(index, "_list_dir", spy)
+    index.changed = False
+    index.scan(model_dir)
+    assert listed == []
+    assert not index.changed
+
+    (model_dir / "a" / "b" / "new.pt").write_bytes(b"")
+    touch_dir(model_dir / "a" / "b", 1_000_000)
+    assert "new.pt" in names(index.scan(model_dir))
+    assert listed == [model_dir / "a" / "b"]
+
+
+def test_scan_removed_dir(model_dir: Path):
+    index = ScanIndex()
+    index.scan(model_dir)
+
+    (model_dir / "a" / "b" / "person.pt").unlink()
+    (model_dir / "a" / "b").rmdir()
+    touch_dir(model_dir / "a", 1_000_000)
+
+    assert names(index.scan(model_dir)) == {"face.pt", "hand.pt"}
+    assert str(model_dir / "a" / "b") not in index.dirs
+
+
+def test_scan_index_persist(model_dir: Path, tmp_path: Path):
+    path = tmp_path / "scan_index.json"
+    index = ScanIndex(path)
+    index.scan(model_dir)
+    index.save()
+    assert not index.changed
+
+    loaded = ScanIndex.load(path)
+    assert loaded.dirs == index.dirs
+    assert ScanIndex.load(path, suffixes=(".safetensors",)).dirs == {}
+
+    loaded.clear()
+    assert loaded.dirs == {}
+    assert loaded.changed
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import pytest
+
+from adetailer.timing import StageTimer, TimingRegistry, format_seconds
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_stage_timer():
+    clock = FakeClock()
+    timer = StageTimer(clock=clock)
+    with timer.stage("detect", 0):
+        clock.now += 0.05
+    with timer.stage("inpaint", 0):
+        clock.now += 1.5
+    with timer.stage("detect", 1):
+        clock.now += 0.02
+    with timer.stage("save"):
+        clock.now += 0.1
+
+    assert timer.by_stage() == pytest.approx(
+        {"detect": 0.07, "inpaint": 1.5, "save": 0.1}
+    )
+    assert timer.by_tab() == pytest.approx({0: 1.55, 1: 0.02})
+    assert timer.total() == pytest.approx(1.67)
+    assert timer.counts[("detect", 0)] == 1
+    assert timer.summary() == (
+        "detect 70ms, inpaint 1.50s, save 100ms (total 1.67s; tab 1 1.55s, tab 2 20ms)"
+    )
+
+
+def test_stage_timer_records_on_error():
+    clock = FakeClock()
+    timer = StageTimer(clock=clock)
+
+    def fail():
+        with timer.stage("inpaint", 0):
+            clock.now += 0.3
+            raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        fail()
+    assert timer.by_stage() == pytest.approx({"inpaint": 0.3})
+
+
+def test_disabled_timer():
+    timer = StageTimer(enabled=False)
+    assert timer.stage("detect", 0) is timer.stage("masks", 1)
+    with timer.stage("detect", 0):
+        pass
+    assert timer.totals == {}
+
+
+def test_format_seconds():
+    assert format_seconds(0.0004) == "0ms"
+    assert format_seconds(0.25) == "250ms"
+    assert format_seconds(12.345) == "12.35s"
+
+
+def test_registry():
+    registry = TimingRegistry()
+    for _ in range(2):
+        timer = StageTimer()
+        timer.add("detect", 0.1, 0)
+        timer.add("detect", 0.2, 1)
+        registry.observe(timer)
+    registry.observe(StageTimer())
+
+    assert registry.images == 2
+    snapshot = registry.snapshot()
+    assert snapshot["detect"]["count"] == 4
+    assert snapshot["detect"]["seconds"] == pytest.approx(0.6)
+
+    registry.reset()
+    assert registry.images == 0
+    assert registry.snapshot() == {}
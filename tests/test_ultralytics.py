@@ -1,8 +1,15 @@
+import numpy as np
 import pytest
+import torch
 from huggingface_hub import hf_hub_download
 from PIL import Image
 
-from adetailer.ultralytics import ultralytics_predict
+from adetailer.ultralytics import (
+    mask_to_crop_mask,
+    mask_to_pil,
+    ultralytics_predict,
+    ultralytics_predict_batch,
+)
 
 
 @pytest.mark.parametrize(
@@ -60,3 +67,37 @@ def test_yolo_world(sample_image2: Image.Image, klass: str):
     assert len(result.masks) > 0
     assert len(result.confidences) > 0
     assert len(result.bboxes) == len(result.masks) == len(result.confidences)
+
+
+def test_ultralytics_predict_batch(
+    sample_image: Image.Image, sample_image2: Image.Image
+):
+    model_path = hf_hub_download("Bingsu/adetailer", "face_yolov8n.pt")
+    images = [sample_image, sample_image2, sample_image]
+    results = ultralytics_predict_batch(model_path, images)
+    assert len(results) == len(images)
+    for result in results:
+        assert len(result.bboxes) == len(result.masks) == len(result.confidences)
+
+    single = ultralytics_predict(model_path, sample_image)
+    assert len(results[0].bboxes) == len(single.bboxes)
+    assert np.array_equal(results[0].bboxes, results[2].bboxes)
+
+
+def test_mask_to_pil_removes_letterbox():
+    # 1000x500 image letterboxed into a 640x352 input: 16px padding on top and bottom
+    masks = torch.zeros(3, 352, 640)
+    masks[0, 16 + 50 : 16 + 100, 100:200] = 1
+    masks[2, 16:-16, :] = 1
+
+    images = mask_to_pil(masks, (1000, 500))
+    assert [img.size for img in images] == [(1000, 500)] * 3
+    assert images[0].getbbox() == (156, 78, 312, 156)
+    assert images[1].getbbox() is None
+    assert images[2].getbbox() == (0, 0, 1000, 500)
+
+    crops = mask_to_crop_mask(masks, (1000, 500))
+    for crop, img in zip(crops, images):
+        assert crop.size == (1000, 500)
+        assert crop.getbbox() == img.getbbox()
+        assert np.array_equal(crop.to_array(), np.array(img))
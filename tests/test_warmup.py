@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import pytest
+from PIL import Image
+
+from adetailer import mediapipe as mediapipe_module
+from adetailer import warmup as warmup_module
+from adetailer.args import WarmupRequest
+from adetailer.warmup import WarmupResult, warmup, warmup_model
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def fake_load_model(model_path, device="", classes=""):
+        calls.append(("load", str(model_path), device, classes))
+
+    def fake_predict(model_path, image, device="", classes=""):
+        calls.append(("predict", str(model_path), image.size, classes))
+
+    def fake_mediapipe_predict(model_type, image, confidence=0.3, *, strict=False):
+        assert strict
+        calls.append(("mediapipe", model_type, image.size))
+
+    monkeypatch.setattr(warmup_module, "load_model", fake_load_model)
+    monkeypatch.setattr(warmup_module, "ultralytics_predict", fake_predict)
+    monkeypatch.setattr(warmup_module, "mediapipe_predict", fake_mediapipe_predict)
+    return calls
+
+
+def test_warmup(calls):
+    models = {
+        "face_yolov8n.pt": "/models/face_yolov8n.pt",
+        "mediapipe_face_full": "mediapipe_face_full",
+    }
+    results = warmup(models, device="cpu", size=256)
+
+    assert calls == [
+        ("load", "/models/face_yolov8n.pt", "cpu", ""),
+        ("predict", "/models/face_yolov8n.pt", (256, 256), ""),
+        ("mediapipe", "mediapipe_face_full", (256, 256)),
+    ]
+    assert [result.model for result in results] == list(models)
+    assert all(not result.error for result in results)
+    assert results[1].load == 0.0
+
+
+def test_warmup_classes(calls):
+    models = {"yolov8x-worldv2.pt": "/models/yolov8x-worldv2.pt"}
+    warmup(models, device="cpu", size=64, classes="person,cat")
+    assert calls == [
+        ("load", "/models/yolov8x-worldv2.pt", "cpu", "person,cat"),
+        ("predict", "/models/yolov8x-worldv2.pt", (64, 64), "person,cat"),
+    ]
+
+
+def test_warmup_error(monkeypatch):
+    def fail(*_args, **_kwargs):
+        msg = "no such file"
+        raise FileNotFoundError(msg)
+
+    monkeypatch.setattr(warmup_module, "load_model", fail)
+    result = warmup_model("missing.pt", "/models/missing.pt")
+    assert result.error == "FileNotFoundError: no such file"
+    assert result.inference == 0.0
+
+
+def test_warmup_mediapipe_error(monkeypatch):
+    def fail(*_args, **_kwargs):
+        msg = "no graph"
+        raise RuntimeError(msg)
+
+    monkeypatch.setattr(mediapipe_module, "face_detection_detector", fail)
+    result = warmup_model("mediapipe_face_full", "mediapipe_face_full")
+    assert result.error == "RuntimeError: no graph"
+
+    # outside of the warm up, the errors still give an empty result
+    image = Image.new("RGB", (64, 64))
+    assert len(mediapipe_module.mediapipe_predict("mediapipe_face_full", image)) == 0
+
+
+def test_to_json():
+    result = WarmupResult("face_yolov8n.pt", load=1.5, inference=0.25)
+    assert result.to_json() == {
+        "model": "face_yolov8n.pt",
+        "load": 1.5,
+        "inference": 0.25,
+        "error": "",
+        "total": 1.75,
+    }
+
+
+def test_warmup_request():
+    assert WarmupRequest().models == []
+    assert WarmupRequest().size == 1024
+    assert WarmupRequest().classes == ""
+    with pytest.raises(ValueError, match="size"):
+        WarmupRequest(size=16)